@@ -0,0 +1,113 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List, Tuple
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_question(question: str) -> str:
+    """
+    Normalize a question so trivially different phrasings share a cache entry.
+
+    "  Is the CO2 level safe? " and "is the co2 level safe" normalize to the same text.
+    """
+    question = _WHITESPACE.sub(" ", question.strip().lower())
+    return question.rstrip("?.! ")
+
+
+@dataclass
+class AnswerCacheStats:
+    hits: int = 0
+    misses: int = 0
+    stores: int = 0
+    skipped: int = 0  # answers that were not cacheable, e.g. they used live databot values
+    evictions: int = 0
+    expirations: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hit_rate, 3),
+            "stores": self.stores,
+            "skipped": self.skipped,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
+
+
+@dataclass
+class _CacheEntry:
+    answers: List[str]
+    expires_at: float
+    hits: int = field(default=0)
+
+
+class AnswerCache:
+    """
+    A thread safe TTL/LRU cache of assistant answers, keyed by the assistant fingerprint and the normalized question.
+
+    One cache is meant to be shared by every assistant in the process, so a question answered for one
+    student is answered from the cache for the next.
+
+    :param max_entries: The maximum number of cached answers.  The least recently used answer is evicted first.
+    :param ttl_seconds: How long an answer stays valid
+    """
+
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 24 * 3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.stats = AnswerCacheStats()
+        self._entries: OrderedDict[Tuple[str, str], _CacheEntry] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, fingerprint: str, question: str) -> List[str] | None:
+        """
+        :return: The cached answer texts, or None on a miss
+        """
+        key = (fingerprint, normalize_question(question))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at < time.monotonic():
+                del self._entries[key]
+                self.stats.expirations += 1
+                entry = None
+            if entry is None:
+                self.stats.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            entry.hits += 1
+            self.stats.hits += 1
+            return list(entry.answers)
+
+    def put(self, fingerprint: str, question: str, answers: List[str]):
+        key = (fingerprint, normalize_question(question))
+        with self._lock:
+            self._entries[key] = _CacheEntry(answers=list(answers), expires_at=time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            self.stats.stores += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats.evictions += 1
+
+    def skip(self):
+        """
+        Record an answer that could not be cached.
+        """
+        with self._lock:
+            self.stats.skipped += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
@@ -1,48 +1,49 @@
+from __future__ import annotations
+
 import json
 import logging
+import time
+import uuid
 from contextlib import contextmanager
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Literal
+from typing import TYPE_CHECKING, Iterator, List, Literal
 
-import pandas as pd
-import requests
 import streamlit as st
-from databot.PyDatabot import databot_sensors
 from dotenv import load_dotenv
-from openai.types.beta import AssistantDeleted
-from openai.types.beta.threads import Run
 
-from openai_assistant import OpenAIAssistant, FunctionDefinition, FunctionParameter, AssistantThreadMessage
+from answer_cache import AnswerCache
+from assistant_service import AssistantService, TenantLimitError, TenantLimits
+from conversation_context import ConversationContext
+from databot_sensors import databot_sensors, get_derived_columns
+from doc_index import get_doc_index
+from file_cache import get_file_cache
+from function_tools import FunctionToolRegistry
+from openai_assistant import OpenAIAssistant, FunctionDefinition, FunctionParameter, AssistantThreadMessage, RunEvent
+from rate_limit import get_default_scheduler
+from run_executor import RunHandle
+from tool_output import ToolOutputEncoder
+from tracing import get_tracer
+
+if TYPE_CHECKING:
+    from openai import OpenAI
+    from openai.types.beta import AssistantDeleted
+
+
+# the functions the Databot Assistant can call, registered below with @databot_tools.tool.  The sensor name enums
+# are recomputed when databot_sensors changes, like the instructions.
+databot_tools = FunctionToolRegistry(output_encoder=ToolOutputEncoder(max_bytes=4096, max_points=24),
+                                     definitions_key=lambda: _databot_sensors_key())
 
 
 class DatabotOpenAIAssistant(OpenAIAssistant):
-    def __init__(self, api_key: str = None, log_level: int = logging.WARNING):
-        super().__init__(api_key=api_key, log_level=log_level)
+    def __init__(self, api_key: str = None, log_level: int = logging.WARNING, answer_cache: AnswerCache | None = None,
+                 openai_client: OpenAI | None = None, context: ConversationContext | None = None):
+        super().__init__(api_key=api_key, log_level=log_level, answer_cache=answer_cache,
+                         openai_client=openai_client, context=context, function_tools=databot_tools)
 
     def _get_databot_friendly_names(self) -> List:
-        df = pd.DataFrame(data=databot_sensors.values()).sort_values(by="friendly_name")
-        f_names = df['friendly_name'].to_list()
-        return f_names
-
-    def _get_function_definition(self) -> FunctionDefinition:
-        function_definition = FunctionDefinition(
-            name="get_databot_values",
-            description="""Get sensor values from the databot.  If there are multiple sensor values, a list of sensor names can be provided.
-                            This function can only provide information on the current values from the databot.  
-                            This function CANNOT describe what the sensor is measuring.
-                            """,
-            parameters=[
-                FunctionParameter(
-                    name="sensor_names",
-                    description="""List of the friendly human readable sensor value names.""",
-                    type="array",
-                    required=True,
-                    array_items_type="string",
-                    enum_values=get_databot_friendly_names()
-                )
-            ]
-        )
-        return function_definition
+        return get_databot_friendly_names()
 
     def create_assistant(self, name: str, instructions: str | None = None,
                          tools: List[Literal["retrieval", "code_interpreter", "function"]] = ["retrieval"],
@@ -53,8 +54,6 @@ class DatabotOpenAIAssistant(OpenAIAssistant):
         if instructions is None:
             instructions = assistant_instructions
 
-        self.add_function(self._get_function_definition())
-
         super().create_assistant(name, instructions, tools, model, include_files)
 
     def delete_assistant(self) -> AssistantDeleted:
@@ -62,113 +61,353 @@ class DatabotOpenAIAssistant(OpenAIAssistant):
         return super().delete_assistant()
 
     def get_assistant_instructions(self) -> str:
-        values = databot_sensors.values()
-        system_content = f"""
-        you are an expert on the databot sensor device.
-        
-        When displaying sensor values, include the appropriate units.
-  
-        Use the following dictionary to understand how 'data columns' are associated with a sensor name.
-
-        Databot Sensor Dictionary: 
-        {json.dumps(list(values), indent=2)} 
-
-        The 'friendly_name' is what humans will call the sensor value. 
-        
-        The 'data_columns' will be the list of values associated with the sensor name.  
-        
-        All 'data_columns' associated with a sensor will need to be returned in the response.  
-
-        The 'sensor_name' is the name of the sensor known by the databot.  
-
-        DO NOT call the function `get_databot_values` unless the user needs the current sensor value.
-                
-        If multiple sensor values are requested, create a list of sensor names and call the `get_databot_values` function once with all of the sensor names.
-
-        Any temperature values will be in celsius, so convert the temperature to fahrenheit and show both values with their units.
-        """
-        return system_content
-
-    def handle_requires_action(self, tool_call, function_name: str, function_args: str) -> str:
-        rtn_value = ""
-        try:
-            args = json.loads(function_args)
-            st.sidebar.write(f"Call function: {function_name}")
-            st.sidebar.write(f"Arguments: {function_args}")
+        return _compile_assistant_instructions(_databot_sensors_key())
 
-            if function_name == "get_databot_values":
-                output = get_databot_values(args['sensor_names'])
-                st.sidebar.write("Document returned to OpenAI")
-                st.sidebar.json(output)
-                rtn_value = output
 
-        except Exception as exc:
-            logging.error(exc)
-            st.sidebar.error(str(exc))
-            rtn_value = "Unknown"
+@st.cache_resource
+def get_answer_cache() -> AnswerCache:
+    """
+    The answer cache shared by every session of the app.
+    """
+    return AnswerCache(max_entries=512, ttl_seconds=24 * 3600)
+
+
+@st.cache_resource
+def get_assistant_service() -> AssistantService:
+    """
+    The service shared by every session of the app.  It owns the OpenAI client, the Databot Assistant and
+    the worker pool that runs the prompts.
+    """
+    # the documentation is searched locally through the search_databot_docs function,
+    # so the docs are not uploaded and the hosted retrieval tool is not used
+    return AssistantService(
+        assistant_factory=lambda client: DatabotOpenAIAssistant(log_level=logging.INFO,
+                                                                answer_cache=get_answer_cache(),
+                                                                openai_client=client,
+                                                                context=ConversationContext(token_budget=6000,
+                                                                                            keep_turns=3)),
+        assistant_name="Databot Assistant",
+        tools=['function', 'code_interpreter'],
+        limits=TenantLimits(max_concurrent_runs=1, prompts_per_minute=6, burst=3)
+    )
 
-        return rtn_value
 
-    def run_response_callback(self, the_run: Run):
-        super().run_response_callback(the_run)
-        st.sidebar.write(the_run.status)
+def get_session_id() -> str:
+    if "session_id" not in st.session_state:
+        st.session_state["session_id"] = uuid.uuid4().hex
+    return st.session_state["session_id"]
 
 
-def get_assistant(create_if_not_exist: bool = True) -> DatabotOpenAIAssistant | None:
+def get_assistant() -> DatabotOpenAIAssistant:
     """
-    Get the Databot OpenAI Assistant.
+    Get the session's Databot OpenAI Assistant.  It shares the OpenAI client and the assistant with every
+    other session, and has its own conversation thread.
 
-    :param create_if_not_exist: Flag to indicate whether to create a new assistant if it doesn't exist.
-    :return: The Databot OpenAI Assistant object if it exists, otherwise None.
+    :return: The Databot OpenAI Assistant object for this session.
     """
-    if "openai_assistant" not in st.session_state:
-        if create_if_not_exist:
-            assistant = DatabotOpenAIAssistant(log_level=logging.INFO)
+    return get_assistant_service().get_assistant(get_session_id())
+
 
-            with files_in_directory('./databot_docs') as files:
-                for file_path in files:
-                    st.sidebar.write(file_path)
-                    assistant.add_file_to_assistant(file_path=file_path)
+# number of chat messages shown per page of history
+CHAT_HISTORY_PAGE_SIZE = 20
 
-            assistant.create_assistant(name="Databot Assistant",
-                                       tools=['function', 'retrieval', 'code_interpreter']
-                                       )
 
-            st.session_state["openai_assistant"] = assistant
+def get_rendered_message(message: AssistantThreadMessage) -> str:
+    """
+    The markdown for a chat message.  It is built once per message id and kept in the session, so
+    redrawing the history does not walk the message content again.
+    """
+    rendered = st.session_state.rendered_messages.get(message.get_id())
+    if rendered is None:
+        if message.get_file_id():
+            # the images are shown by show_message, only the text is markdown
+            rendered = message.get_text()
         else:
-            return None
+            rendered = str(message)
+        st.session_state.rendered_messages[message.get_id()] = rendered
+    return rendered
+
+
+def show_message(message: AssistantThreadMessage):
+    """
+    Show a chat message.  Images generated by the assistant are read from the local file cache, so showing
+    them again does not download them again.
+    """
+    file_id = message.get_file_id()
+    if file_id:
+        try:
+            st.image(get_assistant().get_file_path(file_id))
+        except Exception as e:
+            st.write(f"Could not load image {file_id}: {e}")
+    st.markdown(get_rendered_message(message))
+
 
-    return st.session_state["openai_assistant"]
+def _show_earlier_messages():
+    st.session_state.chat_history_pages += 1
 
 
 def show_chat_history():
-    for chat in st.session_state.chat_history:
+    """
+    Show the most recent pages of the chat history.  Older messages are only drawn when the user asks for them,
+    so the cost of a turn does not grow with the length of the conversation.
+    """
+    history = st.session_state.chat_history
+    visible = CHAT_HISTORY_PAGE_SIZE * st.session_state.chat_history_pages
+    hidden = len(history) - visible
+    if hidden > 0:
+        st.button(f"Show earlier messages ({hidden} hidden)", on_click=_show_earlier_messages)
+
+    for chat in history[max(hidden, 0):]:
         with st.chat_message(chat.get_role()):
-            st.markdown(chat)
+            show_message(chat)
+
+
+def render_run_events(events: Iterator[RunEvent] | List[RunEvent]):
+    """
+    Render the events of a run: the assistant's messages in the chat, and the run status
+    and function calls in the sidebar.
+
+    :param events: The events from OpenAIAssistant.iter_run_events, or the events a RunHandle has observed so far
+    """
+    placeholders = {}
+    status = st.sidebar.empty()
+    for event in events:
+        if event.type == "status":
+            status.write(f"Run status: {event.run.status}")
+
+        elif event.type == "message":
+            message_id = event.message.get_id()
+            if message_id not in placeholders:
+                with st.chat_message(event.message.get_role()):
+                    placeholders[message_id] = st.empty()
+            if event.message.get_file_id():
+                with placeholders[message_id].container():
+                    show_message(event.message)
+            else:
+                placeholders[message_id].markdown(event.message)
+
+        elif event.type == "tool_call":
+            st.sidebar.write(f"Call function: {event.function_name}")
+            st.sidebar.write(f"Arguments: {event.function_args}")
+
+        elif event.type == "tool_output":
+            st.sidebar.write("Document returned to OpenAI")
+            st.sidebar.json(event.output)
+
+        elif event.type == "timeout":
+            with st.chat_message("assistant"):
+                st.write("Timeout occurred. Please try again")
+
 
+def get_active_run() -> RunHandle | None:
+    return st.session_state.get("run_handle")
 
-def get_databot_values(sensor_names: List) -> str:
+
+def show_active_run(refresh_interval: float = 0.5):
+    """
+    Show the progress of the session's run.  While the run is going, the script sleeps briefly and reruns
+    itself to pick up new events; any user interaction interrupts the wait.  When the run is done its
+    messages move to the chat history.
+    """
+    handle = get_active_run()
+    if handle is None:
+        return
+
+    with st.chat_message("user"):
+        st.markdown(handle.user_prompt)
+
+    if handle.cached_response:
+        for message in handle.cached_response[1:]:
+            with st.chat_message(message.get_role()):
+                st.markdown(message)
+    else:
+        render_run_events(handle.get_events())
+
+    if not handle.is_done():
+        time.sleep(refresh_interval)
+        st.rerun()
+
+    if handle.error is not None:
+        with st.chat_message("assistant"):
+            st.write(f"Oops something went wrong: {handle.error}")
+    finish_active_run()
+
+
+def finish_active_run():
+    """
+    Move the messages of the session's finished run to the chat history.
+    """
+    handle = st.session_state.pop("run_handle", None)
+    if handle is None or handle.error is not None:
+        return
+
+    for message in handle.get_messages():
+        if message.get_id() not in st.session_state.chat_history_ids:
+            st.session_state.chat_history.append(message)
+            st.session_state.chat_history_ids.add(message.get_id())
+
+
+# seconds after which the databot values are stale, and how long a stale read waits for a new record
+DATABOT_MAX_AGE = 10.0
+DATABOT_STALE_WAIT = 2.0
+# the (connect, read) seconds before a request to the databot web server fails, within the function timeouts
+DATABOT_REQUEST_TIMEOUT = (3.0, 5.0)
+
+
+def get_sensor_columns(sensor_names: List[str], derived: bool = False) -> List[str]:
+    """
+    The data columns of the sensors with the given friendly names.
+
+    :param derived: True to include the derived columns computed by the databot web server, e.g. dew_point
+    """
+    columns = []
+    for sensor_name, sensor in databot_sensors.items():
+        if sensor['friendly_name'] in sensor_names:
+            columns.extend(sensor['data_columns'])
+            if derived:
+                # a derived column of several sensors, e.g. dew_point, is returned once
+                for column in get_derived_columns(sensor_name):
+                    if column not in columns:
+                        columns.append(column)
+    return columns
+
+
+@databot_tools.tool(description="""Get sensor values from the databot.  If there are multiple sensor values, a list of sensor names can be provided.
+This function can only provide information on the current values from the databot.
+This function CANNOT describe what the sensor is measuring.""",
+                    enums={"sensor_names": lambda: get_databot_friendly_names()}, timeout=10)
+def get_databot_values(sensor_names: List[str]) -> dict | str:
     """
     Get values for specified sensor names from the databot device.
 
-    :param sensor_names: List of sensor names to retrieve values for
+    :param sensor_names: List of the friendly human readable sensor value names.
     :type sensor_names: List
-    :return: JSON string containing the sensor values
-    :rtype: str
+    :return: The requested sensor values, rounded, with their units
+    :rtype: dict
     """
+    # requests is only needed once the assistant calls a databot function
+    import requests
+
     try:
         print(f"Get values for: {sensor_names}")
-        url = "http://localhost:8321/"
-        response = requests.get(url)
-        return json.dumps(response.json())
+        url = "http://localhost:8321/latest"
+        with get_tracer().span("databot_http", url=url) as span:
+            # a stale read waits briefly for the next record, and is marked as stale if none arrives
+            connect_timeout, read_timeout = DATABOT_REQUEST_TIMEOUT
+            response = requests.get(url, params={"max_age": DATABOT_MAX_AGE, "wait": DATABOT_STALE_WAIT},
+                                    timeout=(connect_timeout, read_timeout + DATABOT_STALE_WAIT))
+            latest = response.json()
+            span.set_attribute("sample_age_s", latest["sample_age_s"] if latest["sample_age_s"] is not None else -1.0)
+            span.set_attribute("stale", latest["stale"])
+        return databot_tools.output_encoder.encode_latest(latest, get_sensor_columns(sensor_names, derived=True))
+    except:
+        return "There was an error trying to access the databot device.  Make sure it is turned on and running the webserver."
+
+
+@databot_tools.tool(description="""Get the history of sensor values from the databot as min, max and mean values over time buckets.
+Use this function for questions about trends or past values, for example how the temperature changed this week.""",
+                    enums={"sensor_names": lambda: get_databot_friendly_names()}, exclude=("max_points",),
+                    timeout=10)
+def get_databot_history(sensor_names: List[str], hours: float, max_points: int = 24) -> dict | str:
+    """
+    Get the history of the specified sensors from the databot web server rollups.
+
+    :param sensor_names: List of the friendly human readable sensor value names.
+    :param hours: The number of hours of history, ending now.
+    :param max_points: The maximum number of time buckets per data column
+    :return: The selected rollup tier, and per data column a summary and the min/max/mean per time bucket
+    """
+    import requests
+
+    try:
+        url = "http://localhost:8321/history"
+        with get_tracer().span("databot_http", url=url):
+            response = requests.get(url, params={
+                "columns": ",".join(get_sensor_columns(sensor_names)),
+                "seconds": float(hours) * 3600,
+                "max_points": max_points
+            }, timeout=DATABOT_REQUEST_TIMEOUT)
+        return databot_tools.output_encoder.encode_history(response.json())
     except:
         return "There was an error trying to access the databot device.  Make sure it is turned on and running the webserver."
 
 
+@databot_tools.tool(description="""Get the recent alert events of the databot: CO2 above safe levels, sensor values changing fast, and unusual values.
+Use this function for questions about whether the air is safe or anything unusual happened, before pulling history.""",
+                    timeout=10)
+def get_databot_alerts(hours: float = 1.0) -> List[dict] | str:
+    """
+    Get the recent alert events from the databot web server.
+
+    :param hours: The number of hours of events, ending now.
+    :return: The events, newest first, with the rule, column, value, severity and a message
+    """
+    import requests
+
+    try:
+        url = "http://localhost:8321/events"
+        with get_tracer().span("databot_http", url=url):
+            response = requests.get(url, params={"seconds": float(hours) * 3600, "limit": 20},
+                                    timeout=DATABOT_REQUEST_TIMEOUT)
+        events = response.json().get("events", [])
+        if not events:
+            return f"No alert events in the last {hours:g} hours."
+        return [{"time": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(event["epoch"])),
+                 "rule": event["rule"], "severity": event["severity"], "message": event["message"]}
+                for event in events]
+    except:
+        return "There was an error trying to access the databot device.  Make sure it is turned on and running the webserver."
+
+
+# documentation searches do not depend on the live databot, so those answers can be cached
+@databot_tools.tool(description="""Search the databot and databot-py Python package documentation and examples.
+Returns the most relevant documentation snippets for the query.""", cacheable=True, exclude=("top_k",))
+def search_databot_docs(query: str, top_k: int = 3) -> List[dict]:
+    """
+    Search the local documentation index.
+
+    :param query: The question or keywords to search the documentation for.
+    :param top_k: The number of snippets to return
+    :return: The best matching documentation snippets, best first
+    """
+    snippets = get_doc_index().search(query, top_k=top_k)
+    return [{"source": s.source, "line": s.start_line, "text": s.text} for s in snippets]
+
+
+def _databot_sensors_key() -> tuple:
+    """
+    A hashable snapshot of the parts of `databot_sensors` used by the instructions and function schemas.
+    The compiled values below are memoized on it, so they are rebuilt only when `databot_sensors` changes.
+    """
+    return tuple((name, sensor['friendly_name'], tuple(sensor['data_columns']), tuple(get_derived_columns(name)))
+                 for name, sensor in databot_sensors.items())
+
+
+@lru_cache(maxsize=4)
+def _compile_databot_friendly_names(sensors_key: tuple) -> tuple:
+    return tuple(sorted(friendly_name for _, friendly_name, _, _ in sensors_key))
+
+
+@lru_cache(maxsize=4)
+def _compile_assistant_instructions(sensors_key: tuple) -> str:
+    sensor_lines = "\n".join(f"{friendly_name} | {sensor_name} | {', '.join(data_columns)} | "
+                              f"{', '.join(derived_columns)}"
+                              for sensor_name, friendly_name, data_columns, derived_columns in sensors_key)
+    return f"""You are an expert on the databot sensor device.
+When displaying sensor values, include the appropriate units.
+Databot sensors, one per line as: friendly_name | sensor_name | data_columns | derived_columns
+{sensor_lines}
+The friendly_name is what humans call the sensor, the sensor_name is the name known by the databot, and the data_columns are the values reported for the sensor.  Return all data_columns of a sensor in the response.
+The derived_columns are computed from the data_columns and returned with them, for example temperatures in fahrenheit (columns ending in _f), dew point, acceleration in g and 60 second averages.  Use them instead of doing the arithmetic yourself.
+To answer questions about the databot or the DroneBlocks databot-py Python package, call `search_databot_docs` and use the returned snippets.
+Only call `get_databot_values` when the user needs the current sensor value.  For multiple sensors, call it once with all of the sensor names.
+Temperature values are in celsius; show them with their fahrenheit derived columns and their units.
+If a result is marked stale, tell the user how old the values are.
+For questions about whether the air is safe, call `get_databot_alerts` with `get_databot_values`."""
+
+
 def get_databot_friendly_names() -> List:
-    df = pd.DataFrame(data=databot_sensors.values()).sort_values(by="friendly_name")
-    f_names = df['friendly_name'].to_list()
-    return f_names
+    return list(_compile_databot_friendly_names(_databot_sensors_key()))
 
 
 def get_function_definition() -> FunctionDefinition:
@@ -227,16 +466,30 @@ def setup_sidebar():
         delete_assistant_btn = st.button(label="Delete Assistant")
 
         if delete_assistant_btn:
+            # the assistant is shared, so this ends the conversation of every session
             st.write("Deleting Assistant...")
-            assistant = get_assistant(create_if_not_exist=False)
-            if assistant is not None:
-                assistant.delete_assistant()
-                st.write("Deleting Assistant...Done")
-                del st.session_state["openai_assistant"]
-            else:
-                st.write("No Assistant found...")
+            get_assistant_service().delete_assistant()
+            st.write("Deleting Assistant...Done")
+
+        handle = get_active_run()
+        if handle is not None and not handle.is_done():
+            st.button(label="Cancel Run", on_click=handle.cancel)
 
         st.divider()
+        st.caption("Answer cache")
+        st.json(get_answer_cache().stats.as_dict(), expanded=False)
+        st.caption("Sessions")
+        st.json(get_assistant_service().get_stats(), expanded=False)
+        st.caption("OpenAI requests")
+        st.json(get_default_scheduler().stats.as_dict(), expanded=False)
+        st.caption("File cache")
+        st.json(get_file_cache().stats.as_dict(), expanded=False)
+        st.caption("Function outputs")
+        st.json(databot_tools.output_encoder.get_stats(), expanded=False)
+        st.caption("Run latency by span")
+        st.json(get_tracer().summarize(), expanded=False)
+        st.download_button(label="Download Traces", data=json.dumps(get_tracer().to_otlp()),
+                           file_name="databot_assistant_traces.json", mime="application/json")
 
 
 def handle_userinput(user_content: str):
@@ -244,9 +497,7 @@ def handle_userinput(user_content: str):
     :param user_content: The content provided by the user as input.
     :return: None
 
-    This method takes in user content as input and processes it to generate a response. It uses the `run_conversation` function from the `databot_chat` module to perform the conversation. If the conversation is successful, it retrieves the assistant's response and adds it to the chat history. If there is an error, it adds an error message to the chat history.
-
-    Note: This method requires the `streamlit`, `dotenv`, `databot_chat`, `openai`, and `dataclasses` modules to be imported.
+    This method submits the user content through the shared AssistantService, within the session's limits, and keeps the RunHandle in the session.  The run's progress is shown by `show_active_run`, which moves the assistant's response to the chat history when the run is done.  Only one run per session is active at a time.
 
     Example usage:
 
@@ -256,14 +507,17 @@ def handle_userinput(user_content: str):
     """
 
     try:
-        get_assistant().submit_user_prompt(user_content, wait_for_completion=True)
-        messages: List[AssistantThreadMessage] = get_assistant().get_assistant_conversation()
-        for message in messages:
-            if message.get_id() not in st.session_state.chat_history_ids:
-                st.session_state.chat_history.append(message)
-                st.session_state.chat_history_ids.add(message.get_id())
+        handle = get_active_run()
+        if handle is not None and not handle.is_done():
+            st.warning("Still answering the previous question.  Wait for it, or cancel it from the sidebar.")
+            return
+        if handle is not None:
+            finish_active_run()
 
-        show_chat_history()
+        st.session_state.run_handle = get_assistant_service().submit(get_session_id(), user_content)
+
+    except TenantLimitError as e:
+        st.warning(str(e))
 
     except Exception as e:
         with st.chat_message("assistant"):
@@ -286,11 +540,15 @@ def main():
     if not 'chat_history' in st.session_state:
         st.session_state.chat_history = []
         st.session_state.chat_history_ids = set()
+        st.session_state.rendered_messages = {}
+        st.session_state.chat_history_pages = 1
 
     user_question = st.chat_input("Ask databot:")
-    if user_question:
-        with st.container(height=700):
+    with st.container(height=700):
+        show_chat_history()
+        if user_question:
             handle_userinput(user_question)
+        show_active_run()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,179 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable
+
+from openai_assistant import OpenAIAssistant
+from rate_limit import TokenBucket
+from run_executor import RunExecutor, RunHandle
+
+
+class TenantLimitError(Exception):
+    """
+    Raised when a tenant has too many runs in progress, or is over its rate limit.
+    """
+    pass
+
+
+@dataclass
+class TenantLimits:
+    """
+    Attributes:
+        max_concurrent_runs (int): The number of runs a tenant can have in progress
+        prompts_per_minute (float): The sustained number of prompts per minute
+        burst (int): The number of prompts that can be submitted back to back
+    """
+    max_concurrent_runs: int = 1
+    prompts_per_minute: float = 6
+    burst: int = 3
+
+
+@dataclass
+class _Tenant:
+    assistant: OpenAIAssistant
+    bucket: TokenBucket
+    active_runs: int = field(default=0)
+
+
+class AssistantService:
+    """
+    Serves many users from one process with one shared OpenAI client and one shared OpenAI assistant.
+
+    Each tenant (a browser session) gets a lightweight OpenAIAssistant that reuses the shared client and
+    assistant, and owns only its conversation thread.  Prompts run on a shared RunExecutor, within the
+    tenant's concurrency and rate limits.
+
+    Usage:
+        service = AssistantService(lambda client: DatabotOpenAIAssistant(openai_client=client),
+                                   assistant_name="Databot Assistant", tools=["function"])
+        handle = service.submit(session_id, "What is the co2 value?")
+
+    :param assistant_factory: Creates an (unconfigured) OpenAIAssistant that uses the given OpenAI client
+    :param assistant_name: The name of the shared assistant
+    :param tools: The tools of the shared assistant
+    :param limits: The limits applied to every tenant
+    :param max_tenants: The number of tenants kept.  The least recently used tenant is dropped first.
+    :param max_workers: The number of runs followed at the same time across all tenants
+    :param max_connections: The size of the shared HTTP connection pool
+    """
+
+    def __init__(self, assistant_factory: Callable[[object], OpenAIAssistant], assistant_name: str,
+                 tools: list | None = None, limits: TenantLimits | None = None, max_tenants: int = 200,
+                 max_workers: int = 16, max_connections: int = 32, api_key: str | None = None):
+        import httpx
+        from openai import OpenAI
+
+        if api_key is None:
+            api_key = os.getenv("OPENAI_API_KEY")
+        # retries are done by the RequestScheduler of the assistants
+        self.openai_client = OpenAI(api_key=api_key, max_retries=0, http_client=httpx.Client(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)))
+        self.assistant_factory = assistant_factory
+        self.assistant_name = assistant_name
+        self.tools = tools or ["function"]
+        self.limits = limits or TenantLimits()
+        self.max_tenants = max_tenants
+        self.executor = RunExecutor(max_workers=max_workers)
+
+        self._owner: OpenAIAssistant | None = None
+        # held while the shared assistant is created, so the sessions only wait on _lock for bookkeeping
+        self._owner_lock = threading.Lock()
+        self._tenants: OrderedDict[str, _Tenant] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_shared_assistant(self) -> OpenAIAssistant:
+        """
+        The OpenAIAssistant that created, and owns, the shared OpenAI assistant.  Created on first use.
+        """
+        owner = self._owner
+        if owner is not None:
+            return owner
+        # creating the assistant is a request to OpenAI, made without holding _lock
+        with self._owner_lock:
+            owner = self._owner
+            if owner is None:
+                owner = self.assistant_factory(self.openai_client)
+                owner.create_assistant(name=self.assistant_name, tools=self.tools)
+                with self._lock:
+                    self._owner = owner
+            return owner
+
+    def get_assistant(self, tenant_id: str) -> OpenAIAssistant:
+        """
+        The tenant's assistant.  It shares the OpenAI client and assistant, and has its own thread.
+        """
+        shared = self.get_shared_assistant()
+        with self._lock:
+            return self._get_tenant(tenant_id, shared).assistant
+
+    def _get_tenant(self, tenant_id: str, shared: OpenAIAssistant) -> _Tenant:
+        # called with _lock held
+        tenant = self._tenants.get(tenant_id)
+        if tenant is None:
+            assistant = self.assistant_factory(self.openai_client)
+            assistant.assistant = shared.assistant
+            assistant.functions = shared.functions
+            tenant = _Tenant(assistant=assistant,
+                             bucket=TokenBucket(rate=self.limits.prompts_per_minute / 60,
+                                                capacity=self.limits.burst))
+            self._tenants[tenant_id] = tenant
+        self._tenants.move_to_end(tenant_id)
+        self._evict(keep=tenant_id)
+        return tenant
+
+    def _evict(self, keep: str):
+        while len(self._tenants) > self.max_tenants:
+            for tenant_id, tenant in self._tenants.items():
+                if tenant.active_runs == 0 and tenant_id != keep:
+                    logging.info(f"Dropping idle tenant {tenant_id}")
+                    del self._tenants[tenant_id]
+                    break
+            else:
+                return
+
+    def submit(self, tenant_id: str, user_prompt: str, max_wait_time: int = 60) -> RunHandle:
+        """
+        Submit a prompt for a tenant.
+
+        :raises TenantLimitError: when the tenant already has max_concurrent_runs in progress, or is over its rate limit
+        """
+        shared = self.get_shared_assistant()
+        with self._lock:
+            # looked up, or created, in the same locked block as the run is counted, so it cannot be evicted between
+            tenant = self._get_tenant(tenant_id, shared)
+            if tenant.active_runs >= self.limits.max_concurrent_runs:
+                raise TenantLimitError("A previous question is still being answered")
+            if not tenant.bucket.try_acquire():
+                raise TenantLimitError(f"Too many questions, try again in "
+                                       f"{tenant.bucket.time_until_available():.0f} seconds")
+            tenant.active_runs += 1
+
+        def release(_handle: RunHandle):
+            with self._lock:
+                tenant.active_runs -= 1
+
+        return self.executor.submit(tenant.assistant, user_prompt, max_wait_time=max_wait_time, on_done=release)
+
+    def release_tenant(self, tenant_id: str):
+        with self._lock:
+            self._tenants.pop(tenant_id, None)
+
+    def delete_assistant(self):
+        """
+        Delete the shared OpenAI assistant.  Every tenant is dropped, and the next prompt creates a new assistant.
+        """
+        with self._lock:
+            owner = self._owner
+            self._owner = None
+            self._tenants.clear()
+        if owner is not None:
+            owner.delete_assistant()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "tenants": len(self._tenants),
+                "active_runs": sum(t.active_runs for t in self._tenants.values())
+            }
@@ -0,0 +1,64 @@
+import argparse
+import subprocess
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List
+
+root_dir = str(Path(__file__).resolve().parent.parent)
+
+
+@dataclass
+class ImportTime:
+    module: str
+    depth: int
+    self_us: int
+    cumulative_us: int
+
+
+def measure_import_time(module: str) -> List[ImportTime]:
+    """
+    Import a module in a fresh interpreter with `-X importtime` and parse the per module timings.
+
+    :param module: The module to import, e.g. "app"
+    :return: One ImportTime per imported module, in import order
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=root_dir, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr.splitlines()[-1] if result.stderr else ''}")
+
+    timings = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        timings.append(ImportTime(module=name.strip(), depth=depth,
+                                  self_us=int(self_us), cumulative_us=int(cumulative_us)))
+    return timings
+
+
+def report(module: str, top: int):
+    timings = measure_import_time(module)
+    total = sum(t.self_us for t in timings)
+    print(f"import {module}: {total / 1000:.1f} ms, {len(timings)} modules")
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    # the top level packages are the ones worth deferring
+    for t in sorted((t for t in timings if "." not in t.module), key=lambda t: t.cumulative_us, reverse=True)[:top]:
+        print(f"{t.cumulative_us / 1000:>14.1f} {t.self_us / 1000:>9.1f}  {t.module}")
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report the import time of the app modules, per imported package.")
+    parser.add_argument("modules", nargs="*", default=["app", "openai_assistant"])
+    parser.add_argument("--top", type=int, default=15, help="Number of packages to list per module")
+    args = parser.parse_args()
+
+    for module in args.modules:
+        report(module, args.top)
+
+
+if __name__ == '__main__':
+    main()
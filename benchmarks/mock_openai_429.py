@@ -0,0 +1,95 @@
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import sys
+
+root_dir = str(Path(__file__).resolve().parent.parent)
+sys.path.append(root_dir)
+
+from rate_limit import BACKGROUND, INTERACTIVE, RequestScheduler
+
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    """
+    Answers GET /v1/files with a 429 for every `fail_every` request, and an empty file list otherwise.
+    """
+    fail_every = 3
+    retry_after = 0.2
+    requests = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with MockOpenAIHandler.lock:
+            MockOpenAIHandler.requests += 1
+            fail = MockOpenAIHandler.requests % MockOpenAIHandler.fail_every == 0
+
+        if fail:
+            body = json.dumps({"error": {"message": "Rate limit reached", "type": "requests", "code": None}})
+            self.send_response(429)
+            self.send_header("retry-after", str(MockOpenAIHandler.retry_after))
+        else:
+            body = json.dumps({"object": "list", "data": [], "has_more": False})
+            self.send_response(200)
+        self.send_header("content-type", "application/json")
+        self.end_headers()
+        self.wfile.write(body.encode("utf-8"))
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Exercise the RequestScheduler against a local mock of the OpenAI API that returns 429s.")
+    parser.add_argument("--requests", type=int, default=40, help="Number of calls to make")
+    parser.add_argument("--threads", type=int, default=8, help="Number of threads making calls")
+    parser.add_argument("--fail-every", type=int, default=3, help="Every n-th request gets a 429")
+    parser.add_argument("--rate", type=float, default=10, help="Scheduler requests per second")
+    args = parser.parse_args()
+
+    from openai import OpenAI
+
+    MockOpenAIHandler.fail_every = args.fail_every
+    server = ThreadingHTTPServer(("localhost", 0), MockOpenAIHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    client = OpenAI(api_key="sk-mock", base_url=f"http://localhost:{server.server_port}/v1", max_retries=0)
+    scheduler = RequestScheduler(requests_per_second=args.rate, burst=5, base_delay=0.1)
+
+    failures = 0
+    counter = iter(range(args.requests))
+    counter_lock = threading.Lock()
+
+    def worker():
+        nonlocal failures
+        while True:
+            with counter_lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            try:
+                # every other call is background work, e.g. uploads and clean up
+                scheduler.call(client.files.list, priority=BACKGROUND if i % 2 else INTERACTIVE)
+            except Exception as exc:
+                print(f"Call {i} failed: {exc}")
+                failures += 1
+
+    start = time.monotonic()
+    threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - start
+    server.shutdown()
+
+    print(f"{args.requests} calls in {elapsed:.2f}s, {failures} failed, "
+          f"{MockOpenAIHandler.requests} HTTP requests to the mock server")
+    print(json.dumps(scheduler.stats.as_dict(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
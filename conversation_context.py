@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import re
+from typing import TYPE_CHECKING, List
+
+if TYPE_CHECKING:
+    from openai_assistant import AssistantThreadMessage
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    A rough token count, about four characters per token for English text, plus a few tokens of message overhead.
+    """
+    return len(text) // 4 + 4
+
+
+def _first_sentence(text: str, max_chars: int) -> str:
+    text = " ".join(text.split())
+    sentence = _SENTENCE_END.split(text, maxsplit=1)[0]
+    if len(sentence) > max_chars:
+        sentence = sentence[:max_chars].rstrip() + "..."
+    return sentence
+
+
+def _shorten(text: str, max_chars: int) -> str:
+    if len(text) > max_chars:
+        return text[:max_chars].rstrip() + "..."
+    return text
+
+
+class ConversationContext:
+    """
+    Keeps the context sent with every run bounded.
+
+    Once the estimated tokens of the conversation pass the budget, the conversation is rolled into a new
+    thread seeded with a compact summary of the older turns and the text of the last few turns.  The summary is
+    carried over from one rollover to the next, so a long conversation keeps its earliest questions.  The seed is
+    kept to about half of the budget: the summary drops its oldest lines, and the recent turns are shortened, or
+    summarized when they do not fit.
+
+    :param token_budget: The estimated number of tokens in the thread that triggers a rollover
+    :param keep_turns: The number of most recent turns (a user message and the replies to it) carried over as is
+    :param summary_chars: The maximum characters kept from each question and answer in the summary
+    :param recent_chars: The maximum characters kept from each message of the recent turns
+    """
+
+    def __init__(self, token_budget: int = 6000, keep_turns: int = 3, summary_chars: int = 160,
+                 recent_chars: int = 1000):
+        self.token_budget = token_budget
+        self.keep_turns = keep_turns
+        self.summary_chars = summary_chars
+        self.recent_chars = recent_chars
+        self.rollovers = 0
+
+    def estimate(self, messages: List[AssistantThreadMessage], extra_tokens: int = 0) -> int:
+        """
+        :param extra_tokens: The estimated tokens of the thread that are not messages, e.g. tool outputs
+        """
+        return sum(estimate_tokens(str(message)) for message in messages) + extra_tokens
+
+    def needs_rollover(self, messages: List[AssistantThreadMessage], extra_tokens: int = 0) -> bool:
+        return self.estimate(messages, extra_tokens) > self.token_budget
+
+    @staticmethod
+    def split_turns(messages: List[AssistantThreadMessage]) -> List[List[AssistantThreadMessage]]:
+        turns = []
+        for message in messages:
+            if message.get_role() == "user" or not turns:
+                turns.append([])
+            turns[-1].append(message)
+        return turns
+
+    def _summarize_turn(self, turn: List[AssistantThreadMessage]) -> str:
+        question = next((str(m) for m in turn if m.get_role() == "user"), "")
+        answer = next((str(m) for m in turn if m.get_role() == "assistant"), "")
+        return f"- Q: {_first_sentence(question, self.summary_chars)} A: {_first_sentence(answer, self.summary_chars)}"
+
+    def _fit_summary(self, summary: List[str]) -> List[str]:
+        # the newest lines of the summary that fit in a quarter of the budget
+        budget = self.token_budget // 4
+        kept = []
+        for line in reversed(summary):
+            budget -= estimate_tokens(line)
+            if budget < 0:
+                break
+            kept.append(line)
+        return kept[::-1]
+
+    def summarize(self, messages: List[AssistantThreadMessage], earlier_summary: List[str] = ()) -> List[str]:
+        """
+        The summary lines of a conversation, one per turn, after the summary of the threads before it.  Pass it
+        to build_seed at the next rollover.
+        """
+        return self._fit_summary(list(earlier_summary) + [self._summarize_turn(t) for t in self.split_turns(messages)])
+
+    def build_seed(self, messages: List[AssistantThreadMessage], earlier_summary: List[str] = ()) -> str:
+        """
+        The first message of the new thread: a summary of the older turns, then the most recent turns.
+
+        :param messages: The messages of the thread that is rolled over
+        :param earlier_summary: The summary of the threads before it, see summarize
+        """
+        turns = self.split_turns(messages)
+        # the most recent turns, shortened, that fit in a quarter of the budget; the turns before them are summarized
+        budget = self.token_budget // 4
+        recent = []
+        for turn in reversed(turns[-self.keep_turns:] if self.keep_turns > 0 else []):
+            lines = [f"{message.get_role()}: {_shorten(str(message), self.recent_chars)}" for message in turn]
+            budget -= sum(estimate_tokens(line) for line in lines)
+            if budget < 0:
+                break
+            recent.insert(0, lines)
+        older = turns[:len(turns) - len(recent)]
+        summary = self._fit_summary(list(earlier_summary) + [self._summarize_turn(turn) for turn in older])
+
+        lines = ["This conversation continues an earlier one."]
+        if summary:
+            lines.append("Summary of the earlier questions and answers:")
+            lines.extend(summary)
+        if recent:
+            lines.append("Most recent messages:")
+            for turn_lines in recent:
+                lines.extend(turn_lines)
+        lines.append("Use this context to answer the questions that follow.")
+        return "\n".join(lines)
@@ -0,0 +1,271 @@
+import itertools
+import logging
+import math
+import threading
+import time
+from collections import deque
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Literal
+
+from databot_bus import DatabotBus
+from databot_shm import SampleRing
+
+Severity = Literal["info", "warning", "critical"]
+
+logger = logging.getLogger("databot_alerts")
+
+
+@dataclass
+class AlertEvent:
+    """
+    A rule of the AlertDetector that fired.
+
+    Attributes:
+        event_id (int): Increases with every event of a detector
+        epoch (float): The timestamp of the record that fired the rule
+        rule (str): The rule name
+        column (str): The data column the rule watches
+        value (float): The value that fired the rule
+        severity (str): info, warning or critical
+        message (str): What happened, for people
+    """
+    event_id: int
+    epoch: float
+    rule: str
+    column: str
+    value: float
+    severity: Severity
+    message: str
+
+
+class AlertRule:
+    """
+    Base class for the rules of an AlertDetector.  A rule watches one column, keeps a constant amount of state,
+    and is updated with every value of the column.
+
+    :param name: The rule name
+    :param column: The data column the rule watches
+    :param severity: The severity of its events
+    :param cooldown: The minimum number of seconds between two events of the rule
+    """
+
+    def __init__(self, name: str, column: str, severity: Severity = "warning", cooldown: float = 300.0):
+        self.name = name
+        self.column = column
+        self.severity = severity
+        self.cooldown = cooldown
+        self._last_fired: float | None = None
+
+    def check(self, epoch: float, value: float) -> str | None:
+        """
+        Update the rule with a value.
+
+        :return: The message of the event when the rule fires, else None
+        """
+        raise NotImplementedError
+
+    def update(self, epoch: float, value: float) -> str | None:
+        message = self.check(epoch, value)
+        if message is None:
+            return None
+        if self._last_fired is not None and epoch - self._last_fired < self.cooldown:
+            return None
+        self._last_fired = epoch
+        return message
+
+
+class ThresholdRule(AlertRule):
+    """
+    Fires when a value goes above `above` or below `below`, and again only after the values were back in range.
+    """
+
+    def __init__(self, name: str, column: str, above: float | None = None, below: float | None = None,
+                 severity: Severity = "warning", cooldown: float = 300.0):
+        super().__init__(name, column, severity, cooldown)
+        self.above = above
+        self.below = below
+        self._in_range = True
+
+    def check(self, epoch: float, value: float) -> str | None:
+        if self.above is not None and value > self.above:
+            message = f"{self.column} is {value:g}, above {self.above:g}"
+        elif self.below is not None and value < self.below:
+            message = f"{self.column} is {value:g}, below {self.below:g}"
+        else:
+            self._in_range = True
+            return None
+        was_in_range = self._in_range
+        self._in_range = False
+        return message if was_in_range else None
+
+
+class RateOfChangeRule(AlertRule):
+    """
+    Fires when a column changes faster than max_rate per second between two consecutive values.
+    """
+
+    def __init__(self, name: str, column: str, max_rate: float, severity: Severity = "warning",
+                 cooldown: float = 300.0):
+        super().__init__(name, column, severity, cooldown)
+        self.max_rate = max_rate
+        self._previous: tuple | None = None
+
+    def check(self, epoch: float, value: float) -> str | None:
+        previous = self._previous
+        self._previous = (epoch, value)
+        if previous is None or epoch <= previous[0]:
+            return None
+        rate = (value - previous[1]) / (epoch - previous[0])
+        if abs(rate) > self.max_rate:
+            direction = "rising" if rate > 0 else "falling"
+            return f"{self.column} is {direction} at {abs(rate):.3g} per second, to {value:g}"
+        return None
+
+
+class ZScoreRule(AlertRule):
+    """
+    Fires when a value is more than `threshold` standard deviations from the recent mean.  The mean and variance
+    are exponentially weighted over about `span` values, so the state is two numbers however long it runs.
+
+    :param span: The number of values the mean and variance are weighted over
+    :param warmup: The number of values seen before the rule can fire
+    """
+
+    def __init__(self, name: str, column: str, threshold: float = 4.0, span: int = 120, warmup: int = 30,
+                 severity: Severity = "info", cooldown: float = 300.0):
+        super().__init__(name, column, severity, cooldown)
+        self.threshold = threshold
+        self.alpha = 2.0 / (span + 1)
+        self.warmup = warmup
+        self._count = 0
+        self._mean = 0.0
+        self._variance = 0.0
+
+    def check(self, epoch: float, value: float) -> str | None:
+        message = None
+        if self._count >= self.warmup and self._variance > 0:
+            z = (value - self._mean) / math.sqrt(self._variance)
+            if abs(z) > self.threshold:
+                message = f"{self.column} is {value:g}, unusual for the recent mean of {self._mean:.4g} (z={z:.1f})"
+
+        if self._count == 0:
+            self._mean = value
+        else:
+            difference = value - self._mean
+            increment = self.alpha * difference
+            self._mean += increment
+            self._variance = (1 - self.alpha) * (self._variance + difference * increment)
+        self._count += 1
+        return message
+
+
+def default_rules() -> List[AlertRule]:
+    """
+    Rules for indoor air quality: CO2 above the usual ventilation guidance of 1000 ppm, fast CO2 and VOC changes,
+    and unusual values of the air quality and temperature sensors.
+    """
+    return [
+        ThresholdRule("co2_high", "co2", above=1000, severity="warning"),
+        ThresholdRule("co2_very_high", "co2", above=2000, severity="critical"),
+        RateOfChangeRule("co2_rising_fast", "co2", max_rate=20.0, severity="warning"),
+        ZScoreRule("co2_unusual", "co2"),
+        ZScoreRule("voc_unusual", "voc"),
+        ZScoreRule("temperature_unusual", "humidity_temperature"),
+    ]
+
+
+class AlertDetector:
+    """
+    Runs alert rules over the databot records as they arrive, e.g. as a subscriber of the collector's DatabotBus.
+
+    Every event is logged, kept in memory, published to the optional event ring for the web servers in other
+    processes, and broadcast on the detector's bus, so it can be pushed to subscribers, e.g. a UnixSocketBridge.
+
+    Usage:
+        detector = AlertDetector()
+        collector.bus.subscribe("alerts", detector.process, inline=True)
+        detector.recent_events(seconds=3600)
+
+    :param rules: The rules.  Defaults to default_rules().
+    :param history_size: The number of events kept in memory
+    :param event_ring: A SampleRing the events are published to
+    """
+
+    def __init__(self, rules: List[AlertRule] | None = None, history_size: int = 200,
+                 event_ring: SampleRing | None = None):
+        self.rules: Dict[str, List[AlertRule]] = {}
+        for rule in rules if rules is not None else default_rules():
+            self.rules.setdefault(rule.column, []).append(rule)
+        self.event_ring = event_ring
+        self.bus = DatabotBus()
+        self._events: deque[AlertEvent] = deque(maxlen=history_size)
+        self._event_ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def process(self, epoch: float, data: dict) -> List[AlertEvent]:
+        """
+        Update the rules of the columns of a databot record.
+
+        :return: The events fired by the record
+        """
+        events = []
+        for column, rules in self.rules.items():
+            try:
+                value = float(data[column])
+            except (KeyError, TypeError, ValueError):
+                continue
+            if math.isnan(value):
+                continue
+            for rule in rules:
+                message = rule.update(epoch, value)
+                if message is not None:
+                    events.append(AlertEvent(event_id=next(self._event_ids), epoch=epoch, rule=rule.name,
+                                             column=column, value=value, severity=rule.severity, message=message))
+
+        for event in events:
+            self._emit(event)
+        return events
+
+    def _emit(self, event: AlertEvent):
+        logger.log(logging.INFO if event.severity == "info" else logging.WARNING,
+                   "%s [%s] %s", event.rule, event.severity, event.message)
+        with self._lock:
+            self._events.append(event)
+        if self.event_ring is not None:
+            self.event_ring.publish(asdict(event))
+        self.bus.publish(event.epoch, asdict(event))
+
+    def recent_events(self, seconds: float | None = None, since_id: int = 0, limit: int = 50) -> List[dict]:
+        """
+        The recent events, newest first.
+
+        :param seconds: Only the events of the last seconds
+        :param since_id: Only the events after this event_id
+        :param limit: The maximum number of events
+        """
+        with self._lock:
+            events = [asdict(event) for event in self._events]
+        return _filter_events(events, seconds, since_id, limit)
+
+
+def _filter_events(events: List[dict], seconds: float | None, since_id: int, limit: int) -> List[dict]:
+    start = time.time() - seconds if seconds is not None else None
+    recent = [event for event in reversed(events)
+              if event["event_id"] > since_id and (start is None or event["epoch"] >= start)]
+    return recent[:limit]
+
+
+class AlertEventReader:
+    """
+    Reads the events an AlertDetector in another process publishes to a SampleRing, for a web server that does not
+    run the detector itself.  Provides recent_events of AlertDetector.
+
+    :param event_ring: The ring, attached with SampleRing.attach
+    """
+
+    def __init__(self, event_ring: SampleRing):
+        self.event_ring = event_ring
+
+    def recent_events(self, seconds: float | None = None, since_id: int = 0, limit: int = 50) -> List[dict]:
+        records, _ = self.event_ring.read_since(0)
+        return _filter_events([record for _, record in records], seconds, since_id, limit)
@@ -0,0 +1,284 @@
+import json
+import logging
+import os
+import socket
+import threading
+from collections import deque
+from pathlib import Path
+from typing import Callable, Dict, Iterator, Literal, Tuple
+
+from ndjson_index import NdjsonIndexWriter
+
+# what a subscription does with a new record when its buffer is full
+OverflowPolicy = Literal["drop_oldest", "drop_newest", "block"]
+
+# a sink is called with the epoch and the record, like PyDatabot.process_databot_data
+Sink = Callable[[float, dict], None]
+
+
+class Subscription:
+    """
+    A sink subscribed to a DatabotBus, with its own buffer and overflow policy.
+
+    A threaded subscription delivers the records from its buffer on its own thread, so a slow sink only holds
+    up itself.  An inline subscription is called by the publisher, for sinks that are cheap and must see every
+    record at once, e.g. the latest record of the web server.
+
+    :param name: The name of the subscription
+    :param sink: Called with (epoch, record) for every record.  Every subscription gets its own copy of the record.
+    :param buffer_size: The number of records buffered for a threaded subscription
+    :param overflow: drop_oldest keeps the newest records, drop_newest keeps the buffered ones, and block makes the
+                     publisher wait up to block_timeout seconds for room before dropping the record
+    :param inline: True to call the sink from the publisher, without a buffer or a thread
+    :param block_timeout: The longest the publisher waits for a full buffer with the block policy
+    """
+
+    def __init__(self, name: str, sink: Sink, buffer_size: int = 1000, overflow: OverflowPolicy = "drop_oldest",
+                 inline: bool = False, block_timeout: float = 1.0):
+        self.name = name
+        self.sink = sink
+        self.buffer_size = buffer_size
+        self.overflow = overflow
+        self.inline = inline
+        self.block_timeout = block_timeout
+        self.delivered = 0
+        self.dropped = 0
+        self.errors = 0
+        self._buffer: deque[Tuple[float, dict]] = deque()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._thread: threading.Thread | None = None
+        if not inline:
+            self._thread = threading.Thread(target=self._deliver_buffered, name=f"bus-{name}", daemon=True)
+            self._thread.start()
+
+    def _deliver(self, epoch: float, data: dict):
+        try:
+            self.sink(epoch, data)
+            self.delivered += 1
+        except Exception as exc:
+            self.errors += 1
+            logging.error(f"Bus subscriber {self.name} failed: {exc}")
+
+    def put(self, epoch: float, data: dict):
+        if self.inline:
+            self._deliver(epoch, data)
+            return
+
+        with self._condition:
+            if self._closed:
+                return
+            if len(self._buffer) >= self.buffer_size:
+                if self.overflow == "block":
+                    self._condition.wait_for(lambda: len(self._buffer) < self.buffer_size or self._closed,
+                                             timeout=self.block_timeout)
+                if len(self._buffer) >= self.buffer_size:
+                    self.dropped += 1
+                    if self.overflow != "drop_oldest":
+                        return
+                    self._buffer.popleft()
+            self._buffer.append((epoch, data))
+            self._condition.notify_all()
+
+    def _deliver_buffered(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._buffer or self._closed)
+                if not self._buffer:
+                    return
+                epoch, data = self._buffer.popleft()
+                # a publisher blocked on the full buffer can continue
+                self._condition.notify_all()
+            self._deliver(epoch, data)
+
+    def close(self, timeout: float | None = 5.0):
+        """
+        Stop the subscription once the buffered records are delivered.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        close_sink = getattr(self.sink, "close", None)
+        if close_sink is not None:
+            close_sink()
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "buffered": len(self._buffer)
+        }
+
+
+class DatabotBus:
+    """
+    Broadcasts the databot records of one BLE connection to any number of subscribers, e.g. a capture file,
+    the web server, the rollups and a stream to other processes.
+
+    Usage:
+        bus = DatabotBus()
+        bus.subscribe("file", FileSink("data/capture.txt"), buffer_size=100000, overflow="drop_newest")
+        bus.subscribe("print", lambda epoch, data: print(epoch, data), inline=True)
+        bus.publish(time.time(), {"co2": "412"})
+    """
+
+    def __init__(self):
+        self._subscriptions: Dict[str, Subscription] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, name: str, sink: Sink, buffer_size: int = 1000, overflow: OverflowPolicy = "drop_oldest",
+                  inline: bool = False, block_timeout: float = 1.0) -> Subscription:
+        """
+        Subscribe a sink to the records published from now on.  See Subscription for the parameters.
+        """
+        subscription = Subscription(name, sink, buffer_size=buffer_size, overflow=overflow, inline=inline,
+                                    block_timeout=block_timeout)
+        with self._lock:
+            if name in self._subscriptions:
+                subscription.close()
+                raise ValueError(f"Bus subscriber {name} already exists")
+            self._subscriptions[name] = subscription
+        return subscription
+
+    def unsubscribe(self, name: str):
+        with self._lock:
+            subscription = self._subscriptions.pop(name, None)
+        if subscription is not None:
+            subscription.close()
+
+    def publish(self, epoch: float, data: dict):
+        """
+        Send a record to every subscriber.
+        """
+        with self._lock:
+            subscriptions = list(self._subscriptions.values())
+        for subscription in subscriptions:
+            subscription.put(epoch, dict(data))
+
+    def close(self):
+        """
+        Unsubscribe every subscriber, once their buffered records are delivered.
+        """
+        with self._lock:
+            subscriptions = list(self._subscriptions.values())
+            self._subscriptions = {}
+        for subscription in subscriptions:
+            subscription.close()
+
+    def get_stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            subscriptions = list(self._subscriptions.values())
+        return {subscription.name: subscription.get_stats() for subscription in subscriptions}
+
+
+class FileSink:
+    """
+    Appends records to an NDJSON capture file, in the format of PyDatabotSaveToFileDataCollector, and maintains its
+    sidecar time index.  The file is kept open and flushed every flush_every records, and before an index bucket
+    is closed, so the index never points past the end of the file.
+
+    :param file_name: The capture file.  An existing file is appended to.
+    :param flush_every: The number of records between flushes
+    :param bucket_seconds: The width of an index bucket in seconds
+    """
+
+    def __init__(self, file_name: str, flush_every: int = 10, bucket_seconds: float = 60):
+        self.file_path = Path(file_name)
+        self.file_path.parent.mkdir(parents=True, exist_ok=True)
+        self.flush_every = flush_every
+        self.index_writer = NdjsonIndexWriter(self.file_path, bucket_seconds=bucket_seconds)
+        self._file = self.file_path.open("ab")
+        self._unflushed = 0
+
+    def __call__(self, epoch: float, data: dict):
+        line = (json.dumps(data) + "\n").encode("utf-8")
+        current = self.index_writer.current
+        if current is not None and current.bucket != self.index_writer.bucket_for(epoch):
+            # this line closes the current bucket, whose lines must be in the file before it is indexed
+            self._flush_file()
+        offset = self._file.tell()
+        self._file.write(line)
+        self.index_writer.add(epoch, data, offset, offset + len(line))
+        self._unflushed += 1
+        if self._unflushed >= self.flush_every:
+            self._flush_file()
+
+    def _flush_file(self):
+        self._file.flush()
+        self._unflushed = 0
+
+    def close(self):
+        # closing the file flushes it, before the last bucket is indexed
+        self._file.close()
+        self.index_writer.flush()
+
+
+class UnixSocketBridge:
+    """
+    Streams the records of a bus to other local processes over a Unix socket, one json line per record.
+
+    Every connected client is a subscriber of the bus with its own buffer, so a slow client only drops its own
+    records.  Clients read the stream with read_unix_socket.
+
+    :param bus: The bus to stream
+    :param path: The path of the Unix socket
+    :param buffer_size: The number of records buffered per client
+    """
+
+    def __init__(self, bus: DatabotBus, path: str = "/tmp/databot.sock", buffer_size: int = 1000):
+        self.bus = bus
+        self.path = path
+        self.buffer_size = buffer_size
+        self._server: socket.socket | None = None
+        self._clients = 0
+
+    def start(self) -> threading.Thread:
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(self.path)
+        self._server.listen()
+        t = threading.Thread(target=self._accept, name="bus-socket-bridge", daemon=True)
+        t.start()
+        return t
+
+    def _accept(self):
+        while True:
+            try:
+                connection, _ = self._server.accept()
+            except OSError:
+                # the bridge was closed
+                return
+            self._clients += 1
+            name = f"socket-{self._clients}"
+
+            def send(epoch: float, data: dict, connection=connection, name=name):
+                try:
+                    connection.sendall((json.dumps(data) + "\n").encode("utf-8"))
+                except OSError:
+                    logging.info(f"Bus subscriber {name} disconnected")
+                    connection.close()
+                    threading.Thread(target=self.bus.unsubscribe, args=(name,), daemon=True).start()
+
+            self.bus.subscribe(name, send, buffer_size=self.buffer_size)
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+def read_unix_socket(path: str = "/tmp/databot.sock") -> Iterator[dict]:
+    """
+    The records streamed by a UnixSocketBridge, until the bridge closes the connection.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(path)
+        with client.makefile("r", encoding="utf-8") as lines:
+            for line in lines:
+                yield json.loads(line)
@@ -0,0 +1,312 @@
+import logging
+import math
+from typing import Dict, List, Tuple
+
+from databot.PyDatabot import PyDatabotSaveToFileDataCollector, PyDatabotSaveToQueueDataCollector, DatabotConfig
+
+# a record moving through the pipeline: (epoch, data) exactly as handed to process_databot_data
+Record = Tuple[float, dict]
+
+# columns that describe the record rather than a sensor reading
+NON_SENSOR_COLUMNS = {"time", "timestamp"}
+
+
+def to_float(value) -> float | None:
+    """
+    Convert a databot value to a float.  The databot reports every value as a string.
+
+    :param value: The raw value
+    :return: The float value, or None if the value is not numeric
+    """
+    try:
+        result = float(value)
+    except (TypeError, ValueError):
+        return None
+    if math.isnan(result):
+        return None
+    return result
+
+
+def lttb(points: List[Tuple[float, float]], threshold: int) -> List[int]:
+    """
+    Largest-Triangle-Three-Buckets downsampling.
+
+    :param points: List of (x, y) points sorted by x
+    :param threshold: The number of points to keep
+    :return: The indexes of the selected points, in order
+    """
+    n = len(points)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+
+    selected = [0]
+    bucket_size = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # average point of the next bucket
+        next_start = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, n)
+        avg_x = sum(p[0] for p in points[next_start:next_end]) / (next_end - next_start)
+        avg_y = sum(p[1] for p in points[next_start:next_end]) / (next_end - next_start)
+
+        # the point in this bucket making the largest triangle with the previous
+        # selected point and the next bucket average
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+        ax, ay = points[a]
+        max_area = -1.0
+        max_index = start
+        for j in range(start, end):
+            area = abs((ax - avg_x) * (points[j][1] - ay) - (ax - points[j][0]) * (avg_y - ay))
+            if area > max_area:
+                max_area = area
+                max_index = j
+        selected.append(max_index)
+        a = max_index
+
+    selected.append(n - 1)
+    return selected
+
+
+class PipelineStage:
+    """
+    Base class for a stage in a DownsamplingPipeline.
+
+    A stage receives every record and returns the records, if any, to pass on to the next stage.
+    """
+
+    def process(self, epoch: float, data: dict) -> List[Record]:
+        return [(epoch, data)]
+
+    def flush(self) -> List[Record]:
+        """
+        Called when the collector stops, so that any buffered records can be emitted.
+        """
+        return []
+
+
+class DeadbandStage(PipelineStage):
+    """
+    Emit a record only when a numeric value changed by more than the deadband since the last emitted record.
+
+    :param deadband: The default absolute change required for a column
+    :param column_deadbands: Per column overrides, e.g. {"co2": 10, "pressure": 0.05}
+    :param max_interval: If set, emit a record at least every max_interval seconds, even when nothing changed.
+    """
+
+    def __init__(self, deadband: float = 0.0, column_deadbands: Dict[str, float] | None = None,
+                 max_interval: float | None = None):
+        self.deadband = deadband
+        self.column_deadbands = column_deadbands or {}
+        self.max_interval = max_interval
+        self.last_emitted: Dict[str, float] = {}
+        self.last_emitted_epoch: float | None = None
+
+    def _changed(self, data: dict) -> bool:
+        for column, value in data.items():
+            if column in NON_SENSOR_COLUMNS:
+                continue
+            value = to_float(value)
+            if value is None:
+                continue
+            last = self.last_emitted.get(column)
+            if last is None or abs(value - last) > self.column_deadbands.get(column, self.deadband):
+                return True
+        return False
+
+    def process(self, epoch: float, data: dict) -> List[Record]:
+        heartbeat = (self.max_interval is not None and self.last_emitted_epoch is not None
+                     and epoch - self.last_emitted_epoch >= self.max_interval)
+        if not heartbeat and not self._changed(data):
+            return []
+
+        for column, value in data.items():
+            value = to_float(value)
+            if column not in NON_SENSOR_COLUMNS and value is not None:
+                self.last_emitted[column] = value
+        self.last_emitted_epoch = epoch
+        return [(epoch, data)]
+
+
+class IntervalAverageStage(PipelineStage):
+    """
+    Average numeric values over fixed, epoch aligned intervals and emit one record per interval.
+
+    Non numeric values keep the last value seen in the interval.
+
+    :param interval: The interval length in seconds
+    :param decimal: The number of decimal places for the averaged values.  Matches DatabotConfig.decimal by default.
+    """
+
+    def __init__(self, interval: float, decimal: int = DatabotConfig.decimal):
+        if interval <= 0:
+            raise ValueError("interval must be greater than 0")
+        self.interval = interval
+        self.decimal = decimal
+        self.window_start: float | None = None
+        self.sums: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+        self.last_values: dict = {}
+
+    def _emit(self) -> List[Record]:
+        if self.window_start is None:
+            return []
+        data = dict(self.last_values)
+        for column, total in self.sums.items():
+            data[column] = round(total / self.counts[column], self.decimal)
+        record = (self.window_start, data)
+
+        self.window_start = None
+        self.sums = {}
+        self.counts = {}
+        self.last_values = {}
+        return [record]
+
+    def process(self, epoch: float, data: dict) -> List[Record]:
+        window_start = math.floor(epoch / self.interval) * self.interval
+        output = []
+        if self.window_start is not None and window_start != self.window_start:
+            output = self._emit()
+        self.window_start = window_start
+
+        for column, value in data.items():
+            numeric = to_float(value) if column not in NON_SENSOR_COLUMNS else None
+            if numeric is None:
+                self.last_values[column] = value
+            else:
+                self.sums[column] = self.sums.get(column, 0.0) + numeric
+                self.counts[column] = self.counts.get(column, 0) + 1
+        return output
+
+    def flush(self) -> List[Record]:
+        return self._emit()
+
+
+class LTTBStage(PipelineStage):
+    """
+    Buffer records and emit a Largest-Triangle-Three-Buckets downsampled subset, intended for display.
+
+    The points are selected using a single column, and the whole record for each selected point is emitted.
+
+    :param column: The data column used to select points, e.g. "co2"
+    :param buffer_size: The number of records to buffer before downsampling
+    :param threshold: The number of records emitted for each full buffer
+    """
+
+    def __init__(self, column: str, buffer_size: int = 1000, threshold: int = 100):
+        if threshold < 3 or buffer_size < threshold:
+            raise ValueError("threshold must be at least 3 and no larger than buffer_size")
+        self.column = column
+        self.buffer_size = buffer_size
+        self.threshold = threshold
+        self.buffer: List[Record] = []
+
+    def _emit(self, threshold: int) -> List[Record]:
+        records = [r for r in self.buffer if to_float(r[1].get(self.column)) is not None]
+        self.buffer = []
+        points = [(epoch, to_float(data[self.column])) for epoch, data in records]
+        return [records[i] for i in lttb(points, threshold)]
+
+    def process(self, epoch: float, data: dict) -> List[Record]:
+        self.buffer.append((epoch, data))
+        if len(self.buffer) >= self.buffer_size:
+            return self._emit(self.threshold)
+        return []
+
+    def flush(self) -> List[Record]:
+        # keep the same reduction ratio for a partially filled buffer
+        threshold = max(3, math.ceil(len(self.buffer) * self.threshold / self.buffer_size))
+        return self._emit(threshold)
+
+
+class DownsamplingPipeline:
+    """
+    An ordered list of PipelineStage objects.  Each record is passed through every stage in turn.
+
+    Usage:
+        pipeline = DownsamplingPipeline([DeadbandStage(column_deadbands={"co2": 10}), IntervalAverageStage(60)])
+    """
+
+    def __init__(self, stages: List[PipelineStage]):
+        self.stages = stages
+        self.records_in = 0
+        self.records_out = 0
+
+    def process(self, epoch: float, data: dict) -> List[Record]:
+        self.records_in += 1
+        records = [(epoch, data)]
+        for stage in self.stages:
+            output = []
+            for record_epoch, record_data in records:
+                output.extend(stage.process(record_epoch, record_data))
+            records = output
+        self.records_out += len(records)
+        return records
+
+    def flush(self) -> List[Record]:
+        records = []
+        for stage in self.stages:
+            # records flushed by earlier stages still pass through this stage
+            output = []
+            for epoch, data in records:
+                output.extend(stage.process(epoch, data))
+            output.extend(stage.flush())
+            records = output
+        self.records_out += len(records)
+        return records
+
+    def reduction_ratio(self) -> float:
+        return self.records_in / self.records_out if self.records_out else 0.0
+
+
+class DownsamplingCollectorMixin:
+    """
+    Mixin for PyDatabot collectors that runs every record through a DownsamplingPipeline before the
+    collector's own process_databot_data (the sink) sees it.
+    """
+
+    def __init__(self, *args, pipeline: DownsamplingPipeline, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pipeline = pipeline
+
+    def process_databot_data(self, epoch, data):
+        for out_epoch, out_data in self.pipeline.process(epoch, data):
+            super().process_databot_data(out_epoch, out_data)
+
+    def flush_pipeline(self):
+        for out_epoch, out_data in self.pipeline.flush():
+            super().process_databot_data(out_epoch, out_data)
+
+    async def async_run(self):
+        try:
+            await super().async_run()
+        finally:
+            try:
+                self.flush_pipeline()
+            except Exception as exc:
+                self.logger.info(f"Pipeline flush stopped: {exc}")
+            self.logger.info(f"Pipeline records in: {self.pipeline.records_in}, out: {self.pipeline.records_out}")
+
+
+class PyDatabotDownsampledSaveToFileDataCollector(DownsamplingCollectorMixin, PyDatabotSaveToFileDataCollector):
+    """
+    PyDatabotSaveToFileDataCollector that only writes the records emitted by a DownsamplingPipeline.
+    """
+
+    def __init__(self, databot_config: DatabotConfig, file_name: str, pipeline: DownsamplingPipeline,
+                 extra_data: dict | None = None, number_of_records_to_collect: int | None = None,
+                 log_level: int = logging.INFO):
+        super().__init__(databot_config, file_name, pipeline=pipeline, extra_data=extra_data,
+                         number_of_records_to_collect=number_of_records_to_collect, log_level=log_level)
+
+
+class PyDatabotDownsampledSaveToQueueDataCollector(DownsamplingCollectorMixin, PyDatabotSaveToQueueDataCollector):
+    """
+    PyDatabotSaveToQueueDataCollector that only queues the records emitted by a DownsamplingPipeline.
+    """
+
+    def __init__(self, databot_config: DatabotConfig, pipeline: DownsamplingPipeline,
+                 extra_data: dict | None = None, queue_size: int = 1,
+                 number_of_records_to_collect: int | None = None, log_level: int = logging.INFO):
+        super().__init__(databot_config, pipeline=pipeline, extra_data=extra_data, queue_size=queue_size,
+                         number_of_records_to_collect=number_of_records_to_collect, log_level=log_level)
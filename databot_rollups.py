@@ -0,0 +1,276 @@
+import math
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+# columns that describe the record rather than a sensor reading
+NON_SENSOR_COLUMNS = {"time", "timestamp"}
+
+# minimum number of seconds between deleting expired buckets of a tier
+PRUNE_INTERVAL = 600
+
+
+@dataclass(frozen=True)
+class RollupTier:
+    """
+    A rollup resolution.
+
+    Attributes:
+        seconds (int): The bucket width in seconds
+        retention (float | None): How many seconds of buckets to keep.  None keeps buckets forever.
+    """
+    seconds: int
+    retention: float | None
+
+
+DEFAULT_TIERS = (
+    RollupTier(seconds=1, retention=24 * 3600),
+    RollupTier(seconds=60, retention=30 * 24 * 3600),
+    RollupTier(seconds=3600, retention=2 * 365 * 24 * 3600),
+    RollupTier(seconds=86400, retention=None),
+)
+
+
+class _Bucket:
+    __slots__ = ("minimum", "maximum", "total", "count")
+
+    def __init__(self, value: float):
+        self.minimum = value
+        self.maximum = value
+        self.total = value
+        self.count = 1
+
+    def add(self, value: float):
+        if value < self.minimum:
+            self.minimum = value
+        if value > self.maximum:
+            self.maximum = value
+        self.total += value
+        self.count += 1
+
+
+def _merge_rows(rows: List[tuple], max_points: int) -> List[tuple]:
+    # (bucket, min, max, sum, count) rows merged into at most max_points rows of consecutive buckets
+    size = math.ceil(len(rows) / max_points)
+    return [(group[0][0], min(r[1] for r in group), max(r[2] for r in group), sum(r[3] for r in group),
+             sum(r[4] for r in group))
+            for group in (rows[i:i + size] for i in range(0, len(rows), size))]
+
+
+class RollupStore:
+    """
+    Multi-resolution min/max/mean/count rollups of the databot sensor values, persisted in SQLite.
+
+    Samples are aggregated in memory for the open bucket of every tier, and written to SQLite when
+    the bucket closes, so the database sees one row per column per bucket instead of one per sample.
+    When other processes query the database, e.g. web server processes separate from the ingestion, the open
+    buckets are also written every flush_interval seconds, so the latest samples are not missing from their queries.
+
+    Usage:
+        store = RollupStore("data/databot_rollups.db")
+        store.add_sample(epoch, {"co2": "412.00", "humidity": "40.1"})
+        store.query(["co2"], start=time.time() - 7 * 86400)
+
+    :param db_path: Path to the SQLite database file.  Use ":memory:" for a non persistent store.
+    :param tiers: The rollup tiers, from finest to coarsest
+    :param commit_interval: The maximum number of seconds between SQLite commits
+    :param flush_interval: The maximum number of seconds between writes of the open buckets, with a commit.
+                           None writes a bucket only when it closes, or on flush().
+    :param read_only: True to only query a database written by another process.  The database must exist: it is
+                      opened read only, without creating the tables, so readers do not compete for the write lock.
+    """
+
+    def __init__(self, db_path: str = "data/databot_rollups.db", tiers: Tuple[RollupTier, ...] = DEFAULT_TIERS,
+                 commit_interval: float = 5.0, flush_interval: float | None = None, read_only: bool = False):
+        self.tiers = tuple(sorted(tiers, key=lambda t: t.seconds))
+        self.commit_interval = commit_interval
+        self.flush_interval = flush_interval
+        self.read_only = read_only
+        self._lock = threading.Lock()
+        # open buckets: tier seconds -> (bucket start, column -> _Bucket)
+        self._open: Dict[int, Tuple[int, Dict[str, _Bucket]]] = {}
+        self._last_commit = time.monotonic()
+        self._last_flush = time.monotonic()
+        self._last_prune: Dict[int, float] = {}
+        if read_only:
+            self._connection = sqlite3.connect(Path(db_path).resolve().as_uri() + "?mode=ro", uri=True,
+                                               check_same_thread=False)
+            return
+
+        if db_path != ":memory:":
+            Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS rollups (
+                tier INTEGER NOT NULL,
+                bucket INTEGER NOT NULL,
+                column_name TEXT NOT NULL,
+                min_value REAL NOT NULL,
+                max_value REAL NOT NULL,
+                sum_value REAL NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (tier, column_name, bucket)
+            ) WITHOUT ROWID
+        """)
+        self._connection.execute("CREATE INDEX IF NOT EXISTS rollups_tier_bucket ON rollups (tier, bucket)")
+        self._connection.commit()
+
+    def add_sample(self, epoch: float, data: dict):
+        """
+        Add a databot record to every tier.
+
+        :param epoch: The epoch timestamp of the record
+        :param data: The databot record.  Non numeric values are ignored.
+        """
+        values = {}
+        for column, value in data.items():
+            if column in NON_SENSOR_COLUMNS:
+                continue
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                continue
+            if not math.isnan(value):
+                values[column] = value
+        if not values:
+            return
+
+        with self._lock:
+            for tier in self.tiers:
+                bucket_start = int(epoch // tier.seconds) * tier.seconds
+                open_bucket = self._open.get(tier.seconds)
+                if open_bucket is not None and open_bucket[0] != bucket_start:
+                    self._write_bucket(tier.seconds, *open_bucket)
+                    self._prune(tier, bucket_start)
+                    open_bucket = None
+                if open_bucket is None:
+                    open_bucket = (bucket_start, {})
+                    self._open[tier.seconds] = open_bucket
+
+                columns = open_bucket[1]
+                for column, value in values.items():
+                    bucket = columns.get(column)
+                    if bucket is None:
+                        columns[column] = _Bucket(value)
+                    else:
+                        bucket.add(value)
+
+            if self.flush_interval is not None and time.monotonic() - self._last_flush >= self.flush_interval:
+                self._write_open_buckets()
+                self._commit()
+            elif time.monotonic() - self._last_commit >= self.commit_interval:
+                self._commit()
+
+    def _write_bucket(self, tier_seconds: int, bucket_start: int, columns: Dict[str, _Bucket]):
+        # a bucket may already have been partially written by flush(), so merge with what is stored
+        self._connection.executemany("""
+            INSERT INTO rollups (tier, bucket, column_name, min_value, max_value, sum_value, count)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (tier, column_name, bucket) DO UPDATE SET
+                min_value = MIN(min_value, excluded.min_value),
+                max_value = MAX(max_value, excluded.max_value),
+                sum_value = sum_value + excluded.sum_value,
+                count = count + excluded.count
+        """, [(tier_seconds, bucket_start, column, b.minimum, b.maximum, b.total, b.count)
+              for column, b in columns.items()])
+
+    def _prune(self, tier: RollupTier, now_bucket: int):
+        if tier.retention is None:
+            return
+        # expired buckets only need to be removed occasionally
+        if now_bucket - self._last_prune.get(tier.seconds, 0) >= max(tier.seconds, PRUNE_INTERVAL):
+            self._last_prune[tier.seconds] = now_bucket
+            self._connection.execute("DELETE FROM rollups WHERE tier = ? AND bucket < ?",
+                                     (tier.seconds, now_bucket - tier.retention))
+
+    def _write_open_buckets(self):
+        # the open buckets are written as partial buckets and restarted empty; _write_bucket merges the rest of a
+        # bucket into what was written
+        for tier_seconds, (bucket_start, columns) in self._open.items():
+            self._write_bucket(tier_seconds, bucket_start, columns)
+            self._open[tier_seconds] = (bucket_start, {})
+        self._last_flush = time.monotonic()
+
+    def _commit(self):
+        self._connection.commit()
+        self._last_commit = time.monotonic()
+
+    def flush(self):
+        """
+        Write the open buckets to SQLite and commit.
+        """
+        with self._lock:
+            self._write_open_buckets()
+            self._commit()
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._connection.close()
+
+    def select_tier(self, start: float, end: float, max_points: int) -> RollupTier:
+        """
+        Select the finest tier that still returns at most max_points buckets per column and whose
+        retention reaches back to start.  Falls back to the coarsest tier, whose buckets query merges down to
+        max_points.
+        """
+        now = time.time()
+        for tier in self.tiers:
+            # the buckets the range touches, including the partial buckets at both ends
+            if int(end // tier.seconds) - int(start // tier.seconds) + 1 > max_points:
+                continue
+            if tier.retention is not None and start < now - tier.retention:
+                continue
+            return tier
+        return self.tiers[-1]
+
+    def query(self, columns: List[str], start: float, end: float | None = None, max_points: int = 500) -> dict:
+        """
+        Query the rollups for a time range, using the tier selected by select_tier.
+
+        :param columns: The data columns to return, e.g. ["co2", "humidity"]
+        :param start: Epoch start of the range
+        :param end: Epoch end of the range.  Defaults to now.
+        :param max_points: The maximum number of points returned per column.  When even the coarsest tier has more
+                           buckets, consecutive buckets are merged into one point.
+        :return: dict with the selected tier and, per column, an overall summary and the bucket points
+        """
+        if end is None:
+            end = time.time()
+        tier = self.select_tier(start, end, max_points)
+        bucket_start = int(start // tier.seconds) * tier.seconds
+
+        response = {"tier_seconds": tier.seconds, "start": start, "end": end, "columns": {}}
+        with self._lock:
+            # include the data still aggregating in memory.  Nothing is open in a process that only queries.
+            if any(open_columns for _, open_columns in self._open.values()):
+                self._write_open_buckets()
+                self._commit()
+            for column in columns:
+                rows = self._connection.execute("""
+                    SELECT bucket, min_value, max_value, sum_value, count FROM rollups
+                    WHERE tier = ? AND column_name = ? AND bucket >= ? AND bucket <= ?
+                    ORDER BY bucket
+                """, (tier.seconds, column, bucket_start, end)).fetchall()
+                if not rows:
+                    response["columns"][column] = {"count": 0, "points": []}
+                    continue
+
+                total = sum(r[3] for r in rows)
+                count = sum(r[4] for r in rows)
+                if len(rows) > max_points:
+                    rows = _merge_rows(rows, max_points)
+                response["columns"][column] = {
+                    "min": min(r[1] for r in rows),
+                    "max": max(r[2] for r in rows),
+                    "mean": total / count,
+                    "count": count,
+                    "points": [{"start": r[0], "min": r[1], "max": r[2], "mean": r[3] / r[4], "count": r[4]}
+                               for r in rows]
+                }
+        return response
@@ -0,0 +1,207 @@
+# Sensor metadata for the databot.
+#
+# This is the `databot_sensors` dictionary from `databot.PyDatabot`, kept in a module without the bleak and bottle
+# imports so the chat app can use it without loading the BLE stack.  Keep it in sync with databot-py.
+# The 'unit' of each sensor is not part of databot-py; it is the unit of the sensor's data columns.
+
+# DatabotConfig.decimal, the number of decimal places of the sensor values
+DATABOT_DECIMAL = 2
+
+databot_sensors = {
+    'accl': {
+        'sensor_name': 'accl',
+        'friendly_name': 'Acceleration',
+        'save': False,
+        'display': False,
+        'data_columns': ['acceleration_x', 'acceleration_y', 'acceleration_z', 'absolute_acceleration'],
+        'unit': 'm/s²'
+    },
+    'Laccl': {
+        'sensor_name': 'Laccl',
+        'friendly_name': 'Linear Acceleration',
+        'save': False,
+        'display': False,
+        'data_columns': ['linear_acceleration_x', 'linear_acceleration_y', 'linear_acceleration_z',
+                         'absolute_linear_acceleration'],
+        'unit': 'm/s²'
+    },
+    'gyro': {
+        'sensor_name': 'gyro',
+        'friendly_name': 'Gyroscope',
+        'save': False,
+        'display': False,
+        'data_columns': ['gyro_x', 'gyro_y', 'gyro_z'],
+        'unit': '°/s'
+    },
+    'magneto': {
+        'sensor_name': 'magneto',
+        'friendly_name': 'Magneto',
+        'save': False,
+        'display': False,
+        'data_columns': ['mag_x', 'mag_y', 'mag_z'],
+        'unit': 'µT'
+
+    },
+    # 'IMUTemp': {
+    #     'sensor_name': 'IMUTemp',
+    #     'friendly_name': 'IMU Temperature',
+    #     'save': False,
+    #     'display': False
+    # },
+    'Etemp1': {
+        'sensor_name': 'Etemp1',
+        'friendly_name': 'External Temperature 1',
+        'save': False,
+        'display': False,
+        'data_columns': ['external_temp_1'],
+        'unit': '°C'
+    },
+    'Etemp2': {
+        'sensor_name': 'Etemp2',
+        'friendly_name': 'External Temperature 2',
+        'save': False,
+        'display': False,
+        'data_columns': ['external_temp_2'],
+        'unit': '°C'
+    },
+    'pressure': {
+        'sensor_name': 'pressure',
+        'friendly_name': 'Atmospheric Pressure',
+        'save': False,
+        'display': False,
+        'data_columns': ['pressure'],
+        'unit': 'kPa'
+    },
+    'alti': {
+        'sensor_name': 'alti',
+        'friendly_name': 'Altimeter',
+        'save': False,
+        'display': False,
+        'data_columns': ['altitude'],
+        'unit': 'm'
+    },
+    'ambLight': {
+        'sensor_name': 'ambLight',
+        'friendly_name': 'Ambient Light',
+        'save': False,
+        'display': False,
+        'data_columns': ['ambient_light_in_lux'],
+        'unit': 'lux'
+    },
+    'rgbLight': {
+        'sensor_name': 'rgbLight',
+        'friendly_name': 'RGB Light',
+        'save': False,
+        'display': False,
+        'data_columns': ['r_light', 'g_light', 'b_light'],
+        'unit': None
+    },
+    'UV': {
+        'sensor_name': 'UV',
+        'friendly_name': 'UltraViolet Light',
+        'save': False,
+        'display': False,
+        'data_columns': ['uv_index'],
+        'unit': None
+    },
+    'co2': {
+        'sensor_name': 'co2',
+        'friendly_name': 'CO2',
+        'save': False,
+        'display': False,
+        'data_columns': ['co2'],
+        'unit': 'ppm'
+    },
+    'voc': {
+        'sensor_name': 'voc',
+        'friendly_name': 'Volatile Organic Compound',
+        'save': False,
+        'display': False,
+        'data_columns': ['voc'],
+        'unit': 'ppb'
+    },
+    'hum': {
+        'sensor_name': 'hum',
+        'friendly_name': 'Humidity',
+        'save': False,
+        'display': False,
+        'data_columns': ['humidity'],
+        'unit': '%'
+    },
+    'humTemp': {
+        'sensor_name': 'humTemp',
+        'friendly_name': 'Humidity Adjusted Temperature',
+        'save': False,
+        'display': False,
+        'data_columns': ['humidity_temperature'],
+        'unit': '°C'
+    },
+    # 'Sdist': {
+    #     'sensor_name': 'Sdist',
+    #     'friendly_name': 'Short Distance',
+    #     'save': False,
+    #     'display': False,
+    #     'data_columns': ['distance']
+    # },
+    'noise': {
+        'sensor_name': 'noise',
+        'friendly_name': 'Noise',
+        'save': False,
+        'display': False,
+        'data_columns': ['noise_sound'],
+        'unit': 'dB'
+    },
+    'Ldist': {
+        'sensor_name': 'Ldist',
+        'friendly_name': 'Long Distance',
+        'save': False,
+        'display': False,
+        'data_columns': ['distance'],
+        'unit': 'mm'
+
+    },
+    'gesture': {
+        'sensor_name': 'gesture',
+        'friendly_name': 'Gesture',
+        'save': False,
+        'display': False,
+        'data_columns': ['gesture'],
+        'unit': None
+    },
+
+}
+
+# Columns computed from the data columns by databot_signals.DerivedSignalEngine.  The 'sensors' of a derived column
+# are the sensors it is reported with; it needs the data columns of all of them.
+derived_signals = {
+    'external_temp_1_f': {'sensors': ['Etemp1'], 'unit': '°F'},
+    'external_temp_2_f': {'sensors': ['Etemp2'], 'unit': '°F'},
+    'humidity_temperature_f': {'sensors': ['humTemp'], 'unit': '°F'},
+    'dew_point': {'sensors': ['hum', 'humTemp'], 'unit': '°C'},
+    'dew_point_f': {'sensors': ['hum', 'humTemp'], 'unit': '°F'},
+    'acceleration_g': {'sensors': ['accl'], 'unit': 'g'},
+    'linear_acceleration_g': {'sensors': ['Laccl'], 'unit': 'g'},
+    'gyro_magnitude': {'sensors': ['gyro'], 'unit': '°/s'},
+    'mag_magnitude': {'sensors': ['magneto'], 'unit': 'µT'},
+    'pressure_altitude': {'sensors': ['pressure'], 'unit': 'm'},
+    'co2_avg_60s': {'sensors': ['co2'], 'unit': 'ppm'},
+    'voc_avg_60s': {'sensors': ['voc'], 'unit': 'ppb'},
+}
+
+
+def get_derived_columns(sensor_name: str) -> list:
+    """
+    The derived columns reported with a sensor, e.g. ["co2_avg_60s"] for "co2".
+    """
+    return [column for column, signal in derived_signals.items() if sensor_name in signal['sensors']]
+
+
+def get_column_units() -> dict:
+    """
+    The unit of every data column and derived column that has one, e.g. {"co2": "ppm"}.
+    """
+    units = {column: sensor['unit']
+             for sensor in databot_sensors.values() if sensor.get('unit')
+             for column in sensor['data_columns']}
+    units.update({column: signal['unit'] for column, signal in derived_signals.items()})
+    return units
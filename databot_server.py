@@ -0,0 +1,634 @@
+import asyncio
+import json
+import logging
+import socket
+import threading
+import time
+from functools import wraps
+from typing import Dict
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIServer
+
+from bottle import Bottle, ServerAdapter, request, response, run
+from databot.PyDatabot import PyDatabotSaveToQueueDataCollector, DatabotConfig, ProcessDatabotDataComplete, \
+    StopGatheringData, response_mapping
+
+from databot_alerts import AlertDetector, AlertEventReader
+from databot_bus import DatabotBus
+from databot_metrics import DEFAULT_AGE_BUCKETS, MetricsRegistry, RateLimitedLog
+from databot_rollups import RollupStore
+from databot_shm import RecordTooLargeError, SampleRing
+from databot_signals import DerivedSignalEngine
+
+# the metrics of the databot web server, served at /metrics.  Rates, e.g. notifications per second, are
+# computed from the counters by the metrics server, e.g. rate(databot_notifications_total[1m]) in Prometheus.
+metrics = MetricsRegistry()
+_notifications_total = metrics.counter("databot_notifications_total", "BLE notifications received from the databot")
+_parse_errors_total = metrics.counter("databot_parse_errors_total",
+                                      "Notifications that could not be decoded, and fields with an unknown key")
+_records_total = metrics.counter("databot_records_total", "Records processed")
+_samples_total = metrics.counter("databot_samples_total", "Sensor values received, per data column", ("column",))
+_queue_depth = metrics.gauge("databot_queue_depth", "Notifications waiting to be processed")
+_sample_age_seconds = metrics.histogram("databot_sample_age_seconds",
+                                        "Age of the latest record when it is read through the web server",
+                                        buckets=DEFAULT_AGE_BUCKETS)
+_http_request_seconds = metrics.histogram("databot_http_request_duration_seconds",
+                                          "Web server request latency", ("route",))
+_ble_connects_total = metrics.counter("databot_ble_connects_total", "BLE connections to the databot")
+_ble_reconnects_total = metrics.counter("databot_ble_reconnects_total",
+                                        "BLE connections to the databot after the first one")
+_alerts_total = metrics.counter("databot_alerts_total", "Alert events, per rule and severity", ("rule", "severity"))
+_ring_sequence = metrics.gauge("databot_ring_sequence",
+                               "Sequence number of the latest record in the shared memory ring buffer")
+_ring_missed_total = metrics.counter("databot_ring_missed_records_total",
+                                     "Records overwritten in the shared memory ring buffer before this process "
+                                     "read them")
+
+# the metrics counted by the BLE ingestion.  With separate server processes, the ingestion process exports them to
+# a SampleRing with export_ingestion_metrics, and the servers serve them in place of their own.
+_INGESTION_METRICS = tuple(metric.name for metric in (_notifications_total, _parse_errors_total, _records_total,
+                                                      _samples_total, _queue_depth, _ble_connects_total,
+                                                      _ble_reconnects_total, _alerts_total))
+
+# record columns that are not sensor values
+_NON_SAMPLE_COLUMNS = {"time", "timestamp"}
+
+# the longest a /latest request waits for a fresh record
+MAX_READ_WAIT = 5.0
+
+
+def _latest_response(latest_values: Dict[str, tuple], latest_epoch: float | None, max_age: float | None) -> dict:
+    """
+    The /latest response for the latest value and update epoch of every column.
+    """
+    now = time.time()
+    sample_age = now - latest_epoch if latest_epoch is not None else None
+    return {
+        "timestamp": latest_epoch,
+        "sample_age_s": round(sample_age, 3) if sample_age is not None else None,
+        "stale": latest_epoch is None or (max_age is not None and sample_age > max_age),
+        "max_age_s": max_age,
+        "values": {column: value for column, (value, _) in latest_values.items()},
+        "column_updated": {column: epoch for column, (_, epoch) in latest_values.items()},
+        "column_age_s": {column: round(now - epoch, 3) for column, (_, epoch) in latest_values.items()}
+    }
+
+
+def _is_stale(latest_epoch: float | None, max_age: float | None) -> bool:
+    return max_age is not None and (latest_epoch is None or time.time() - latest_epoch > max_age)
+
+
+class DatabotServerDataCollector(PyDatabotSaveToQueueDataCollector):
+    """
+    DatabotServerDataCollector
+
+    The PyDatabotSaveToQueueDataCollector used by the databot web server.  In addition to keeping the latest
+    record in the queue, every record is added to an optional RollupStore so history queries do not have to
+    scan raw samples.
+
+    Notifications, parse errors, samples and connections are counted in the server metrics.  Records are
+    logged at most once every log_interval seconds instead of once per record.
+
+    The latest value and update time of every column are kept, so reads report how fresh the data is, see
+    read_latest.
+
+    With a SampleRing, every record is also published to the ring, so web servers in other processes can read
+    it, see SampleRingReader.
+
+    Records are broadcast on a DatabotBus.  The queue ("queue"), the rollups ("aggregate") and the ring
+    ("stream") are subscribers of the bus, and more can subscribe to share the BLE connection, e.g.
+    bus.subscribe("file", FileSink("data/capture.txt")).  The rollups are written on the thread of their
+    subscription, so SQLite does not hold up the notifications.
+
+    With a DerivedSignalEngine, the derived columns, e.g. dew_point, are read with the data columns.  With an
+    AlertDetector, every record is checked by the alert rules as it arrives.
+
+    The BLE connection is kept up while data is collected: when connecting fails, or no notification arrives
+    for stall_timeout seconds (a dropped connection), the databot is connected again, after a delay that doubles
+    up to max_reconnect_delay.  The stall_timeout includes the scan and setup of a new connection, which take
+    up to about 15 seconds.
+
+    Attributes:
+        rollup_store (RollupStore | None): The store that maintains the multi-resolution rollups.
+        sample_ring (SampleRing | None): The shared memory ring buffer the records are published to.
+        signal_engine (DerivedSignalEngine | None): Computes the derived columns.
+        alerts (AlertDetector | None): Runs the alert rules.
+        bus (DatabotBus): The bus the records are broadcast on.
+    """
+
+    def __init__(self, databot_config: DatabotConfig, rollup_store: RollupStore | None = None,
+                 sample_ring: SampleRing | None = None, signal_engine: DerivedSignalEngine | None = None,
+                 alerts: AlertDetector | None = None, bus: DatabotBus | None = None,
+                 extra_data: dict | None = None, queue_size: int = 1,
+                 number_of_records_to_collect: int | None = None,
+                 log_level: int = logging.INFO, log_interval: float = 10.0, stall_timeout: float = 30.0,
+                 reconnect_delay: float = 1.0, max_reconnect_delay: float = 30.0):
+        super().__init__(databot_config, extra_data=extra_data, queue_size=queue_size,
+                         number_of_records_to_collect=number_of_records_to_collect, log_level=log_level)
+        self.rollup_store = rollup_store
+        self.sample_ring = sample_ring
+        self.signal_engine = signal_engine
+        self.alerts = alerts
+        self.bus = bus if bus is not None else DatabotBus()
+        self.bus.subscribe("queue", self._queue_record, inline=True)
+        if rollup_store is not None:
+            self.bus.subscribe("aggregate", rollup_store.add_sample, buffer_size=10000)
+        if sample_ring is not None:
+            self.bus.subscribe("stream", self._publish_to_ring, inline=True)
+        if signal_engine is not None:
+            # adding a record is a row write, the derived columns are computed when they are read
+            self.bus.subscribe("derived", signal_engine.add, inline=True)
+        if alerts is not None:
+            # the rules keep constant state per rule, so they run inline and fire on the record that breaks them
+            self.bus.subscribe("alerts", alerts.process, inline=True)
+            alerts.bus.subscribe("metrics", lambda epoch, event: _alerts_total.inc(rule=event["rule"],
+                                                                                 severity=event["severity"]),
+                                 inline=True)
+        _queue_depth.set_function(self.queue.qsize)
+        self._record_log = RateLimitedLog(self.logger, interval=log_interval)
+        self.stall_timeout = stall_timeout
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self._connects = 0
+        self._last_notification = time.monotonic()
+        # column -> (value, epoch of the record it came from), guarded by _latest_condition
+        self._latest_values: Dict[str, tuple] = {}
+        self._latest_epoch: float | None = None
+        self._latest_condition = threading.Condition()
+
+    def read_latest(self, max_age: float | None = None, wait: float = 0.0) -> dict:
+        """
+        The latest value of every column, with how old it is.
+
+        :param max_age: The age in seconds after which the data is stale.  None never marks it stale.
+        :param wait: When the data is stale, the number of seconds to wait for the next record before returning
+                     the stale data
+        :return: dict with the latest "values", the epoch of the latest record as "timestamp", its age as
+                 "sample_age_s", the update epoch and age of every column as "column_updated" and "column_age_s",
+                 and "stale": True when the latest record is older than max_age, or there is no record at all.
+        """
+        deadline = time.monotonic() + wait
+        with self._latest_condition:
+            while _is_stale(self._latest_epoch, max_age):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._latest_condition.wait(remaining)
+            latest_values = dict(self._latest_values)
+            latest_epoch = self._latest_epoch
+
+        if self.signal_engine is not None:
+            latest_values.update(self.signal_engine.latest())
+        return _latest_response(latest_values, latest_epoch, max_age)
+
+    async def connect(self):
+        if self._connects > 0:
+            _ble_reconnects_total.inc()
+        self._connects += 1
+        _ble_connects_total.inc()
+        await super().connect()
+
+    async def process_sensor_data(self, characteristic: str, raw_data: bytearray):
+        # the parsing of PyDatabot.process_sensor_data, counting what it silently drops
+        _notifications_total.inc()
+        self._last_notification = time.monotonic()
+        try:
+            data = raw_data.decode()
+        except UnicodeDecodeError:
+            _parse_errors_total.inc()
+            return
+
+        data_dict = {}
+        for data_field in data.split(";"):
+            if not data_field:
+                continue
+            column = response_mapping.get(data_field[0:1])
+            if column is None:
+                _parse_errors_total.inc()
+                continue
+            data_dict[column] = data_field[1:]
+
+        await self.queue.put((time.time(), data_dict))
+
+    def _queue_record(self, epoch: float, data: dict):
+        # the "queue" subscriber: the latest record and column values read by the web server
+        self.q.add(json.dumps(data))
+        with self._latest_condition:
+            for column, value in data.items():
+                if column not in _NON_SAMPLE_COLUMNS and value != "" and \
+                        (self.extra_data is None or column not in self.extra_data):
+                    _samples_total.inc(column=column)
+                    self._latest_values[column] = (value, epoch)
+            self._latest_epoch = epoch
+            self._latest_condition.notify_all()
+
+    def _publish_to_ring(self, epoch: float, data: dict):
+        # the "stream" subscriber
+        try:
+            self.sample_ring.publish(data)
+        except RecordTooLargeError as exc:
+            _parse_errors_total.inc()
+            self._record_log.log(logging.WARNING, "Record not published: %s", exc)
+
+    def process_databot_data(self, epoch, data):
+        # PyDatabotSaveToQueueDataCollector.process_databot_data, publishing to the bus, and without its per
+        # record INFO and DEBUG logging
+        data['timestamp'] = epoch
+        if self.extra_data is not None:
+            data.update(**self.extra_data)
+
+        self.bus.publish(epoch, data)
+        _records_total.inc()
+
+        self._record_log.log(logging.INFO, "Time: %s - Queued record[%s]", data.get('time'), self.record_number)
+        self.record_number = self.record_number + 1
+        if self.number_of_records_to_collect is not None:
+            if self.record_number >= self.number_of_records_to_collect:
+                raise ProcessDatabotDataComplete("Done collecting data")
+
+    async def _watch_connection(self):
+        # PyDatabot.connect holds the connection until data collection stops, and does not notice when the
+        # databot goes away, so a connection without notifications for stall_timeout seconds is dropped
+        self._last_notification = time.monotonic()
+        connection = asyncio.ensure_future(self.connect())
+        try:
+            while True:
+                done, _ = await asyncio.wait({connection}, timeout=1.0)
+                if done:
+                    return connection.result()
+                if time.monotonic() - self._last_notification > self.stall_timeout:
+                    self.logger.warning("No notifications for %.0f seconds, reconnecting", self.stall_timeout)
+                    return
+        finally:
+            # the errors of a connection going away are dropped, e.g. stop_notify fails on a disconnected client
+            connection.cancel()
+            await asyncio.gather(connection, return_exceptions=True)
+
+    async def _stay_connected(self):
+        # the connect task of PyDatabot.async_run, connecting again after a failure or a dropped connection
+        delay = self.reconnect_delay
+        while self.collect_data:
+            connected_at = time.monotonic()
+            try:
+                await self._watch_connection()
+            except StopGatheringData:
+                raise
+            except Exception as exc:
+                self.logger.warning("BLE connection failed: %r", exc)
+            if not self.collect_data:
+                raise StopGatheringData()
+            if self._last_notification > connected_at:
+                # the connection delivered data, so the databot was reachable
+                delay = self.reconnect_delay
+            self.logger.info("Reconnecting in %.1f seconds", delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+        raise StopGatheringData()
+
+    async def async_run(self):
+        connection = asyncio.ensure_future(self._stay_connected())
+        try:
+            await asyncio.gather(connection, self.run_queue_consumer())
+        except StopGatheringData:
+            self.logger.info("Stop gathering data")
+        except ProcessDatabotDataComplete:
+            self.logger.info("Completed Processing Data")
+        except Exception as exc:
+            self.logger.exception(exc)
+        finally:
+            # the connection is closed before returning, when the queue consumer stopped first
+            connection.cancel()
+            await asyncio.gather(connection, return_exceptions=True)
+            # delivers the buffered records, e.g. to the rollups, before they are flushed
+            self.bus.close()
+            if self.rollup_store is not None:
+                self.rollup_store.flush()
+
+
+def export_ingestion_metrics(metrics_ring: SampleRing, interval: float = 1.0) -> threading.Thread:
+    """
+    Publish the ingestion metrics of this process to a SampleRing every interval seconds, in the Prometheus text
+    format, so the web servers in other processes serve them at /metrics, see SampleRingReader.
+
+    :param metrics_ring: The ring, with slots large enough for the rendered metrics
+    :param interval: The number of seconds between exports
+    """
+
+    def export():
+        while True:
+            try:
+                metrics_ring.publish({"timestamp": time.time(), "text": metrics.render(names=_INGESTION_METRICS)})
+            except RecordTooLargeError as exc:
+                logging.warning(f"Could not export the ingestion metrics: {exc}")
+            time.sleep(interval)
+
+    t = threading.Thread(target=export, name="metrics-export", daemon=True)
+    t.start()
+    return t
+
+
+class SampleRingReader:
+    """
+    SampleRingReader
+
+    Reads the records a DatabotServerDataCollector in another process publishes to a SampleRing, for a web
+    server that does not run the BLE ingestion itself.  It provides the reads of the collector used by the
+    web server: get_item, read_latest and the rollup_store.
+
+    The reader follows the ring with its own sequence number, so reads never wait on the ingestion process.
+
+    :param sample_ring: The ring, attached with SampleRing.attach
+    :param rollup_store: The RollupStore the ingestion process writes to, opened on the same database file
+    :param signal_engine: Computes the derived columns from the records read from the ring
+    :param alerts: Reads the alert events of the AlertDetector of the ingestion process
+    :param metrics_ring: The ring the ingestion process exports its metrics to, see export_ingestion_metrics
+    :param poll_interval: The number of seconds between checks for a new record while read_latest waits
+    """
+
+    def __init__(self, sample_ring: SampleRing, rollup_store: RollupStore | None = None,
+                 signal_engine: DerivedSignalEngine | None = None, alerts: AlertEventReader | None = None,
+                 metrics_ring: SampleRing | None = None, poll_interval: float = 0.05):
+        self.sample_ring = sample_ring
+        self.rollup_store = rollup_store
+        self.signal_engine = signal_engine
+        self.alerts = alerts
+        self.metrics_ring = metrics_ring
+        self.poll_interval = poll_interval
+        self._sequence = 0
+        self._latest_record: dict | None = None
+        # column -> (value, epoch of the record it came from)
+        self._latest_values: Dict[str, tuple] = {}
+        self._latest_epoch: float | None = None
+        self._lock = threading.Lock()
+
+    def _catch_up(self):
+        # the records published since the last read, only the latest value of every column is kept
+        with self._lock:
+            if self.sample_ring.latest_sequence() == self._sequence:
+                return
+            records, missed = self.sample_ring.read_since(self._sequence)
+            if missed:
+                _ring_missed_total.inc(missed)
+            for sequence, record in records:
+                epoch = record.get("timestamp")
+                if self.signal_engine is not None:
+                    self.signal_engine.add(epoch, record)
+                for column, value in record.items():
+                    if column not in _NON_SAMPLE_COLUMNS and value != "":
+                        self._latest_values[column] = (value, epoch)
+                self._latest_epoch = epoch
+                self._latest_record = record
+                self._sequence = sequence
+
+    def get_item(self) -> str | None:
+        """
+        The latest record as json, as PyDatabotSaveToQueueDataCollector.get_item.
+        """
+        self._catch_up()
+        with self._lock:
+            return json.dumps(self._latest_record) if self._latest_record is not None else None
+
+    def read_latest(self, max_age: float | None = None, wait: float = 0.0) -> dict:
+        """
+        The latest value of every column, with how old it is.  See DatabotServerDataCollector.read_latest.
+        """
+        deadline = time.monotonic() + wait
+        self._catch_up()
+        while _is_stale(self._latest_epoch, max_age) and time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+            self._catch_up()
+        with self._lock:
+            latest_values = dict(self._latest_values)
+            latest_epoch = self._latest_epoch
+        if self.signal_engine is not None:
+            latest_values.update(self.signal_engine.latest())
+        return _latest_response(latest_values, latest_epoch, max_age)
+
+    def read_ingestion_metrics(self) -> str | None:
+        """
+        The metrics last exported by the ingestion process, in the Prometheus text format, or None if none were
+        exported yet.
+        """
+        latest = self.metrics_ring.read_latest() if self.metrics_ring is not None else None
+        return latest[1]["text"] if latest is not None else None
+
+
+# private reference to the queue based databot collector, or the SampleRingReader of a server process,
+# used by the web server to retrieve databot data
+_web_databot: DatabotServerDataCollector | SampleRingReader | None = None
+_bottle_app: Bottle | None = None
+
+
+def _timed(route: str, callback):
+    @wraps(callback)
+    def timed_callback(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return callback(*args, **kwargs)
+        finally:
+            _http_request_seconds.observe(time.perf_counter() - start, route=route)
+
+    return timed_callback
+
+
+def _databot_index():
+    if _web_databot is None:
+        return {
+            "message": "reference to DatabotServerDataCollector is None"
+        }
+
+    item = _web_databot.get_item()
+    if item is not None:
+        _sample_age_seconds.observe(time.time() - json.loads(item)["timestamp"])
+    return item
+
+
+def _databot_metrics():
+    response.content_type = "text/plain; version=0.0.4; charset=utf-8"
+    if isinstance(_web_databot, SampleRingReader) and _web_databot.metrics_ring is not None:
+        # the ingestion runs in another process, its metrics are the ones it exported rather than this process's
+        return metrics.render(exclude=_INGESTION_METRICS) + (_web_databot.read_ingestion_metrics() or "")
+    return metrics.render()
+
+
+def _databot_latest():
+    """
+    The latest value of every column with its age.
+
+    Query parameters:
+        max_age: the age in seconds after which the data is stale
+        wait: the number of seconds to wait for a new record when the data is stale
+    """
+    if _web_databot is None:
+        return {
+            "message": "reference to DatabotServerDataCollector is None"
+        }
+
+    max_age = request.query.get("max_age")
+    latest = _web_databot.read_latest(max_age=float(max_age) if max_age else None,
+                                      wait=min(float(request.query.get("wait", 0)), MAX_READ_WAIT))
+    if latest["sample_age_s"] is not None:
+        _sample_age_seconds.observe(latest["sample_age_s"])
+    return latest
+
+
+def _databot_derived():
+    """
+    The recent rows of the derived columns.
+
+    Query parameters:
+        columns: comma separated derived or data columns, e.g. dew_point,co2_avg_60s.  Defaults to every derived
+                 column.
+        seconds: the number of seconds of rows, up to the latest record
+    """
+    if _web_databot is None or _web_databot.signal_engine is None:
+        return {
+            "message": "The databot web server was not started with a DerivedSignalEngine"
+        }
+
+    engine = _web_databot.signal_engine
+    columns = [c for c in request.query.get("columns", "").split(",") if c] or [s.name for s in engine.signals]
+    seconds = request.query.get("seconds")
+    return engine.history(columns, seconds=float(seconds) if seconds else None)
+
+
+def _databot_events():
+    """
+    The recent alert events, newest first.
+
+    Query parameters:
+        seconds: only the events of the last seconds
+        since_id: only the events after this event_id, to poll for new events
+        limit: the maximum number of events
+    """
+    if _web_databot is None or _web_databot.alerts is None:
+        return {
+            "message": "The databot web server was not started with an AlertDetector"
+        }
+
+    seconds = request.query.get("seconds")
+    return {
+        "events": _web_databot.alerts.recent_events(seconds=float(seconds) if seconds else None,
+                                                    since_id=int(request.query.get("since_id", 0)),
+                                                    limit=int(request.query.get("limit", 50)))
+    }
+
+
+def _databot_history():
+    """
+    Query the rollups.
+
+    Query parameters:
+        columns: comma separated data columns, e.g. co2,humidity
+        seconds: the number of seconds of history ending now.  Ignored if start is given.
+        start, end: epoch range
+        max_points: the maximum number of buckets per column
+    """
+    if _web_databot is None or _web_databot.rollup_store is None:
+        return {
+            "message": "The databot web server was not started with a RollupStore"
+        }
+
+    columns = [c for c in request.query.get("columns", "").split(",") if c]
+    end = float(request.query.get("end", time.time()))
+    start = float(request.query.get("start", end - float(request.query.get("seconds", 3600))))
+    max_points = int(request.query.get("max_points", 500))
+
+    return _web_databot.rollup_store.query(columns, start=start, end=end, max_points=max_points)
+
+
+class _ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    # every request on its own thread, so a /latest request waiting for a new record does not hold up the others
+    daemon_threads = True
+
+
+class _ReusePortWSGIServer(_ThreadingWSGIServer):
+    def server_bind(self):
+        # several server processes listen on the same port, and the kernel spreads the connections over them
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+
+class _ThreadingServer(ServerAdapter):
+    """
+    The bottle wsgiref server, handling every request on its own thread.
+    """
+    server_class = _ThreadingWSGIServer
+
+    def run(self, handler):
+        from wsgiref.simple_server import WSGIRequestHandler, make_server
+
+        class QuietHandler(WSGIRequestHandler):
+            def log_request(*args, **kwargs):
+                if not self.quiet:
+                    return WSGIRequestHandler.log_request(*args, **kwargs)
+
+        make_server(self.host, self.port, handler, server_class=self.server_class,
+                    handler_class=QuietHandler).serve_forever()
+
+
+class _ReusePortServer(_ThreadingServer):
+    """
+    The threading wsgiref server, listening with SO_REUSEPORT.
+    """
+    server_class = _ReusePortWSGIServer
+
+
+def _web_server_worker(host: str, port: int, reuse_port: bool = False):
+    run(_bottle_app, host=host, port=port, server=_ReusePortServer if reuse_port else _ThreadingServer)
+
+
+def _create_app(databot_source: DatabotServerDataCollector | SampleRingReader):
+    global _web_databot, _bottle_app
+    _bottle_app = Bottle()
+    _web_databot = databot_source
+    _bottle_app.route(path="/", method="GET", callback=_timed("/", _databot_index))
+    _bottle_app.route(path="/latest", method="GET", callback=_timed("/latest", _databot_latest))
+    _bottle_app.route(path="/history", method="GET", callback=_timed("/history", _databot_history))
+    _bottle_app.route(path="/derived", method="GET", callback=_timed("/derived", _databot_derived))
+    _bottle_app.route(path="/events", method="GET", callback=_timed("/events", _databot_events))
+    _bottle_app.route(path="/metrics", method="GET", callback=_databot_metrics)
+    if databot_source.sample_ring is not None:
+        _ring_sequence.set_function(databot_source.sample_ring.latest_sequence)
+
+
+def serve_databot_webserver(ring_reader: SampleRingReader, host: str = "localhost", port: int = 8321,
+                            reuse_port: bool = False):
+    """
+    Run the Databot web server on the records of a SampleRing, in a server process that does not run the BLE
+    ingestion.  Blocks until the server stops.  The routes are those of start_databot_webserver; /metrics has
+    the metrics of this process, and the ingestion metrics exported to the metrics ring of the ring_reader.
+
+    :param ring_reader: The SampleRingReader of the ring the ingestion process publishes to
+    :param host: The host address on which the web server will listen. Default is "localhost".
+    :param port: The port number on which the web server will listen. Default is 8321.
+    :param reuse_port: True to listen with SO_REUSEPORT, so several server processes can share the port
+    """
+    _create_app(ring_reader)
+    _web_server_worker(host, port, reuse_port)
+
+
+def start_databot_webserver(queue_data_collector: DatabotServerDataCollector,
+                            host: str = "localhost", port: int = 8321) -> threading.Thread:
+    """
+    Start the Databot web server.
+
+    Routes:
+        GET /         the latest databot record
+        GET /latest   the latest value of every column with its age, see DatabotServerDataCollector.read_latest
+        GET /history  min/max/mean/count rollups from the collector's RollupStore
+        GET /derived  the recent rows of the derived columns from the collector's DerivedSignalEngine
+        GET /events   the recent events of the collector's AlertDetector
+        GET /metrics  the server metrics in the Prometheus text format
+
+    :param queue_data_collector: The DatabotServerDataCollector object that will handle saving data to the queue.
+    :param host: The host address on which the web server will listen. Default is "localhost".
+    :param port: The port number on which the web server will listen. Default is 8321.
+    :return: A threading.Thread object representing the web server thread.
+    """
+    _create_app(queue_data_collector)
+
+    t = threading.Thread(target=_web_server_worker, args=(host, port,), daemon=True)
+    t.start()
+
+    return t
@@ -0,0 +1,170 @@
+import json
+import struct
+from multiprocessing import shared_memory
+from typing import List, Tuple
+
+# header: magic, version, capacity, slot size, sequence number of the last published record
+_HEADER = struct.Struct("<4sIIIQ")
+_MAGIC = b"DBRB"
+_VERSION = 1
+
+# slot: sequence counter, payload length, then the payload
+_SLOT_HEADER = struct.Struct("<QI")
+_COUNTER = struct.Struct("<Q")
+
+
+class RecordTooLargeError(ValueError):
+    """
+    Raised when a record does not fit in a slot of the SampleRing.
+    """
+    pass
+
+
+class SampleRing:
+    """
+    A ring buffer of databot records in shared memory, written by one ingestion process and read by any number
+    of other processes.
+
+    Every slot has a sequence counter used as a seqlock: the writer makes it odd while it writes the slot and even
+    when done, so a reader knows a slot it copied is consistent when the counter was even and did not change while
+    it copied.  The header holds the sequence number of the last published record.  Neither the writer nor the
+    readers take a lock; readers copy only the slots they read, straight out of the shared memory.
+
+    Usage:
+        ring = SampleRing.create("databot")         # in the ingestion process
+        ring.publish({"co2": "412", "timestamp": 1700000000.0})
+
+        ring = SampleRing.attach("databot")         # in a server process
+        seq, record = ring.read_latest()
+
+    :param shm: The shared memory block
+    :param capacity: The number of slots
+    :param slot_size: The size of a slot in bytes, including the slot header
+    :param owner: True if the block was created by this object, and should be unlinked when closed
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, capacity: int, slot_size: int, owner: bool = False):
+        self.shm = shm
+        self.capacity = capacity
+        self.slot_size = slot_size
+        self.owner = owner
+        self._buf = shm.buf
+        # the writer's next sequence number, records are numbered from 1
+        self._next_seq = self.latest_sequence() + 1
+
+    @classmethod
+    def create(cls, name: str, capacity: int = 1024, slot_size: int = 1024, replace: bool = False) -> "SampleRing":
+        """
+        :param replace: True to replace a block with the same name, e.g. one left behind by a process that crashed
+                        before closing its ring.  Only for names no running process uses.
+        """
+        size = _HEADER.size + capacity * slot_size
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            if not replace:
+                raise
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        _HEADER.pack_into(shm.buf, 0, _MAGIC, _VERSION, capacity, slot_size, 0)
+        shm.buf[_HEADER.size:] = bytes(capacity * slot_size)
+        return cls(shm, capacity, slot_size, owner=True)
+
+    @classmethod
+    def attach(cls, name: str) -> "SampleRing":
+        shm = shared_memory.SharedMemory(name=name)
+        magic, version, capacity, slot_size, _ = _HEADER.unpack_from(shm.buf, 0)
+        if magic != _MAGIC or version != _VERSION:
+            shm.close()
+            raise ValueError(f"Shared memory {name} is not a version {_VERSION} SampleRing")
+        return cls(shm, capacity, slot_size)
+
+    def _slot_offset(self, seq: int) -> int:
+        return _HEADER.size + (seq % self.capacity) * self.slot_size
+
+    def latest_sequence(self) -> int:
+        """
+        The sequence number of the last published record, 0 if none has been published.
+        """
+        return _COUNTER.unpack_from(self._buf, _HEADER.size - _COUNTER.size)[0]
+
+    def publish(self, record: dict) -> int:
+        """
+        Write a record.  Only one process may publish to a ring.
+
+        :return: The sequence number of the record
+        :raises RecordTooLargeError: when the json record does not fit in a slot
+        """
+        payload = json.dumps(record, separators=(",", ":")).encode("utf-8")
+        if len(payload) > self.slot_size - _SLOT_HEADER.size:
+            raise RecordTooLargeError(f"Record of {len(payload)} bytes does not fit in a "
+                                      f"{self.slot_size} byte slot")
+
+        seq = self._next_seq
+        offset = self._slot_offset(seq)
+        _SLOT_HEADER.pack_into(self._buf, offset, 2 * seq - 1, len(payload))
+        start = offset + _SLOT_HEADER.size
+        self._buf[start:start + len(payload)] = payload
+        _COUNTER.pack_into(self._buf, offset, 2 * seq)
+        _COUNTER.pack_into(self._buf, _HEADER.size - _COUNTER.size, seq)
+        self._next_seq = seq + 1
+        return seq
+
+    def read(self, seq: int) -> dict | None:
+        """
+        The record with the sequence number, or None if it has not been published yet or was overwritten.
+        """
+        if seq < 1 or seq > self.latest_sequence():
+            return None
+        offset = self._slot_offset(seq)
+        counter, length = _SLOT_HEADER.unpack_from(self._buf, offset)
+        if counter != 2 * seq or length > self.slot_size - _SLOT_HEADER.size:
+            return None
+        start = offset + _SLOT_HEADER.size
+        payload = bytes(self._buf[start:start + length])
+        if _COUNTER.unpack_from(self._buf, offset)[0] != counter:
+            # the writer started on the slot while it was copied
+            return None
+        return json.loads(payload)
+
+    def read_latest(self) -> Tuple[int, dict] | None:
+        """
+        The last published record and its sequence number, None if no record has been published.
+        """
+        # the writer can overwrite the slot while it is read, then the next newest record is read
+        for _ in range(3):
+            seq = self.latest_sequence()
+            if seq == 0:
+                return None
+            record = self.read(seq)
+            if record is not None:
+                return seq, record
+        return None
+
+    def read_since(self, seq: int) -> Tuple[List[Tuple[int, dict]], int]:
+        """
+        The records published after the sequence number, oldest first.
+
+        :return: The (sequence number, record) pairs, and the number of records that were missed because they
+                 were overwritten before they were read
+        """
+        latest = self.latest_sequence()
+        # the oldest slot may be overwritten next, so it is not read
+        first = max(seq + 1, latest - self.capacity + 2)
+        missed = first - seq - 1
+        records = []
+        for s in range(first, latest + 1):
+            record = self.read(s)
+            if record is None:
+                missed += 1
+            else:
+                records.append((s, record))
+        return records, missed
+
+    def close(self):
+        self._buf = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
@@ -0,0 +1,225 @@
+import math
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from databot_sensors import DATABOT_DECIMAL, derived_signals
+
+# standard gravity in m/s², to convert acceleration to g
+STANDARD_GRAVITY = 9.80665
+# the sea level pressure of the international standard atmosphere, in kPa like the databot pressure
+SEA_LEVEL_PRESSURE_KPA = 101.325
+# the Magnus formula coefficients for dew point over water, valid from -45°C to 60°C
+MAGNUS_A = 17.62
+MAGNUS_B = 243.12
+
+
+class SignalFrame:
+    """
+    The rows of the history buffer a DerivedSignal is computed over.  frame["co2"] is a float array of a column,
+    with NaN where the column was missing; frame.epochs are the epochs of the rows.
+    """
+
+    def __init__(self, data: np.ndarray, epochs: np.ndarray, columns: Dict[str, int]):
+        self._data = data
+        self.epochs = epochs
+        self._columns = columns
+
+    def __getitem__(self, column: str) -> np.ndarray:
+        return self._data[:, self._columns[column]]
+
+
+@dataclass
+class DerivedSignal:
+    """
+    A column computed from other columns, in batches over the history buffer.
+
+    Attributes:
+        name (str): The derived column, a key of databot_sensors.derived_signals
+        inputs (List[str]): The data columns, or earlier derived columns, it is computed from
+        function (Callable): Computes the column for every row of a SignalFrame, as an array
+        window (float): The seconds of history before a row the function needs, e.g. for a moving average
+    """
+    name: str
+    inputs: List[str]
+    function: Callable[[SignalFrame], np.ndarray]
+    window: float = 0.0
+
+
+def fahrenheit(name: str, column: str) -> DerivedSignal:
+    return DerivedSignal(name, [column], lambda f: f[column] * 9.0 / 5.0 + 32.0)
+
+
+def magnitude(name: str, x: str, y: str, z: str, scale: float = 1.0) -> DerivedSignal:
+    return DerivedSignal(name, [x, y, z], lambda f: np.sqrt(f[x] ** 2 + f[y] ** 2 + f[z] ** 2) / scale)
+
+
+def _dew_point(f: SignalFrame) -> np.ndarray:
+    humidity = f["humidity"]
+    temperature = f["humidity_temperature"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        gamma = np.log(humidity / 100.0) + MAGNUS_A * temperature / (MAGNUS_B + temperature)
+        dew_point = MAGNUS_B * gamma / (MAGNUS_A - gamma)
+    # a humidity of 0% has no dew point
+    return np.where(humidity > 0, dew_point, np.nan)
+
+
+def _pressure_altitude(f: SignalFrame) -> np.ndarray:
+    with np.errstate(invalid="ignore"):
+        return 44330.0 * (1.0 - np.power(f["pressure"] / SEA_LEVEL_PRESSURE_KPA, 1.0 / 5.255))
+
+
+def moving_average(name: str, column: str, seconds: float) -> DerivedSignal:
+    """
+    The mean of the values of a column over the seconds up to and including every row.
+    """
+
+    def average(f: SignalFrame) -> np.ndarray:
+        values = f[column]
+        valid = np.isfinite(values)
+        sums = np.concatenate(([0.0], np.cumsum(np.where(valid, values, 0.0))))
+        counts = np.concatenate(([0], np.cumsum(valid)))
+        end = np.arange(1, len(values) + 1)
+        start = np.searchsorted(f.epochs, f.epochs - seconds, side="right")
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return (sums[end] - sums[start]) / (counts[end] - counts[start])
+
+    return DerivedSignal(name, [column], average, window=seconds)
+
+
+# in dependency order, derived columns can be inputs of the signals after them
+DEFAULT_SIGNALS = [
+    fahrenheit("external_temp_1_f", "external_temp_1"),
+    fahrenheit("external_temp_2_f", "external_temp_2"),
+    fahrenheit("humidity_temperature_f", "humidity_temperature"),
+    DerivedSignal("dew_point", ["humidity", "humidity_temperature"], _dew_point),
+    fahrenheit("dew_point_f", "dew_point"),
+    magnitude("acceleration_g", "acceleration_x", "acceleration_y", "acceleration_z", scale=STANDARD_GRAVITY),
+    magnitude("linear_acceleration_g", "linear_acceleration_x", "linear_acceleration_y", "linear_acceleration_z",
+              scale=STANDARD_GRAVITY),
+    magnitude("gyro_magnitude", "gyro_x", "gyro_y", "gyro_z"),
+    magnitude("mag_magnitude", "mag_x", "mag_y", "mag_z"),
+    DerivedSignal("pressure_altitude", ["pressure"], _pressure_altitude),
+    moving_average("co2_avg_60s", "co2", 60.0),
+    moving_average("voc_avg_60s", "voc", 60.0),
+]
+
+
+class DerivedSignalEngine:
+    """
+    Computes derived columns, e.g. temperatures in fahrenheit, dew point and moving averages, from the databot
+    records, so the assistant does not have to do the arithmetic.
+
+    Records are added to a history buffer of float columns, one row per record.  The derived columns are computed
+    with NumPy when they are read, for all the rows added since the last read at once, and for a windowed signal
+    over the rows of its window.
+
+    Usage:
+        engine = DerivedSignalEngine()
+        engine.add(epoch, {"humidity": "40.1", "humidity_temperature": "21.5"})
+        engine.latest()     # {"dew_point": (7.4, epoch), ...}
+
+    :param signals: The derived signals, in dependency order
+    :param history_size: The number of records kept.  Must cover the longest signal window.
+    :param decimal: The number of decimal places of the derived values
+    """
+
+    def __init__(self, signals: List[DerivedSignal] | None = None, history_size: int = 600,
+                 decimal: int = DATABOT_DECIMAL):
+        self.signals = list(signals) if signals is not None else list(DEFAULT_SIGNALS)
+        for signal in self.signals:
+            if signal.name not in derived_signals:
+                raise ValueError(f"Derived signal {signal.name} is not described in databot_sensors.derived_signals")
+        self.history_size = history_size
+        self.decimal = decimal
+
+        derived = {signal.name for signal in self.signals}
+        self.input_columns = sorted({column for signal in self.signals for column in signal.inputs} - derived)
+        self.columns = {column: i for i, column in enumerate(self.input_columns + [s.name for s in self.signals])}
+
+        # twice the history, so the buffer is shifted back only once every history_size records
+        self._data = np.full((2 * history_size, len(self.columns)), np.nan)
+        self._epochs = np.zeros(2 * history_size)
+        self._end = 0
+        self._computed = 0
+        self._lock = threading.Lock()
+
+    def add(self, epoch: float, data: dict):
+        """
+        Add a databot record.  Values that are not numbers are missing values.
+        """
+        with self._lock:
+            if self._end == len(self._epochs):
+                keep = self._end - self.history_size
+                self._data[:self.history_size] = self._data[keep:self._end]
+                self._epochs[:self.history_size] = self._epochs[keep:self._end]
+                self._computed = max(0, self._computed - keep)
+                self._end = self.history_size
+
+            row = self._end
+            self._data[row] = np.nan
+            self._epochs[row] = epoch
+            for column in self.input_columns:
+                value = data.get(column)
+                if value is None or value == "":
+                    continue
+                try:
+                    self._data[row, self.columns[column]] = float(value)
+                except (TypeError, ValueError):
+                    pass
+            self._end = row + 1
+
+    def _compute(self):
+        start = max(0, self._end - self.history_size)
+        pending = max(self._computed, start)
+        if pending >= self._end:
+            return
+        epochs = self._epochs[start:self._end]
+        for signal in self.signals:
+            first = pending
+            if signal.window > 0:
+                first = start + int(np.searchsorted(epochs, self._epochs[pending] - signal.window, side="left"))
+            frame = SignalFrame(self._data[first:self._end], self._epochs[first:self._end], self.columns)
+            values = np.asarray(signal.function(frame), dtype=float)
+            self._data[pending:self._end, self.columns[signal.name]] = values[pending - first:]
+        self._computed = self._end
+
+    def latest(self) -> Dict[str, tuple]:
+        """
+        The latest value of every derived column, with the epoch of the record it was computed from.
+
+        :return: dict of column -> (value, epoch), without the columns that have no value
+        """
+        with self._lock:
+            self._compute()
+            start = max(0, self._end - self.history_size)
+            latest = {}
+            for signal in self.signals:
+                rows = np.flatnonzero(np.isfinite(self._data[start:self._end, self.columns[signal.name]]))
+                if rows.size:
+                    row = start + rows[-1]
+                    value = round(float(self._data[row, self.columns[signal.name]]), self.decimal)
+                    latest[signal.name] = (value, float(self._epochs[row]))
+            return latest
+
+    def history(self, columns: List[str], seconds: float | None = None) -> Dict[str, list]:
+        """
+        The derived and input columns of the records in the buffer, as lists with None for missing values.
+
+        :param columns: The columns to return
+        :param seconds: Only the records of the last seconds, up to the latest record
+        :return: dict with the "timestamp" of every row and a list per known column
+        """
+        with self._lock:
+            self._compute()
+            start = max(0, self._end - self.history_size)
+            if seconds is not None and self._end > start:
+                start += int(np.searchsorted(self._epochs[start:self._end], self._epochs[self._end - 1] - seconds))
+            history = {"timestamp": self._epochs[start:self._end].tolist()}
+            for column in columns:
+                if column in self.columns:
+                    values = np.round(self._data[start:self._end, self.columns[column]], self.decimal)
+                    history[column] = [None if math.isnan(v) else v for v in values.tolist()]
+            return history
@@ -0,0 +1,234 @@
+import json
+import logging
+import math
+import re
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+# bump when the chunking or tokenizing changes so cached indexes are rebuilt
+INDEX_VERSION = 1
+
+DEFAULT_DOC_DIRECTORIES = ("./databot_docs", "./pydatabot_docs")
+DEFAULT_CACHE_PATH = "./.doc_index/index.json"
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lower case alphanumeric tokens.  Identifiers such as get_databot_address are split on the underscores,
+    and the whole identifier is kept as well.
+    """
+    text = text.lower()
+    tokens = _TOKEN_PATTERN.findall(text)
+    tokens.extend(word.replace("_", "") for word in re.findall(r"[a-z0-9]+(?:_[a-z0-9]+)+", text))
+    return tokens
+
+
+@dataclass
+class DocSnippet:
+    source: str
+    start_line: int
+    text: str
+    score: float = 0.0
+
+
+class DocIndex:
+    """
+    A local BM25 index over chunks of the databot documentation files.
+
+    The chunks and their term frequencies are cached on disk.  On refresh only files whose size or
+    modification time changed are re-chunked.  Searches can run on several threads while the index is refreshed:
+    the postings are rebuilt aside and replaced in one assignment.
+
+    Usage:
+        index = DocIndex()
+        for snippet in index.search("what are the classes in databot-py?"):
+            print(snippet.source, snippet.text)
+
+    :param directories: The directories whose files are indexed
+    :param cache_path: Where the index is cached.  None disables the disk cache.
+    :param chunk_lines: The number of lines in a chunk
+    :param overlap_lines: The number of lines shared by consecutive chunks
+    :param refresh_interval: The minimum number of seconds between the directory scans of refresh_if_due
+    """
+
+    def __init__(self, directories=DEFAULT_DOC_DIRECTORIES, cache_path: str | None = DEFAULT_CACHE_PATH,
+                 chunk_lines: int = 30, overlap_lines: int = 5, k1: float = 1.5, b: float = 0.75,
+                 refresh_interval: float = 30.0):
+        self.directories = [Path(d) for d in directories]
+        self.cache_path = Path(cache_path) if cache_path is not None else None
+        self.chunk_lines = chunk_lines
+        self.overlap_lines = overlap_lines
+        self.k1 = k1
+        self.b = b
+        self.refresh_interval = refresh_interval
+        # file path -> {"mtime", "size", "chunks": [{"start_line", "text", "terms"}]}, guarded by _refresh_lock
+        self.files: Dict[str, dict] = {}
+        # (chunks, postings, chunk lengths, average chunk length), replaced as a whole by _build_postings
+        self._index: tuple = ([], {}, [], 0.0)
+        self._refresh_lock = threading.Lock()
+        self._last_refresh = 0.0
+        self._load_cache()
+        self.refresh()
+
+    def _load_cache(self):
+        if self.cache_path is None or not self.cache_path.exists():
+            return
+        try:
+            cache = json.loads(self.cache_path.read_text(encoding="utf-8"))
+            if cache.get("version") == INDEX_VERSION and cache.get("chunk_lines") == self.chunk_lines \
+                    and cache.get("overlap_lines") == self.overlap_lines:
+                self.files = cache["files"]
+        except Exception as exc:
+            logging.warning(f"Ignoring unreadable doc index cache {self.cache_path}: {exc}")
+
+    def _save_cache(self):
+        if self.cache_path is None:
+            return
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        self.cache_path.write_text(json.dumps({
+            "version": INDEX_VERSION,
+            "chunk_lines": self.chunk_lines,
+            "overlap_lines": self.overlap_lines,
+            "files": self.files
+        }), encoding="utf-8")
+
+    def _chunk_file(self, path: Path) -> List[dict]:
+        lines = path.read_text(encoding="utf-8", errors="replace").splitlines()
+        chunks = []
+        step = max(self.chunk_lines - self.overlap_lines, 1)
+        for start in range(0, max(len(lines), 1), step):
+            text = "\n".join(lines[start:start + self.chunk_lines]).strip()
+            if text:
+                chunks.append({"start_line": start + 1, "text": text, "terms": Counter(tokenize(text))})
+            if start + self.chunk_lines >= len(lines):
+                break
+        return chunks
+
+    def refresh(self) -> bool:
+        """
+        Re-chunk the files that were added or changed since the last refresh, and drop removed files.
+
+        :return: True if the index changed
+        """
+        with self._refresh_lock:
+            self._last_refresh = time.monotonic()
+            return self._refresh()
+
+    def refresh_if_due(self) -> bool:
+        """
+        Refresh, unless the last refresh was less than refresh_interval seconds ago.
+
+        :return: True if the index changed
+        """
+        if time.monotonic() - self._last_refresh < self.refresh_interval:
+            return False
+        # a refresh already running on another thread is as good as one on this thread
+        if not self._refresh_lock.acquire(blocking=False):
+            return False
+        try:
+            self._last_refresh = time.monotonic()
+            return self._refresh()
+        finally:
+            self._refresh_lock.release()
+
+    def _refresh(self) -> bool:
+        current = {}
+        for directory in self.directories:
+            if directory.is_dir():
+                for path in directory.glob("*"):
+                    if path.is_file():
+                        current[str(path)] = path.stat()
+
+        changed = False
+        for file_path in list(self.files):
+            if file_path not in current:
+                del self.files[file_path]
+                changed = True
+
+        for file_path, stat in current.items():
+            entry = self.files.get(file_path)
+            if entry is not None and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+                continue
+            logging.info(f"Indexing {file_path}")
+            self.files[file_path] = {
+                "mtime": stat.st_mtime,
+                "size": stat.st_size,
+                "chunks": self._chunk_file(Path(file_path))
+            }
+            changed = True
+
+        if changed or not self._index[0]:
+            self._build_postings()
+        if changed:
+            self._save_cache()
+        return changed
+
+    def _build_postings(self):
+        chunks = []
+        postings = {}
+        for file_path, entry in self.files.items():
+            for chunk in entry["chunks"]:
+                chunk_id = len(chunks)
+                chunks.append({"source": file_path, "start_line": chunk["start_line"], "text": chunk["text"]})
+                for term, frequency in chunk["terms"].items():
+                    postings.setdefault(term, []).append((chunk_id, frequency))
+        chunk_lengths = [0] * len(chunks)
+        for term_postings in postings.values():
+            for chunk_id, frequency in term_postings:
+                chunk_lengths[chunk_id] += frequency
+        average_length = sum(chunk_lengths) / len(chunks) if chunks else 0.0
+        self._index = (chunks, postings, chunk_lengths, average_length)
+
+    def search(self, query: str, top_k: int = 3) -> List[DocSnippet]:
+        """
+        Search the documentation chunks.
+
+        :param query: The question or keywords
+        :param top_k: The maximum number of snippets returned
+        :return: The best matching snippets, best first
+        """
+        # one consistent version of the index, even if it is replaced during the search
+        chunks, all_postings, chunk_lengths, average_length = self._index
+        number_of_chunks = len(chunks)
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = all_postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (number_of_chunks - len(postings) + 0.5) / (len(postings) + 0.5))
+            for chunk_id, frequency in postings:
+                length_norm = 1 - self.b + self.b * chunk_lengths[chunk_id] / average_length
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + \
+                    idf * frequency * (self.k1 + 1) / (frequency + self.k1 * length_norm)
+
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+        return [DocSnippet(source=chunks[chunk_id]["source"],
+                           start_line=chunks[chunk_id]["start_line"],
+                           text=chunks[chunk_id]["text"],
+                           score=round(score, 3))
+                for chunk_id, score in best]
+
+
+_doc_index: DocIndex | None = None
+_doc_index_lock = threading.Lock()
+
+
+def get_doc_index() -> DocIndex:
+    """
+    The process wide DocIndex over the default documentation directories.  Changed files are re-indexed, at most
+    once every refresh_interval seconds.
+    """
+    global _doc_index
+    if _doc_index is None:
+        with _doc_index_lock:
+            if _doc_index is None:
+                _doc_index = DocIndex()
+                return _doc_index
+    _doc_index.refresh_if_due()
+    return _doc_index
@@ -0,0 +1,200 @@
+import hashlib
+import logging
+import mmap
+import os
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable
+
+DEFAULT_CACHE_DIR = "./.file_cache"
+
+# the number of download locks, files whose ids hash to the same lock are downloaded one after the other
+DOWNLOAD_LOCK_STRIPES = 64
+
+
+@dataclass
+class FileCacheStats:
+    hits: int = 0
+    misses: int = 0
+    downloaded_bytes: int = 0
+    evictions: int = 0
+
+    def as_dict(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "downloaded_bytes": self.downloaded_bytes,
+            "evictions": self.evictions
+        }
+
+
+class FileContentCache:
+    """
+    An on disk cache of OpenAI file contents.
+
+    OpenAI files never change once created, so the file id addresses the content: a file is downloaded once,
+    streamed straight to disk, and every later read is served from the cache without a network call.
+    Reads are memory mapped, so large files are not copied into memory.
+
+    Usage:
+        path = cache.get_path(file_id, download=lambda f: stream_file(file_id, f))
+        with cache.open(file_id, download=...) as content:
+            image = bytes(content[:16])
+
+    :param cache_dir: The directory of the cached files
+    :param max_bytes: The size of the cache.  The least recently used files are removed first.
+    :param evict_to: The fraction of max_bytes left after an eviction, so the cache directory is not scanned on
+                     every download once the cache is full
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_bytes: int = 512 * 1024 * 1024,
+                 evict_to: float = 0.9):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.evict_to = evict_to
+        self.stats = FileCacheStats()
+        self._lock = threading.Lock()
+        # a fixed set of locks shared by file id, so a file is only downloaded once when several sessions show it
+        # at the same time
+        self._download_locks = tuple(threading.Lock() for _ in range(DOWNLOAD_LOCK_STRIPES))
+        # the bytes in the cache directory, counted by the downloads.  None until the directory was scanned once.
+        self._total_bytes: int | None = None
+        self._evict_lock = threading.Lock()
+
+    def path_for(self, file_id: str) -> Path:
+        # files are spread over sub directories, so no directory gets too large
+        digest = hashlib.sha256(file_id.encode("utf-8")).hexdigest()
+        return self.cache_dir / digest[:2] / digest
+
+    def _download_lock(self, file_id: str) -> threading.Lock:
+        return self._download_locks[hash(file_id) % len(self._download_locks)]
+
+    def get_path(self, file_id: str, download: Callable) -> Path:
+        """
+        The path of the cached file, downloading it first if it is not in the cache.
+
+        :param file_id: The OpenAI file id
+        :param download: Called with a file opened for binary writing, writes the content of the file.  It is
+                         written to a temporary file that is moved into the cache once complete, so a failed
+                         download never leaves a partial file behind.
+        :return: The path of the cached file
+        """
+        path = self.path_for(file_id)
+        if path.exists():
+            self._hit(path)
+            return path
+
+        with self._download_lock(file_id):
+            if path.exists():
+                self._hit(path)
+                return path
+
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+            try:
+                with open(tmp_path, "wb") as f:
+                    download(f)
+                os.replace(tmp_path, path)
+            finally:
+                if tmp_path.exists():
+                    tmp_path.unlink()
+
+            size = path.stat().st_size
+            with self._lock:
+                self.stats.misses += 1
+                self.stats.downloaded_bytes += size
+            logging.info(f"Cached file {file_id}, {size} bytes")
+
+        self._evict(size)
+        return path
+
+    def _hit(self, path: Path):
+        with self._lock:
+            self.stats.hits += 1
+        try:
+            # the least recently used files are evicted first, by modification time
+            os.utime(path)
+        except OSError:
+            pass
+
+    def read(self, file_id: str, download: Callable) -> bytes:
+        """
+        The content of the file.  Prefer get_path or open for large files.
+        """
+        return self.get_path(file_id, download).read_bytes()
+
+    def open(self, file_id: str, download: Callable) -> mmap.mmap | memoryview:
+        """
+        The file memory mapped read only.  Use as a context manager, or close it when done.
+        """
+        path = self.get_path(file_id, download)
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                # an empty file cannot be memory mapped
+                return memoryview(b"")
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _evict(self, added_bytes: int):
+        with self._lock:
+            if self._total_bytes is not None:
+                self._total_bytes += added_bytes
+                if self._total_bytes <= self.max_bytes:
+                    return
+        # one thread scans the directory at a time, the others' downloads are counted by the scan
+        if not self._evict_lock.acquire(blocking=False):
+            return
+        try:
+            self._scan_and_evict()
+        finally:
+            self._evict_lock.release()
+
+    def _scan_and_evict(self):
+        entries = []
+        total = 0
+        for path in self.cache_dir.glob("*/*"):
+            if path.suffix == ".tmp":
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        target = self.max_bytes * self.evict_to if total > self.max_bytes else self.max_bytes
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            total -= size
+            with self._lock:
+                self.stats.evictions += 1
+            logging.info(f"Evicted cached file {path.name}")
+
+        with self._lock:
+            self._total_bytes = total
+
+    def clear(self):
+        for path in self.cache_dir.glob("*/*"):
+            path.unlink()
+        with self._lock:
+            self._total_bytes = 0
+
+
+_file_cache: FileContentCache | None = None
+_file_cache_lock = threading.Lock()
+
+
+def get_file_cache() -> FileContentCache:
+    """
+    The FileContentCache shared by every OpenAIAssistant in the process.
+    """
+    global _file_cache
+    with _file_cache_lock:
+        if _file_cache is None:
+            _file_cache = FileContentCache()
+        return _file_cache
@@ -0,0 +1,321 @@
+import asyncio
+import contextvars
+import inspect
+import json
+import logging
+import re
+import types
+import typing
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Hashable, List, Literal
+
+from openai_assistant import FunctionDefinition, FunctionParameter
+from tool_output import ToolOutputEncoder
+
+_PARAM_PATTERN = re.compile(r"^\s*:param\s+(\w+):\s*(.*)$")
+
+# python type -> (json schema type, argument converter)
+_SCALAR_TYPES = {
+    str: ("string", str),
+    int: ("integer", int),
+    float: ("number", float),
+    bool: ("boolean", bool),
+}
+
+
+class ToolArgumentError(ValueError):
+    """
+    Raised when the arguments of a function call from the assistant do not match the function.
+    """
+    pass
+
+
+def _parse_docstring(function: Callable) -> tuple:
+    """
+    The description (the docstring up to the first field) and the :param descriptions of a function.
+    """
+    description_lines = []
+    parameters = {}
+    current = None
+    for line in (inspect.getdoc(function) or "").splitlines():
+        match = _PARAM_PATTERN.match(line)
+        if match:
+            current = match.group(1)
+            parameters[current] = match.group(2).strip()
+        elif line.strip().startswith(":"):
+            current = None
+        elif current is not None and line.strip():
+            parameters[current] += " " + line.strip()
+        elif not parameters:
+            description_lines.append(line)
+    return "\n".join(description_lines).strip(), parameters
+
+
+def _schema_type(annotation) -> tuple:
+    """
+    The json schema type, array items type, enum values and argument converter of a type hint.
+    """
+    origin = typing.get_origin(annotation)
+    args = typing.get_args(annotation)
+
+    if origin in (typing.Union, types.UnionType):
+        # Optional[X] is described as X
+        args = [arg for arg in args if arg is not type(None)]
+        if len(args) == 1:
+            return _schema_type(args[0])
+
+    if origin is Literal:
+        schema_type, _, _, convert = _schema_type(type(args[0]))
+        return schema_type, None, [str(arg) for arg in args], convert
+
+    if annotation in (list, List) or origin is list:
+        items_type = _schema_type(args[0])[0] if args else "string"
+        items_convert = _SCALAR_TYPES.get(args[0], (None, lambda value: value))[1] if args else str
+
+        def convert(value):
+            # a single value is sometimes sent for a list
+            if not isinstance(value, list):
+                value = [value]
+            return [items_convert(item) for item in value]
+
+        return "array", items_type, None, convert
+
+    if annotation in _SCALAR_TYPES:
+        schema_type, convert = _SCALAR_TYPES[annotation]
+        return schema_type, None, None, convert
+
+    raise TypeError(f"Unsupported function tool parameter type: {annotation}")
+
+
+@dataclass
+class FunctionTool:
+    """
+    A Python function the assistant can call.
+
+    Attributes:
+        name (str): The function name known by the assistant
+        function (Callable): The Python function, a plain or an async function
+        definition (FunctionDefinition): The definition sent to OpenAI
+        cacheable (bool): True if the answers of runs calling this function can be cached.  Functions whose
+                          output depends on live data are not cacheable.
+        timeout (float | None): Seconds to wait for the function, None waits as long as it takes
+        is_async (bool): True for async functions
+    """
+    name: str
+    function: Callable
+    definition: FunctionDefinition
+    cacheable: bool = False
+    timeout: float | None = None
+    is_async: bool = False
+    # (name, converter, required) per parameter, compiled from the type hints on registration
+    arguments: List[tuple] = field(default_factory=list)
+    # parameter name -> function returning the enum values, called when the definitions are first needed and
+    # again whenever the definitions key of the registry changes
+    enum_sources: Dict[str, Callable[[], List[str]]] = field(default_factory=dict)
+
+    def parse_arguments(self, function_args: str) -> Dict[str, Any]:
+        """
+        Convert the json arguments of a function call into the keyword arguments of the function.
+
+        :raises ToolArgumentError: when the arguments are not valid json, or a required argument is missing
+        """
+        try:
+            args = json.loads(function_args) if function_args else {}
+        except json.JSONDecodeError as exc:
+            raise ToolArgumentError(f"Invalid arguments for {self.name}: {exc}")
+        if not isinstance(args, dict):
+            raise ToolArgumentError(f"Invalid arguments for {self.name}: {function_args}")
+
+        kwargs = {}
+        for name, convert, required in self.arguments:
+            if name in args:
+                try:
+                    kwargs[name] = convert(args[name])
+                except (TypeError, ValueError) as exc:
+                    raise ToolArgumentError(f"Invalid argument {name} for {self.name}: {exc}")
+            elif required:
+                raise ToolArgumentError(f"Missing argument {name} for {self.name}")
+        return kwargs
+
+
+class FunctionToolRegistry:
+    """
+    The functions an assistant can call, registered with a decorator.
+
+    The function definitions are built from the type hints and the :param lines of the docstring when a function
+    is registered, and calls are dispatched by name.
+
+    Usage:
+        tools = FunctionToolRegistry()
+
+        @tools.tool(cacheable=True, timeout=10)
+        def search_docs(query: str, top_k: int = 3) -> str:
+            \"\"\"
+            Search the documentation.
+
+            :param query: The question or keywords
+            \"\"\"
+
+        assistant = OpenAIAssistant(function_tools=tools)
+
+    :param max_workers: The number of threads running functions that have a timeout
+    :param output_encoder: Encodes the function outputs within a byte budget and records their sizes.  Without
+                           it, outputs that are not text are sent as json.
+    :param definitions_key: Returns a hashable snapshot of the data the enum values are computed from.  The enum
+                            functions are called again when it changes.  Without it they are called once.
+    """
+
+    def __init__(self, max_workers: int = 4, output_encoder: ToolOutputEncoder | None = None,
+                 definitions_key: Callable[[], Hashable] | None = None):
+        self.output_encoder = output_encoder
+        self.definitions_key = definitions_key
+        # the definitions key the enum values were last computed for, see get_definitions
+        self.enums_key: Hashable = None
+        self._enums_resolved = False
+        self._tools: Dict[str, FunctionTool] = {}
+        # created up front, as functions can be called from several run threads at once
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="function-tool")
+
+    def tool(self, name: str | None = None, description: str | None = None, cacheable: bool = False,
+             timeout: float | None = None, parameters: Dict[str, str] | None = None,
+             enums: Dict[str, Callable[[], List[str]] | List[str]] | None = None, exclude: tuple = ()):
+        """
+        Register the decorated function.  The function is returned unchanged.
+
+        :param name: The function name known by the assistant.  Defaults to the Python function name.
+        :param description: The description for the assistant.  Defaults to the docstring up to the first :param line.
+        :param cacheable: True if the answers of runs calling this function can be cached
+        :param timeout: Seconds to wait for the function
+        :param parameters: Parameter descriptions that replace the ones from the docstring
+        :param enums: The allowed values per parameter, or a function returning them.  The function is called
+                      when the definitions are first needed, and again when the definitions key changes.
+        :param exclude: Parameters with default values that are not shown to the assistant
+        """
+        def decorator(function: Callable) -> Callable:
+            self.register(function, name=name, description=description, cacheable=cacheable, timeout=timeout,
+                          parameters=parameters, enums=enums, exclude=exclude)
+            return function
+
+        return decorator
+
+    def register(self, function: Callable, name: str | None = None, description: str | None = None,
+                 cacheable: bool = False, timeout: float | None = None, parameters: Dict[str, str] | None = None,
+                 enums: Dict[str, Callable[[], List[str]] | List[str]] | None = None,
+                 exclude: tuple = ()) -> FunctionTool:
+        """
+        Register a function.  See `tool` for the parameters.
+        """
+        name = name or function.__name__
+        doc_description, doc_parameters = _parse_docstring(function)
+        doc_parameters.update(parameters or {})
+        enums = enums or {}
+        hints = typing.get_type_hints(function)
+
+        function_parameters = []
+        arguments = []
+        enum_sources = {}
+        for parameter in inspect.signature(function).parameters.values():
+            required = parameter.default is inspect.Parameter.empty
+            if parameter.name in exclude:
+                if required:
+                    raise ValueError(f"{name}: parameter {parameter.name} has no default and cannot be excluded")
+                continue
+            schema_type, items_type, enum_values, convert = _schema_type(hints.get(parameter.name, str))
+            if parameter.name in enums:
+                if callable(enums[parameter.name]):
+                    enum_sources[parameter.name] = enums[parameter.name]
+                else:
+                    enum_values = list(enums[parameter.name])
+            function_parameters.append(FunctionParameter(
+                name=parameter.name,
+                type=schema_type,
+                description=doc_parameters.get(parameter.name, ""),
+                required=required,
+                enum_values=enum_values or [],
+                array_items_type=items_type
+            ))
+            arguments.append((parameter.name, convert, required))
+
+        function_tool = FunctionTool(
+            name=name,
+            function=function,
+            definition=FunctionDefinition(name=name, description=description or doc_description,
+                                          parameters=function_parameters),
+            cacheable=cacheable,
+            timeout=timeout,
+            is_async=inspect.iscoroutinefunction(function),
+            arguments=arguments,
+            enum_sources=enum_sources
+        )
+        self._tools[name] = function_tool
+        self._enums_resolved = False
+        return function_tool
+
+    def get(self, name: str) -> FunctionTool | None:
+        return self._tools.get(name)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._tools
+
+    def get_definitions(self) -> List[FunctionDefinition]:
+        """
+        The definitions of the registered functions.  The same objects are returned on every call; their enum
+        values are updated when the definitions key changed.
+        """
+        key = self.definitions_key() if self.definitions_key is not None else None
+        if not self._enums_resolved or key != self.enums_key:
+            for function_tool in self._tools.values():
+                for parameter in function_tool.definition.parameters:
+                    if parameter.name in function_tool.enum_sources:
+                        parameter.enum_values = list(function_tool.enum_sources[parameter.name]())
+            self.enums_key = key
+            self._enums_resolved = True
+        return [function_tool.definition for function_tool in self._tools.values()]
+
+    def is_cacheable(self, name: str) -> bool:
+        function_tool = self._tools.get(name)
+        return function_tool is not None and function_tool.cacheable
+
+    def _run(self, function_tool: FunctionTool, kwargs: dict):
+        if function_tool.is_async:
+            coroutine = function_tool.function(**kwargs)
+            if function_tool.timeout is not None:
+                coroutine = asyncio.wait_for(coroutine, function_tool.timeout)
+            return asyncio.run(coroutine)
+
+        if function_tool.timeout is None:
+            return function_tool.function(**kwargs)
+
+        # the function keeps running in the pool after a timeout, but the run is not held up by it.  It runs in
+        # a copy of the caller's context, so its tracing spans are part of the run's trace.
+        return self._pool.submit(contextvars.copy_context().run, function_tool.function, **kwargs) \
+            .result(timeout=function_tool.timeout)
+
+    def call(self, name: str, function_args: str) -> str:
+        """
+        Call a function with the json arguments from the assistant.
+
+        :return: The output of the function for the assistant.  Errors are returned as text, so the assistant
+                 can tell the user what went wrong.
+        """
+        function_tool = self._tools.get(name)
+        if function_tool is None:
+            logging.error(f"Unknown function: {name}")
+            return f"Unknown function: {name}"
+
+        try:
+            output = self._run(function_tool, function_tool.parse_arguments(function_args))
+        except ToolArgumentError as exc:
+            logging.error(exc)
+            return str(exc)
+        except (TimeoutError, asyncio.TimeoutError):
+            logging.error(f"{name} timed out after {function_tool.timeout} seconds")
+            return f"{name} did not answer within {function_tool.timeout} seconds"
+        except Exception as exc:
+            logging.error(exc)
+            return "Unknown"
+
+        if self.output_encoder is not None:
+            return self.output_encoder.encode(name, output)
+        return output if isinstance(output, str) else json.dumps(output)
@@ -0,0 +1,316 @@
+import bisect
+import json
+import logging
+import math
+import mmap
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+from databot.PyDatabot import PyDatabotSaveToFileDataCollector, DatabotConfig
+
+# columns that describe the record rather than a sensor reading
+NON_SENSOR_COLUMNS = {"time", "timestamp"}
+
+
+def index_path_for(file_path: str | Path) -> Path:
+    """
+    The sidecar index of an NDJSON capture file, e.g. data/test_data.txt -> data/test_data.txt.idx
+    """
+    file_path = Path(file_path)
+    return file_path.with_name(file_path.name + ".idx")
+
+
+@dataclass
+class IndexBucket:
+    """
+    One time bucket of an NDJSON capture file.
+
+    Attributes:
+        bucket (float): Epoch start of the bucket
+        offset (int): Byte offset of the first line in the bucket
+        end (int): Byte offset just past the last line in the bucket
+        seconds (float): Width of the bucket in seconds
+        count (int): Number of lines in the bucket
+        min (dict): Per column minimum of the numeric values
+        max (dict): Per column maximum of the numeric values
+    """
+    bucket: float
+    offset: int
+    end: int
+    seconds: float = 60
+    count: int = 0
+    min: Dict[str, float] = field(default_factory=dict)
+    max: Dict[str, float] = field(default_factory=dict)
+
+    def add(self, data: dict, end: int):
+        self.end = end
+        self.count += 1
+        for column, value in data.items():
+            if column in NON_SENSOR_COLUMNS:
+                continue
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                continue
+            if math.isnan(value):
+                continue
+            if column not in self.min or value < self.min[column]:
+                self.min[column] = value
+            if column not in self.max or value > self.max[column]:
+                self.max[column] = value
+
+    def to_json(self) -> str:
+        return json.dumps({"bucket": self.bucket, "offset": self.offset, "end": self.end, "seconds": self.seconds,
+                           "count": self.count, "min": self.min, "max": self.max})
+
+
+class NdjsonIndexWriter:
+    """
+    Maintains the sidecar index of an NDJSON capture file as lines are appended to it.
+
+    A bucket is appended to the index file once a line for a later bucket arrives, or on flush.
+
+    :param file_path: The NDJSON capture file
+    :param bucket_seconds: The width of an index bucket in seconds
+    """
+
+    def __init__(self, file_path: str | Path, bucket_seconds: float = 60):
+        self.file_path = Path(file_path)
+        self.index_path = index_path_for(file_path)
+        self.bucket_seconds = bucket_seconds
+        self.current: IndexBucket | None = None
+
+    def add(self, epoch: float, data: dict, offset: int, end: int):
+        """
+        Add a line to the index.
+
+        :param epoch: The timestamp of the line
+        :param data: The record written on the line
+        :param offset: Byte offset of the start of the line
+        :param end: Byte offset just past the end of the line
+        """
+        bucket = self.bucket_for(epoch)
+        if self.current is not None and self.current.bucket != bucket:
+            self.flush()
+        if self.current is None:
+            self.current = IndexBucket(bucket=bucket, offset=offset, end=end, seconds=self.bucket_seconds)
+        self.current.add(data, end)
+
+    def bucket_for(self, epoch: float) -> float:
+        """
+        The start of the bucket of a timestamp.  A line of another bucket than the current one closes it.
+        """
+        return math.floor(epoch / self.bucket_seconds) * self.bucket_seconds
+
+    def flush(self):
+        if self.current is None:
+            return
+        with self.index_path.open("a", encoding="utf-8") as f:
+            f.write(self.current.to_json())
+            f.write("\n")
+        self.current = None
+
+
+def build_index(file_path: str | Path, bucket_seconds: float = 60) -> Path:
+    """
+    Build, or extend, the sidecar index of an existing NDJSON capture file.
+
+    Only the lines of the last indexed bucket and after it are read, so calling this repeatedly on a
+    growing file is incremental.  The last bucket is re-read because lines may have been added to it.
+
+    :param file_path: The NDJSON capture file
+    :param bucket_seconds: The width of an index bucket in seconds.  Ignored when extending an index.
+    :return: The path to the index file
+    """
+    file_path = Path(file_path)
+    index_path = index_path_for(file_path)
+    buckets = _load_index(index_path)
+    start = 0
+    if buckets:
+        bucket_seconds = buckets[-1].seconds
+        start = buckets[-1].offset
+        _remove_last_bucket(index_path, start)
+
+    writer = NdjsonIndexWriter(file_path, bucket_seconds=bucket_seconds)
+    with file_path.open("rb") as f:
+        f.seek(start)
+        offset = start
+        for line in f:
+            end = offset + len(line)
+            if not line.endswith(b"\n"):
+                # a partially written line, it will be indexed next time
+                break
+            data = json.loads(line)
+            writer.add(data["timestamp"], data, offset, end)
+            offset = end
+    writer.flush()
+    return writer.index_path
+
+
+def _remove_last_bucket(index_path: Path, offset: int):
+    """
+    Truncate the index before its entries for the bucket starting at the byte offset, so it can be rebuilt.
+    """
+    keep = 0
+    with index_path.open("rb") as f:
+        position = 0
+        for line in f:
+            if line.endswith(b"\n") and json.loads(line)["offset"] >= offset:
+                break
+            position += len(line)
+            keep = position
+    with index_path.open("r+b") as f:
+        f.truncate(keep)
+
+
+def _load_index(index_path: Path) -> List[IndexBucket]:
+    buckets = []
+    if index_path.exists():
+        with index_path.open("r", encoding="utf-8") as f:
+            for line in f:
+                if not line.endswith("\n"):
+                    continue
+                bucket = IndexBucket(**json.loads(line))
+                previous = buckets[-1] if buckets else None
+                if previous is not None and previous.bucket == bucket.bucket and previous.end == bucket.offset:
+                    # a bucket continued after the index was flushed, e.g. by a writer appending to the file
+                    previous.end = bucket.end
+                    previous.count += bucket.count
+                    for column, value in bucket.min.items():
+                        previous.min[column] = min(value, previous.min.get(column, value))
+                    for column, value in bucket.max.items():
+                        previous.max[column] = max(value, previous.max.get(column, value))
+                    continue
+                buckets.append(bucket)
+    return buckets
+
+
+class NdjsonTimeSeriesReader:
+    """
+    Reads time ranges out of an NDJSON capture file using its sidecar index.
+
+    Only the bytes of the buckets that overlap the requested range are memory mapped and parsed.  Lines
+    appended after the last indexed bucket are read from the tail of the file.
+
+    Usage:
+        reader = NdjsonTimeSeriesReader("data/test_data.txt")
+        for record in reader.read_range(start, start + 3600, columns=["co2"]):
+            print(record)
+    """
+
+    def __init__(self, file_path: str | Path):
+        self.file_path = Path(file_path)
+        self.index_path = index_path_for(file_path)
+        self.buckets: List[IndexBucket] = []
+        self._bucket_starts: List[float] = []
+        self.refresh()
+
+    def refresh(self):
+        """
+        Reload the index, picking up buckets written since the reader was created.
+        """
+        self.buckets = _load_index(self.index_path)
+        self._bucket_starts = [b.bucket for b in self.buckets]
+
+    def _byte_ranges(self, start: float, end: float) -> List[tuple]:
+        ranges = []
+        if self.buckets:
+            # from the bucket containing start, to the last bucket starting before end
+            first = max(bisect.bisect_right(self._bucket_starts, start) - 1, 0)
+            last = bisect.bisect_right(self._bucket_starts, end)
+            selected = self.buckets[first:last]
+            if selected:
+                ranges.append((selected[0].offset, selected[-1].end))
+            tail_start = self.buckets[-1].end
+        else:
+            tail_start = 0
+
+        size = os.path.getsize(self.file_path)
+        if size > tail_start:
+            ranges.append((tail_start, size))
+        return ranges
+
+    def read_range(self, start: float, end: float, columns: List[str] | None = None) -> Iterator[dict]:
+        """
+        Yield the records with start <= timestamp < end.
+
+        :param start: Epoch start of the range
+        :param end: Epoch end of the range
+        :param columns: If given, only these columns (and the timestamp) are returned
+        """
+        ranges = self._byte_ranges(start, end)
+        if not ranges:
+            return
+
+        with self.file_path.open("rb") as f:
+            for offset, range_end in ranges:
+                if range_end <= offset:
+                    continue
+                # mmap offsets must be a multiple of the allocation granularity
+                aligned = offset - offset % mmap.ALLOCATIONGRANULARITY
+                with mmap.mmap(f.fileno(), range_end - aligned, access=mmap.ACCESS_READ, offset=aligned) as mm:
+                    position = offset - aligned
+                    limit = range_end - aligned
+                    while position < limit:
+                        newline = mm.find(b"\n", position, limit)
+                        if newline == -1:
+                            break
+                        data = json.loads(mm[position:newline])
+                        position = newline + 1
+                        timestamp = data.get("timestamp")
+                        if timestamp is None or timestamp < start:
+                            continue
+                        if timestamp >= end:
+                            break
+                        if columns is not None:
+                            data = {c: data[c] for c in columns + ["timestamp"] if c in data}
+                        yield data
+
+    def column_range(self, column: str, start: float, end: float) -> tuple:
+        """
+        The min and max of a column over the indexed buckets overlapping the range, without reading the file.
+
+        :return: (min, max), or (None, None) if there are no values
+        """
+        first = max(bisect.bisect_right(self._bucket_starts, start) - 1, 0)
+        last = bisect.bisect_right(self._bucket_starts, end)
+        minimums = [b.min[column] for b in self.buckets[first:last] if column in b.min]
+        maximums = [b.max[column] for b in self.buckets[first:last] if column in b.max]
+        if not minimums:
+            return None, None
+        return min(minimums), max(maximums)
+
+
+class PyDatabotIndexedSaveToFileDataCollector(PyDatabotSaveToFileDataCollector):
+    """
+    PyDatabotSaveToFileDataCollector that maintains a sidecar time index (file_name + ".idx") as records are written.
+
+    Attributes:
+        index_writer (NdjsonIndexWriter): Writer for the sidecar index.
+    """
+
+    def __init__(self, databot_config: DatabotConfig, file_name: str, extra_data: dict | None = None,
+                 number_of_records_to_collect: int | None = None, bucket_seconds: float = 60,
+                 log_level: int = logging.INFO):
+        super().__init__(databot_config, file_name, extra_data=extra_data,
+                         number_of_records_to_collect=number_of_records_to_collect, log_level=log_level)
+        self.index_writer = NdjsonIndexWriter(self.file_path, bucket_seconds=bucket_seconds)
+        # the capture file was removed by the parent class, so the old index no longer applies
+        self.index_writer.index_path.unlink(missing_ok=True)
+
+    def process_databot_data(self, epoch, data):
+        offset = self.file_path.stat().st_size if self.file_path.exists() else 0
+        try:
+            super().process_databot_data(epoch, data)
+        finally:
+            end = self.file_path.stat().st_size if self.file_path.exists() else 0
+            if end > offset:
+                self.index_writer.add(epoch, data, offset, end)
+
+    async def async_run(self):
+        try:
+            await super().async_run()
+        finally:
+            self.index_writer.flush()
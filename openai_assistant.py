@@ -1,14 +1,29 @@
+from __future__ import annotations
+
+import hashlib
+import json
 import os
 import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass, field
-from typing import Literal, List
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, Iterator, Literal, List
 import logging
 
-from openai import OpenAI
-from openai.types.beta import AssistantDeleted
-from openai.types.beta.threads.run import Run
-from openai.types.beta.threads.thread_message import ThreadMessage
-from openai.types.file_object import FileObject
+from answer_cache import AnswerCache
+from conversation_context import ConversationContext, estimate_tokens
+from file_cache import FileContentCache, get_file_cache
+from rate_limit import BACKGROUND, INTERACTIVE, RequestScheduler, get_default_scheduler
+from tracing import Tracer, get_tracer
+
+if TYPE_CHECKING:
+    from openai import OpenAI
+
+    from function_tools import FunctionToolRegistry
+    from openai.types.beta import AssistantDeleted
+    from openai.types.beta.threads.run import Run
+    from openai.types.beta.threads.thread_message import ThreadMessage
+    from openai.types.file_object import FileObject
 
 
 @dataclass
@@ -36,50 +51,140 @@ class AssistantFile:
     file_object: FileObject = field(default=None)
 
 
-class AssistantThreadMessage:
+@dataclass
+class FileOperationResult:
+    """
+    The result of one item of a bulk file operation.
+
+    Attributes:
+        item (str): The file path that was uploaded, or the file id that was deleted
+        file_id (str | None): The OpenAI file id, None if an upload failed
+        ok (bool): True if the operation succeeded
+        error (str | None): The error, if the operation failed
+    """
+    item: str
+    file_id: str | None = None
+    ok: bool = True
+    error: str | None = None
 
-    def __init__(self, thread_message: ThreadMessage):
-        self.thread_message = thread_message
 
-    def get_thread_message(self) -> ThreadMessage:
-        return self.thread_message
+class AssistantThreadMessage:
+    """
+    A compact, read only copy of a thread message.
+
+    The id, role, content parts and annotations are extracted from the SDK ThreadMessage once, and the
+    ThreadMessage itself is not kept, so a long conversation holds only the text and file ids.
+
+    Attributes:
+        message_id (str): The message id
+        role (str): "user" or "assistant"
+        parts (tuple): One (type, value) pair per content part.  The value is the text of "text" parts,
+                       and the file id of "image_file" parts.
+        annotations (tuple): One (type, text, file_id) triple per annotation of the text parts
+    """
+    __slots__ = ("message_id", "role", "parts", "annotations")
+
+    def __init__(self, thread_message: ThreadMessage | None = None, message_id: str | None = None,
+                 role: str | None = None, parts: tuple = (), annotations: tuple = ()):
+        if thread_message is not None:
+            message_id = thread_message.id
+            role = thread_message.role
+            parts, annotations = self._extract_content(thread_message.content)
+        self.message_id = message_id
+        self.role = role
+        self.parts = tuple(parts)
+        self.annotations = tuple(annotations)
+
+    @staticmethod
+    def _extract_content(content: list) -> tuple:
+        parts = []
+        annotations = []
+        for part in content:
+            if part.type == "text":
+                parts.append(("text", part.text.value))
+                for annotation in part.text.annotations:
+                    source = getattr(annotation, "file_citation", None) or getattr(annotation, "file_path", None)
+                    annotations.append((annotation.type, annotation.text, getattr(source, "file_id", None)))
+            elif part.type == "image_file":
+                parts.append(("image_file", part.image_file.file_id))
+            else:
+                parts.append((part.type, ""))
+        return parts, annotations
+
+    @classmethod
+    def from_text(cls, role: str, text: str, message_id: str | None = None) -> AssistantThreadMessage:
+        """
+        A text message that has no ThreadMessage behind it, e.g. an answer from the AnswerCache.
+        """
+        return cls(message_id=message_id or f"cached_{uuid.uuid4().hex}", role=role, parts=(("text", text),))
 
     def get_id(self) -> str:
-        return self.thread_message.id
+        return self.message_id
 
     def get_role(self) -> str:
-        return self.thread_message.role
+        return self.role
 
     def get_file_id(self) -> str:
-        if self.get_type() == "image_file":
-            return self.thread_message.content[0].image_file.file_id
-        else:
-            return ""
+        """
+        The file id of the first image of the message, or "" if there is none.
+        """
+        return next((value for part_type, value in self.parts if part_type == "image_file"), "")
+
+    def get_file_ids(self) -> List[str]:
+        return [value for part_type, value in self.parts if part_type == "image_file"]
 
     def get_type(self) -> str:
-        return self.thread_message.content[0].type
+        """
+        The type of the first content part.
+        """
+        return self.parts[0][0] if self.parts else "text"
+
+    def get_text(self) -> str:
+        """
+        The text of every text part of the message.
+        """
+        return "\n".join(value for part_type, value in self.parts if part_type == "text")
 
     def get_message(self) -> List[str]:
-        if self.get_type() == "text":
-            return [self.thread_message.content[0].text.value]
-        elif self.get_type() == "image_file":
-            return [self.thread_message.content[0].image_file.file_id, self.thread_message.content[1].text.value]
+        """
+        The value of every content part, in order: the text of text parts and the file id of images.
+        """
+        return [value for _, value in self.parts]
 
-    def get_message_annotations(self) -> List[str]:
-        if self.get_type() == "text":
-            return [self.thread_message.content[0].text.annotations]
-        return []
+    def get_message_annotations(self) -> List[tuple]:
+        return list(self.annotations)
 
     def __str__(self):
-        if self.get_type() == "text":
-            # msg = f"""{self.thread_message.content[0].text.value}
-            # {self.get_message_annotations()}"""
-            msg = self.thread_message.content[0].text.value
-            return msg
-        elif self.get_type() == "image_file":
-            return f"FileID: {self.thread_message.content[0].image_file.file_id}\n{self.thread_message.content[1].text.value}"
-        else:
-            return f"Unknown type: {self.get_type()}, MessageID: {self.thread_message.content[0]}"
+        lines = []
+        for part_type, value in self.parts:
+            if part_type == "text":
+                lines.append(value)
+            elif part_type == "image_file":
+                lines.append(f"FileID: {value}")
+            else:
+                lines.append(f"Unknown type: {part_type}, MessageID: {self.message_id}")
+        return "\n".join(lines)
+
+
+@dataclass
+class RunEvent:
+    """
+    Something observed while following a run with OpenAIAssistant.iter_run_events.
+
+    type is one of:
+        'status'      the run status changed
+        'message'     a message was added to the thread, or its content changed.  Updates reuse the message id.
+        'tool_call'   a function is about to be called, see function_name and function_args
+        'tool_output' a function returned, see function_name and output
+        'done'        the run reached a final status, message_history holds the conversation
+        'timeout'     the run did not finish within max_wait_time
+    """
+    type: Literal["status", "message", "tool_call", "tool_output", "done", "timeout"]
+    run: Run
+    message: AssistantThreadMessage | None = None
+    function_name: str | None = None
+    function_args: str | None = None
+    output: str | None = None
 
 
 @dataclass
@@ -91,30 +196,115 @@ class ChatMessage:
 
 
 class OpenAIAssistant:
-    def __init__(self, api_key: str = None, log_level: int = logging.WARNING):
+    def __init__(self, api_key: str = None, log_level: int = logging.WARNING, answer_cache: AnswerCache | None = None,
+                 openai_client: OpenAI | None = None, scheduler: RequestScheduler | None = None,
+                 context: ConversationContext | None = None, file_cache: FileContentCache | None = None,
+                 function_tools: FunctionToolRegistry | None = None, tracer: Tracer | None = None):
+        """
+        :param api_key: The OpenAI API key.  Defaults to the OPENAI_API_KEY environment variable.
+        :param log_level: The logging level
+        :param answer_cache: Optional cache of answers to repeated prompts
+        :param openai_client: An OpenAI client to share with other assistants.  When given, api_key is not used.
+        :param scheduler: Rate limits and retries the OpenAI calls.  Defaults to the scheduler shared by every assistant.
+        :param context: When given, the conversation is rolled into a new, summarized thread once it passes the
+                        context's token budget.
+        :param file_cache: Where downloaded file contents are cached.  Defaults to the cache shared by every assistant.
+        :param function_tools: The functions the assistant can call.  Their definitions are added to the assistant
+                               and the calls are dispatched to them by handle_requires_action.
+        :param tracer: Records the spans of the runs.  Defaults to the tracer shared by every assistant.
+        """
 
         logging.basicConfig(level=log_level)
 
-        if api_key is None:
-            api_key = os.getenv("OPENAI_API_KEY")
+        if openai_client is not None:
+            self.api_key = openai_client.api_key
+            self.openai_client = openai_client
+        else:
+            if api_key is None:
+                api_key = os.getenv("OPENAI_API_KEY")
+
+            if api_key is None:
+                raise ValueError("API key is required")
 
-        if api_key is None:
-            raise ValueError("API key is required")
+            # the openai package is large, import it when the first assistant is created rather than at app start up
+            from openai import OpenAI
 
-        self.api_key = api_key
-        self.openai_client = OpenAI(api_key=api_key)
+            self.api_key = api_key
+            # retries are done by the RequestScheduler
+            self.openai_client = OpenAI(api_key=api_key, max_retries=0)
+
+        self.scheduler = scheduler if scheduler is not None else get_default_scheduler()
+        self.context = context
+        self.file_cache = file_cache if file_cache is not None else get_file_cache()
+        self.function_tools = function_tools
+        self.tracer = tracer if tracer is not None else get_tracer()
 
         self.assistant = None
         self.thread = None
         self.run = None
-        self.files: List[AssistantFile] = []
+        # the assistant files by file id
+        self._files: Dict[str, AssistantFile] = {}
         self.functions: List[FunctionDefinition] = []
         self.message_history: List[AssistantThreadMessage] = []
 
+        # answers to the first prompt of a conversation are cached unless the run called a function tool that is
+        # not cacheable.  Later prompts depend on the conversation before them, so they are neither cached nor
+        # answered from the cache.
+        self.answer_cache = answer_cache
+        self.cached_response: List[AssistantThreadMessage] = []
+        self._pending_prompt: str | None = None
+        self._prompt_message_id: str | None = None
+        self._run_function_names: List[str] = []
+        self._conversation_prompts = 0
+        # questions and answers served from the cache, added to the thread with the next prompt
+        self._cached_exchanges: List[AssistantThreadMessage] = []
+        # the cached exchanges added to the thread, with the number of message_history messages before them
+        self._thread_exchanges: List[tuple] = []
+        # the summary of the threads before this one, see ConversationContext.summarize
+        self._seed_summary: List[str] = []
+        # the messages added to the thread as context for the assistant, not written by the user
+        self._context_message_ids: set = set()
+        # the estimated tokens of the thread that are not in message_history: context messages and tool outputs
+        self._unlisted_tokens = 0
+
+        # memoized create_function_definition_json result, keyed by the identity of the functions and the
+        # definitions key of the function tools
+        self._function_json_cache: tuple | None = None
+        # memoized get_assistant_fingerprint result, keyed by the identity of the assistant
+        self._fingerprint_cache: tuple | None = None
+
+    @property
+    def files(self) -> List[AssistantFile]:
+        return list(self._files.values())
+
+    @files.setter
+    def files(self, files: Iterable[AssistantFile]):
+        self._files = {file.file_id: file for file in files}
+
+    def _request(self, function, *args, priority: int = INTERACTIVE, **kwargs):
+        """
+        Make an OpenAI call through the RequestScheduler.  Use BACKGROUND priority for calls nobody is waiting on.
+        """
+        return self.scheduler.call(function, *args, priority=priority, **kwargs)
+
     def get_assistant_instructions(self) -> str:
         return "If documents are associated with this assistant, use the documents to help answer the question."
 
     def create_function_definition_json(self) -> List[dict]:
+        """
+        The function tool schemas for the assistant.  The schemas are built once and rebuilt only when a function
+        is added or replaced, or the enum values of the function tools changed, so treat the returned list as read
+        only.
+        """
+        enums_key = None
+        if self.function_tools is not None:
+            # updates the enum values of the registered definitions when their definitions key changed
+            self.function_tools.get_definitions()
+            enums_key = self.function_tools.enums_key
+        key = (tuple(id(function_definition) for function_definition in self.functions), enums_key)
+        if self._function_json_cache is not None and self._function_json_cache[0] == key:
+            return self._function_json_cache[1]
+
         result = []
         for function_definition in self.functions:
             function_template = {
@@ -148,6 +338,7 @@ class OpenAIAssistant:
             # result.append(json.dumps(function_template))
             result.append(function_template)
 
+        self._function_json_cache = (key, result)
         return result
 
     def add_function(self, function: FunctionDefinition):
@@ -155,26 +346,85 @@ class OpenAIAssistant:
 
     def delete_file(self, file_id: str) -> bool:
         logging.info(f"Delete File: {file_id}")
-        is_deleted = self.openai_client.files.delete(file_id=file_id)
+        is_deleted = self._request(self.openai_client.files.delete, file_id=file_id, priority=BACKGROUND)
         if is_deleted.deleted:
-            for i, assistant_file in enumerate(self.files):
-                if assistant_file.file_id == file_id:
-                    logging.info(f"Deleting local Assistant file: {self.files[i]}")
-                    del self.files[i]
+            self._files.pop(file_id, None)
         else:
             logging.info(f"File {file_id} was not deleted from OpenAI")
 
         return is_deleted.deleted
 
-    def delete_files(self):
-        file_ids = [f.file_id for f in self.files]
+    def _run_bulk(self, function: Callable[[str], str], items: List[str],
+                  max_workers: int) -> List[FileOperationResult]:
+        """
+        Call function(item) for every item on a bounded pool of threads.  The calls still go through the
+        RequestScheduler, so the pool only bounds how many requests are in flight.
 
-        for file_id in file_ids:
-            self.delete_file(file_id)
+        :return: One FileOperationResult per item, in the order of the items
+        """
+        if not items:
+            return []
+        results: List[FileOperationResult | None] = [None] * len(items)
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(items)), thread_name_prefix="assistant-files") as pool:
+            futures = {pool.submit(function, item): i for i, item in enumerate(items)}
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    results[i] = FileOperationResult(item=items[i], file_id=future.result())
+                except Exception as exc:
+                    logging.warning(f"File operation on {items[i]} failed: {exc}")
+                    results[i] = FileOperationResult(item=items[i], ok=False, error=str(exc))
+        return results
+
+    def delete_files(self, file_ids: List[str] | None = None, max_workers: int = 8) -> List[FileOperationResult]:
+        """
+        Delete files in parallel.
+
+        :param file_ids: The files to delete.  Defaults to every assistant file.
+        :param max_workers: The maximum number of deletes in flight
+        :return: One FileOperationResult per file id.  ok is False if the file was not deleted.
+        """
+        if file_ids is None:
+            file_ids = list(self._files)
+
+        def delete(file_id: str) -> str:
+            is_deleted = self._request(self.openai_client.files.delete, file_id=file_id, priority=BACKGROUND)
+            if not is_deleted.deleted:
+                raise RuntimeError("File was not deleted from OpenAI")
+            return file_id
+
+        results = self._run_bulk(delete, list(file_ids), max_workers)
+        for result in results:
+            if result.ok:
+                self._files.pop(result.file_id, None)
+        logging.info(f"Deleted {sum(r.ok for r in results)} of {len(results)} files")
+        return results
+
+    def _download_file(self, file_id: str, f):
+        def stream_to_file():
+            # a retry writes the file again from the start
+            f.seek(0)
+            f.truncate()
+            with self.openai_client.files.with_streaming_response.content(file_id) as response:
+                for chunk in response.iter_bytes():
+                    f.write(chunk)
+
+        self._request(stream_to_file)
+
+    def get_file_path(self, file_id: str) -> str:
+        """
+        The path of the file content in the local file cache.  The file is downloaded on first use only.
+        """
+        return str(self.file_cache.get_path(file_id, lambda f: self._download_file(file_id, f)))
+
+    def get_file_content(self, file_id: str) -> bytes:
+        return self.file_cache.read(file_id, lambda f: self._download_file(file_id, f))
 
-    def get_file_content(self, file_id: str):
-        myfile = self.openai_client.files.content(file_id=file_id)
-        return myfile.content
+    def open_file_content(self, file_id: str):
+        """
+        The file content memory mapped from the local file cache.  Close it when done.
+        """
+        return self.file_cache.open(file_id, lambda f: self._download_file(file_id, f))
 
     def add_file_id_to_assistant(self, file_id: str):
         """
@@ -183,48 +433,87 @@ class OpenAIAssistant:
         :param file_id:
         :return:
         """
-        for file in self.files:
-            if file.file_id == file_id:
-                break
-        else:
-            self.files.append(AssistantFile(
-                file_id=file_id
-            ))
+        if file_id not in self._files:
+            self._files[file_id] = AssistantFile(file_id=file_id)
 
-    def add_file_to_assistant(self, file_path: str) -> str:
+    def _upload_file(self, file_path: str) -> AssistantFile:
+        def upload_file():
+            # opened on every attempt, so a retry uploads the whole file again
+            with open(file_path, "rb") as f:
+                return self.openai_client.files.create(file=f, purpose="assistants")
 
-        file = self.openai_client.files.create(file=open(file_path, "rb"), purpose="assistants")
-        self.files.append(AssistantFile(
+        file = self._request(upload_file, priority=BACKGROUND)
+        if self.assistant is not None:
+            self._request(self.openai_client.beta.assistants.files.create, assistant_id=self.assistant.id,
+                          file_id=file.id, priority=BACKGROUND)
+
+        return AssistantFile(
             file_id=file.id,
             file_path=file_path,
             file_object=file
-        ))
+        )
 
-        if self.assistant is not None:
-            self.openai_client.beta.assistants.files.create(assistant_id=self.assistant.id, file_id=file.id)
+    def add_file_to_assistant(self, file_path: str) -> str:
+        assistant_file = self._upload_file(file_path)
+        self._files[assistant_file.file_id] = assistant_file
+        return assistant_file.file_id
 
-        return file.id
+    def add_files_to_assistant(self, file_paths: List[str], max_workers: int = 8) -> List[FileOperationResult]:
+        """
+        Upload files in parallel, and attach them to the assistant if it has been created.
+
+        :param file_paths: The files to upload
+        :param max_workers: The maximum number of uploads in flight
+        :return: One FileOperationResult per file path, with the file id of the uploaded file
+        """
+        uploaded: Dict[str, AssistantFile] = {}
+
+        def upload(file_path: str) -> str:
+            assistant_file = self._upload_file(file_path)
+            uploaded[file_path] = assistant_file
+            return assistant_file.file_id
+
+        results = self._run_bulk(upload, list(file_paths), max_workers)
+        for result in results:
+            if result.ok:
+                self._files[result.file_id] = uploaded[result.item]
+        logging.info(f"Uploaded {sum(r.ok for r in results)} of {len(results)} files")
+        return results
+
+    def _list_pages(self, function, priority: int = BACKGROUND, **kwargs) -> Iterator:
+        """
+        Iterate over every item of a paginated list call, fetching each page through the RequestScheduler.
+        """
+        page = self._request(function, priority=priority, **kwargs)
+        while True:
+            yield from page.data
+            if not page.has_next_page():
+                break
+            page = self._request(page.get_next_page, priority=priority)
 
     def get_assistant_files(self, refresh_from_openai: bool = False) -> List[AssistantFile]:
         """
-        :param refresh_from_openai: A boolean value indicating whether to retrieve all files from OpenAI or only the locally stored ones. Default is False.
+        :param refresh_from_openai: A boolean value indicating whether to retrieve the files from OpenAI or only the locally stored ones. Default is False.
         :return: A list of AssistantFile objects.
 
-        This method retrieves the assistant files either from OpenAI or from the locally stored files. If `all_from_openai` is set to True, it will fetch all files from OpenAI and return them
-        * as a list of AssistantFile objects. If `all_from_openai` is set to False, it will return the locally stored files.
+        This method retrieves the assistant files either from OpenAI or from the locally stored files. If `refresh_from_openai` is set to True,
+        the local files are replaced with the files attached to the assistant, or with the files with the "assistants" purpose when no assistant
+        has been created.  Files already known locally keep their path and file object.
         """
         if refresh_from_openai:
-            # then remove the internal collection and replace with the list from openai
-            self.files = []
-            resp: List[AssistantFile] = []
-            files = self.openai_client.files.list()
-            for file in files:
-                resp.append(AssistantFile(
-                    file_id=file.id,
-                    file_path=file.filename,
-                    file_object=file
-                ))
-            self.files = resp
+            files: Dict[str, AssistantFile] = {}
+            if self.assistant is not None:
+                for file in self._list_pages(self.openai_client.beta.assistants.files.list,
+                                             assistant_id=self.assistant.id, limit=100):
+                    files[file.id] = self._files.get(file.id) or AssistantFile(file_id=file.id)
+            else:
+                for file in self._list_pages(self.openai_client.files.list, purpose="assistants"):
+                    files[file.id] = AssistantFile(
+                        file_id=file.id,
+                        file_path=file.filename,
+                        file_object=file
+                    )
+            self._files = files
 
         return self.files
 
@@ -234,6 +523,11 @@ class OpenAIAssistant:
                              "gpt-3.5-turbo-1106", "gpt-4-1106-preview"] = "gpt-3.5-turbo-1106",
                          include_files: bool = True):
 
+        if self.function_tools is not None:
+            for function_definition in self.function_tools.get_definitions():
+                if function_definition not in self.functions:
+                    self.add_function(function_definition)
+
         tool_list = []
         for tool in tools:
             if tool == "function":
@@ -258,21 +552,124 @@ class OpenAIAssistant:
                 instructions = instructions + f"\n Use files with ids: {','.join(file_ids)} associated with this assistant when answering a question."
 
 
-        self.assistant = self.openai_client.beta.assistants.create(
+        self.assistant = self._request(
+            self.openai_client.beta.assistants.create,
             name=name,
             instructions=instructions,
             tools=tool_list,
             model=model,
-            file_ids=file_ids
+            file_ids=file_ids,
+            priority=BACKGROUND
         )
 
+    def get_assistant_fingerprint(self) -> str:
+        """
+        A fingerprint of everything that shapes the answers of the assistant: model, instructions and tools.
+
+        Assistants created with the same configuration share the fingerprint, so they can share cached answers.
+        """
+        if self._fingerprint_cache is not None and self._fingerprint_cache[0] is self.assistant:
+            return self._fingerprint_cache[1]
+
+        fingerprint = json.dumps({
+            "model": self.assistant.model,
+            "instructions": self.assistant.instructions,
+            "tools": [tool.model_dump() for tool in self.assistant.tools]
+        }, sort_keys=True)
+        fingerprint = hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()
+        self._fingerprint_cache = (self.assistant, fingerprint)
+        return fingerprint
+
+    def _get_cached_response(self, user_prompt: str) -> List[AssistantThreadMessage] | None:
+        if self.answer_cache is None or self.assistant is None or self._conversation_prompts > 0:
+            return None
+        answers = self.answer_cache.get(self.get_assistant_fingerprint(), user_prompt)
+        if answers is None:
+            return None
+        logging.info(f"Answered from the cache: {user_prompt}")
+        return [AssistantThreadMessage.from_text(role="user", text=user_prompt)] + \
+            [AssistantThreadMessage.from_text(role="assistant", text=answer) for answer in answers]
+
+    def _cache_run_response(self, the_run: Run, conversation: List[AssistantThreadMessage]):
+        if self.answer_cache is None or self._pending_prompt is None or the_run.status != "completed":
+            return
+        prompt = self._pending_prompt
+        self._pending_prompt = None
+
+        # a run without function calls is cacheable with or without a registry, a function call is cacheable only
+        # when the registry says so
+        if self._run_function_names and (self.function_tools is None or not all(
+                self.function_tools.is_cacheable(name) for name in self._run_function_names)):
+            self.answer_cache.skip()
+            return
+
+        ids = [message.get_id() for message in conversation]
+        if self._prompt_message_id not in ids:
+            return
+        answers = conversation[ids.index(self._prompt_message_id) + 1:]
+        if not answers or any(m.get_role() != "assistant" or m.get_type() != "text" or m.get_file_id()
+                              for m in answers):
+            self.answer_cache.skip()
+            return
+        self.answer_cache.put(self.get_assistant_fingerprint(), prompt, [str(m) for m in answers])
+
     def delete_assistant(self) -> AssistantDeleted:
-        response = self.openai_client.beta.assistants.delete(self.assistant.id)
+        response = self._request(self.openai_client.beta.assistants.delete, self.assistant.id, priority=BACKGROUND)
         return response
 
     def _create_conversation(self):
         if self.thread is None:
-            self.thread = self.openai_client.beta.threads.create()
+            self.thread = self._request(self.openai_client.beta.threads.create)
+
+    def _add_context_message(self, content: str) -> ThreadMessage:
+        """
+        Add a message the assistant needs as context to the thread.  Threads only take user messages, so it is
+        added as one, and left out of the conversation shown to the user.
+        """
+        message = self._request(self.openai_client.beta.threads.messages.create, thread_id=self.thread.id,
+                                role="user", content=content)
+        self._context_message_ids.add(message.id)
+        self._unlisted_tokens += estimate_tokens(content)
+        return message
+
+    def _add_cached_exchanges(self):
+        """
+        Add the questions and answers served from the cache to the thread, so the next prompt is answered with them
+        as context.
+        """
+        if not self._cached_exchanges:
+            return
+        lines = ["Earlier in this conversation:"]
+        lines.extend(f"{message.get_role()}: {message}" for message in self._cached_exchanges)
+        self._add_context_message("\n".join(lines))
+        self._thread_exchanges.append((len(self.message_history), self._cached_exchanges))
+        self._cached_exchanges = []
+
+    def _rollover_conversation(self):
+        """
+        Start a new thread, seeded with a summary of the conversation so far, if the conversation is over the
+        context's token budget.  Runs on the new thread only process the seed and the new messages.
+        """
+        if self.context is None or self.thread is None or \
+                not self.context.needs_rollover(self.message_history, self._unlisted_tokens):
+            return
+
+        # the conversation of the thread, with the exchanges answered from the cache where they were asked
+        messages = list(self.message_history)
+        for position, exchange in reversed(self._thread_exchanges):
+            messages[position:position] = exchange
+        seed = self.context.build_seed(messages, self._seed_summary)
+        logging.info(f"Rolling conversation {self.thread.id} into a new thread, "
+                     f"{self.context.estimate(self.message_history, self._unlisted_tokens)} estimated tokens")
+        self.thread = self._request(self.openai_client.beta.threads.create)
+        self._unlisted_tokens = 0
+        # the seed is context for the assistant, it is not shown as a message of the student
+        self._add_context_message(seed)
+        # the summary of this thread is in the seed, and is carried over to the next one
+        self._seed_summary = self.context.summarize(messages, self._seed_summary)
+        self._thread_exchanges = []
+        self.message_history = []
+        self.context.rollovers += 1
 
     def _add_user_prompt(self, user_prompt: str, include_files: bool = False) -> ThreadMessage:
         self._create_conversation()
@@ -282,7 +679,8 @@ class OpenAIAssistant:
                 if i < 10:
                     file_ids.append(file.file_id)
 
-        message = self.openai_client.beta.threads.messages.create(
+        message = self._request(
+            self.openai_client.beta.threads.messages.create,
             thread_id=self.thread.id,
             role="user",
             content=user_prompt,
@@ -290,17 +688,44 @@ class OpenAIAssistant:
         )
         return message
 
-    def submit_user_prompt(self, user_prompt: str, instructions: str = "", wait_for_completion: bool = False) -> Run:
-        # hard code include files to false
-        # Todo should figure out a way to allow the user to select which documents to use for a specific
-        # request.
-        self._add_user_prompt(user_prompt, include_files=False)
+    def submit_user_prompt(self, user_prompt: str, instructions: str = "", wait_for_completion: bool = False) -> Run | None:
+        """
+        Add the user prompt to the conversation and start a run.
 
-        self.run = self.openai_client.beta.threads.runs.create(
-            thread_id=self.thread.id,
-            assistant_id=self.assistant.id,
-            instructions=instructions
-        )
+        If the answer is in the answer cache no run is started, None is returned and the question and
+        answer are available in `cached_response`.
+        """
+        with self.tracer.span("submit_user_prompt", prompt_chars=len(user_prompt)) as span:
+            self.cached_response = []
+            if not instructions:
+                cached_response = self._get_cached_response(user_prompt)
+                span.set_attribute("cache_hit", cached_response is not None)
+                if cached_response is not None:
+                    self.cached_response = cached_response
+                    self._cached_exchanges.extend(cached_response)
+                    self._conversation_prompts += 1
+                    return None
+
+            # hard code include files to false
+            # Todo should figure out a way to allow the user to select which documents to use for a specific
+            # request.
+            self._rollover_conversation()
+            self._create_conversation()
+            self._add_cached_exchanges()
+            message = self._add_user_prompt(user_prompt, include_files=False)
+            # only the first prompt of a conversation is answered without context, so only its answer is cached
+            self._pending_prompt = user_prompt if not instructions and self._conversation_prompts == 0 else None
+            self._conversation_prompts += 1
+            self._prompt_message_id = message.id
+            self._run_function_names = []
+
+            self.run = self._request(
+                self.openai_client.beta.threads.runs.create,
+                thread_id=self.thread.id,
+                assistant_id=self.assistant.id,
+                instructions=instructions
+            )
+            span.set_attribute("run_id", self.run.id)
 
         if wait_for_completion:
             self.poll_for_assistant_conversation()
@@ -308,44 +733,125 @@ class OpenAIAssistant:
         return self.run
 
     def get_run(self) -> Run:
-        the_run = self.openai_client.beta.threads.runs.retrieve(
-            thread_id=self.thread.id,
-            run_id=self.run.id
-        )
+        with self.tracer.span("get_run") as span:
+            the_run = self._request(
+                self.openai_client.beta.threads.runs.retrieve,
+                thread_id=self.thread.id,
+                run_id=self.run.id
+            )
+            span.set_attribute("run_status", the_run.status)
         return the_run
 
     def get_assistant_conversation(self) -> List[AssistantThreadMessage]:
-        messages = self.openai_client.beta.threads.messages.list(
-            thread_id=self.thread.id
-        )
-        thread_messages = []
-        for thread_message in messages.data[::-1]:
-            thread_messages.append(AssistantThreadMessage(thread_message))
+        with self.tracer.span("get_assistant_conversation") as span:
+            # every page of the thread, a conversation can pass the 20 messages of a page before it is rolled over
+            messages = self._list_pages(self.openai_client.beta.threads.messages.list, priority=INTERACTIVE,
+                                        thread_id=self.thread.id, order="asc", limit=100)
+            thread_messages = []
+            for thread_message in messages:
+                if thread_message.id not in self._context_message_ids:
+                    thread_messages.append(AssistantThreadMessage(thread_message))
+            span.set_attribute("messages", len(thread_messages))
 
         return thread_messages
 
-    def poll_for_assistant_conversation(self, max_wait_time: int = 60) -> List[AssistantThreadMessage]:
-        the_run = self.get_run()
-        response = the_run.status
-        max_timeout = max_wait_time
+    def _list_new_messages(self, after: str | None) -> List[ThreadMessage]:
+        with self.tracer.span("list_new_messages"):
+            messages = self._request(
+                self.openai_client.beta.threads.messages.list,
+                thread_id=self.thread.id,
+                order="asc",
+                after=after
+            )
+        return messages.data
+
+    def cancel_run(self) -> Run:
+        """
+        Cancel the current run.  The run goes to 'cancelling' and then 'cancelled'.
+        """
+        logging.info(f"Cancel Run: {self.run.id}")
+        return self._request(self.openai_client.beta.threads.runs.cancel, thread_id=self.thread.id, run_id=self.run.id)
 
-        # we cannot just look for != 'complete' because it might be 'requires_action'
-        # when we need to call a function
-        while response == "queued" or response == "in_progress" or response == "requires_action":
+    def iter_run_events(self, max_wait_time: float = 60, min_poll_interval: float = 1.0,
+                        max_poll_interval: float = 2.0,
+                        should_cancel: Callable[[], bool] | None = None) -> Iterator[RunEvent]:
+        """
+        Follow the current run and yield RunEvents as soon as they are observed, so a UI can show progress
+        and the assistant's messages before the run has finished.
+
+        The run is polled every min_poll_interval at first, and the interval grows to max_poll_interval while
+        nothing changes.  The thread's messages are only listed when the run status changed, as the assistant's
+        messages are added while the run moves between statuses.
+
+        :param max_wait_time: Wall clock seconds to wait for the run to finish.  After that the run is cancelled
+                              and a 'timeout' event is yielded.
+        :param min_poll_interval: Seconds between polls right after something changed
+        :param max_poll_interval: The longest time between polls
+        :param should_cancel: Checked on every poll.  When it returns True the run is cancelled, and followed until
+                              OpenAI reports it as cancelled.
+        """
+        deadline = time.monotonic() + max_wait_time
+        poll_interval = min_poll_interval
+        last_status = None
+        status_start_ns = time.time_ns()
+        message_text_lengths = {}
+        cancel_sent = False
+
+        while True:
             the_run = self.get_run()
-            response = the_run.status
-
-            self.run_response_callback(the_run=the_run)
-
-            if response == "requires_action":
+            changed = False
+            status_changed = False
+
+            if should_cancel is not None and not cancel_sent and the_run.status in ("queued", "in_progress",
+                                                                                     "requires_action") \
+                    and should_cancel():
+                the_run = self.cancel_run()
+                cancel_sent = True
+
+            if the_run.status != last_status:
+                # the time spent in each status, e.g. queued or in_progress for the model, as observed by the polls
+                now_ns = time.time_ns()
+                if last_status is not None:
+                    self.tracer.record_span(f"run_{last_status}", status_start_ns, now_ns)
+                status_start_ns = now_ns
+                last_status = the_run.status
+                changed = True
+                status_changed = True
+                self.run_response_callback(the_run=the_run)
+                yield RunEvent(type="status", run=the_run)
+
+            # messages added to the thread after the prompt, in the order they were created.  They are listed
+            # again on every status change so that content added to a message that was already shown is picked up.
+            new_messages = self._list_new_messages(after=self._prompt_message_id) if status_changed else []
+            for thread_message in new_messages:
+                if not thread_message.content:
+                    continue
+                message = AssistantThreadMessage(thread_message)
+                text_length = len(str(message))
+                if message_text_lengths.get(message.get_id()) != text_length:
+                    message_text_lengths[message.get_id()] = text_length
+                    changed = True
+                    yield RunEvent(type="message", run=the_run, message=message)
+
+            if the_run.status == "requires_action" and not cancel_sent:
                 tool_outputs = []
                 tool_calls = the_run.required_action.submit_tool_outputs.tool_calls
 
                 for tool_call in tool_calls:
                     function_name = tool_call.function.name
                     function_args = tool_call.function.arguments
-
-                    function_output = self.handle_requires_action(tool_call, function_name, function_args)
+                    self._run_function_names.append(function_name)
+                    yield RunEvent(type="tool_call", run=the_run, function_name=function_name,
+                                   function_args=function_args)
+
+                    # spans are not held open across a yield, the consumer of the events would run inside them
+                    with self.tracer.span("handle_requires_action", function_name=function_name) as span:
+                        function_output = self.handle_requires_action(tool_call, function_name, function_args)
+                        span.set_attribute("output_bytes", len(function_output.encode("utf-8")))
+                    # tool outputs are part of the thread's context, but not of its messages
+                    self._unlisted_tokens += estimate_tokens(function_output)
+                    yield RunEvent(type="tool_output", run=the_run, function_name=function_name,
+                                   output=function_output)
 
                     tool_output = {
                         "tool_call_id": tool_call.id,
@@ -353,34 +859,49 @@ class OpenAIAssistant:
                     }
 
                     tool_outputs.append(tool_output)
-                self.openai_client.beta.threads.runs.submit_tool_outputs(thread_id=self.thread.id,
-                                                                         run_id=the_run.id, tool_outputs=tool_outputs)
-                time.sleep(1)
-                the_run = self.get_run()
-                response = the_run.status
-                continue
-
-            time.sleep(1)
-            the_run = self.get_run()
-            response = the_run.status
-            max_timeout -= 1
-            if max_timeout == 0:
-                break
-        self.run_response_callback(the_run=the_run)
+                with self.tracer.span("submit_tool_outputs", tool_outputs=len(tool_outputs)):
+                    self._request(self.openai_client.beta.threads.runs.submit_tool_outputs, thread_id=self.thread.id,
+                                  run_id=the_run.id, tool_outputs=tool_outputs)
+                changed = True
+
+            # we cannot just look for != 'complete' because it might be 'requires_action'
+            # when we need to call a function
+            elif the_run.status not in ("queued", "in_progress", "requires_action", "cancelling"):
+                conversation = self.get_assistant_conversation()
+                self.message_history = conversation
+                self._cache_run_response(the_run, conversation)
+                yield RunEvent(type="done", run=the_run)
+                return
+
+            if time.monotonic() >= deadline:
+                # an active run locks the thread, so cancel it before giving up on it
+                if not cancel_sent:
+                    try:
+                        self.cancel_run()
+                    except Exception as exc:
+                        logging.warning(f"Could not cancel the run after the timeout: {exc}")
+                yield RunEvent(type="timeout", run=the_run)
+                return
+
+            poll_interval = min_poll_interval if changed else min(poll_interval * 1.5, max_poll_interval)
+            time.sleep(poll_interval)
 
-        if max_timeout == 0:
-            return ["Timeout occurred. Please try again"]
-        else:
-            conversation = self.get_assistant_conversation()
-            messages = []
-            for message in conversation:
-                messages.append(message)
-            self.message_history = messages
-            return messages
+    def poll_for_assistant_conversation(self, max_wait_time: int = 60) -> List[AssistantThreadMessage]:
+        for event in self.iter_run_events(max_wait_time=max_wait_time):
+            if event.type == "timeout":
+                return ["Timeout occurred. Please try again"]
+
+        return self.message_history
 
     def handle_requires_action(self, tool_call, function_name: str, function_args: str) -> str:
-        raise NotImplementedError(
-            "handle_requires_action is not implemented.  Expected to be implemented in base classes")
+        """
+        Call the function the assistant asked for, and return its output.  Calls are dispatched to the
+        function_tools; override this for functions that are not registered there.
+        """
+        if self.function_tools is None:
+            raise NotImplementedError(
+                "handle_requires_action is not implemented.  Expected to be implemented in base classes")
+        return self.function_tools.call(function_name, function_args)
 
     def run_response_callback(self, the_run: Run):
-        print(f"The Run Status is: {the_run.status}")
+        logging.debug(f"The Run Status is: {the_run.status}")
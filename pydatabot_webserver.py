@@ -1,13 +1,32 @@
+import argparse
 import logging
+import multiprocessing
+import os
 from pathlib import Path
 import sys
 
 root_dir = str(Path(__file__).resolve().parent.parent)
 sys.path.append(root_dir)
 
-from databot.PyDatabot import start_databot_webserver, PyDatabot, PyDatabotSaveToQueueDataCollector, DatabotConfig
+from databot.PyDatabot import PyDatabot, DatabotConfig
 
-def main():
+from databot_alerts import AlertDetector, AlertEventReader
+from databot_bus import FileSink, UnixSocketBridge
+from databot_rollups import RollupStore
+from databot_server import start_databot_webserver, serve_databot_webserver, export_ingestion_metrics, \
+    DatabotServerDataCollector, SampleRingReader
+from databot_shm import SampleRing
+from databot_signals import DerivedSignalEngine
+
+ROLLUP_DB_PATH = "data/databot_rollups.db"
+RING_NAME = "databot_samples"
+EVENT_RING_NAME = "databot_events"
+METRICS_RING_NAME = "databot_metrics"
+# seconds between writes of the open rollup buckets, for the history queries of the server processes
+ROLLUP_FLUSH_INTERVAL = 1.0
+
+
+def get_databot_config() -> DatabotConfig:
     c = DatabotConfig()
     c.accl = True
     c.Laccl = True
@@ -22,11 +41,123 @@ def main():
     c.voc = True
     c.refresh = 1000
     c.address = PyDatabot.get_databot_address()
-    db = PyDatabotSaveToQueueDataCollector(c, log_level=logging.DEBUG)
+    return c
+
 
-    t =start_databot_webserver(queue_data_collector=db, host="localhost", port=8321)
+def subscribe_sinks(db: DatabotServerDataCollector, capture_file: str | None, socket_path: str | None,
+                    events_socket_path: str | None):
+    """
+    Subscribe the optional capture file and Unix socket streams to the records and alert events of the collector.
+    """
+    if capture_file is not None:
+        # a large buffer, so a slow disk does not lose records.  The bus never waits for the file, a publisher
+        # blocked on it would stall the notifications.
+        db.bus.subscribe("file", FileSink(capture_file), buffer_size=100000, overflow="drop_newest")
+    if socket_path is not None:
+        UnixSocketBridge(db.bus, socket_path).start()
+    if events_socket_path is not None:
+        UnixSocketBridge(db.alerts.bus, events_socket_path).start()
+
+
+def run_ingestion(c: DatabotConfig, ring_name: str, event_ring_name: str, metrics_ring_name: str,
+                  capture_file: str | None = None, socket_path: str | None = None,
+                  events_socket_path: str | None = None):
+    """
+    The ingestion process: reads the databot over BLE, publishes every record to the ring and runs the alert
+    rules, publishing their events to the event ring.  Its metrics are exported to the metrics ring.
+    """
+    logging.basicConfig(level=logging.INFO)
+    sample_ring = SampleRing.attach(ring_name)
+    alerts = AlertDetector(event_ring=SampleRing.attach(event_ring_name))
+    rollup_store = RollupStore(ROLLUP_DB_PATH, flush_interval=ROLLUP_FLUSH_INTERVAL)
+    db = DatabotServerDataCollector(c, rollup_store=rollup_store, sample_ring=sample_ring, alerts=alerts,
+                                    log_level=logging.INFO)
+    subscribe_sinks(db, capture_file, socket_path, events_socket_path)
+    export_ingestion_metrics(SampleRing.attach(metrics_ring_name))
     db.run()
 
 
+def run_server(ring_name: str, event_ring_name: str, metrics_ring_name: str, host: str, port: int,
+               reuse_port: bool):
+    """
+    A server process: serves the records, alert events and ingestion metrics of the rings.
+    """
+    logging.basicConfig(level=logging.INFO)
+    sample_ring = SampleRing.attach(ring_name)
+    ring_reader = SampleRingReader(sample_ring, rollup_store=RollupStore(ROLLUP_DB_PATH, read_only=True),
+                                   signal_engine=DerivedSignalEngine(),
+                                   alerts=AlertEventReader(SampleRing.attach(event_ring_name)),
+                                   metrics_ring=SampleRing.attach(metrics_ring_name))
+    serve_databot_webserver(ring_reader, host=host, port=port, reuse_port=reuse_port)
+
+
+def main(workers: int = 1, host: str = "localhost", port: int = 8321, capture_file: str | None = None,
+         socket_path: str | None = None, events_socket_path: str | None = None):
+    """
+    Run the BLE ingestion and the web server in separate processes, so web requests do not hold up the
+    databot notifications.  With workers=0 both run in this process.
+
+    :param workers: The number of web server processes.  More than one share the port with SO_REUSEPORT.
+    :param capture_file: An NDJSON file every record is also appended to
+    :param socket_path: A Unix socket other local processes can read the records from, see read_unix_socket
+    :param events_socket_path: A Unix socket other local processes can read the alert events from
+    """
+    c = get_databot_config()
+    if workers == 0:
+        rollup_store = RollupStore(ROLLUP_DB_PATH)
+        db = DatabotServerDataCollector(c, rollup_store=rollup_store, signal_engine=DerivedSignalEngine(),
+                                        alerts=AlertDetector(), log_level=logging.INFO)
+        subscribe_sinks(db, capture_file, socket_path, events_socket_path)
+
+        t = start_databot_webserver(queue_data_collector=db, host=host, port=port)
+        db.run()
+        return
+
+    # the tables are created before the processes start, the server processes open the database read only
+    RollupStore(ROLLUP_DB_PATH).close()
+
+    # the parent owns the rings, and removes them when the processes stop.  The names include the parent's pid, so
+    # the rings of a crashed run, or of another running instance, are not in the way.
+    pid = os.getpid()
+    ring_name, event_ring_name, metrics_ring_name = \
+        f"{RING_NAME}_{pid}", f"{EVENT_RING_NAME}_{pid}", f"{METRICS_RING_NAME}_{pid}"
+    sample_ring = SampleRing.create(ring_name, replace=True)
+    event_ring = SampleRing.create(event_ring_name, capacity=256, replace=True)
+    # a few large slots, every export holds all of the ingestion metrics
+    metrics_ring = SampleRing.create(metrics_ring_name, capacity=4, slot_size=65536, replace=True)
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=run_ingestion, args=(c, ring_name, event_ring_name, metrics_ring_name,
+                                                             capture_file, socket_path, events_socket_path),
+                                 name="databot-ingestion")]
+    processes.extend(context.Process(target=run_server, args=(ring_name, event_ring_name, metrics_ring_name, host,
+                                                              port, workers > 1),
+                                     name=f"databot-server-{i}", daemon=True)
+                     for i in range(workers))
+    try:
+        for process in processes:
+            process.start()
+        processes[0].join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+        sample_ring.close()
+        event_ring.close()
+        metrics_ring.close()
+
+
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description="Databot web server")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="The number of web server processes, 0 to run the server in the ingestion process")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8321)
+    parser.add_argument("--capture", help="Also append every record to this NDJSON file")
+    parser.add_argument("--socket", help="Stream the records to other local processes on this Unix socket")
+    parser.add_argument("--events-socket", help="Stream the alert events to other local processes on this Unix socket")
+    args = parser.parse_args()
+    main(workers=args.workers, host=args.host, port=args.port, capture_file=args.capture, socket_path=args.socket,
+         events_socket_path=args.events_socket)
@@ -0,0 +1,222 @@
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List
+
+
+class TokenBucket:
+    """
+    A thread safe token bucket.
+
+    Tokens are added at `rate` per second up to `capacity`.  Each request takes one or more tokens.
+
+    :param rate: Tokens added per second
+    :param capacity: The maximum number of tokens, i.e. the largest burst
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """
+        Take tokens if they are available.
+
+        :return: True if the tokens were taken
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def time_until_available(self, tokens: float = 1) -> float:
+        """
+        :return: Seconds until the tokens will be available, 0 if they are available now
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            return max(0.0, (tokens - self._tokens) / self.rate)
+
+    def acquire(self, tokens: float = 1, timeout: float | None = None) -> bool:
+        """
+        Wait for tokens and take them.
+
+        :param timeout: The maximum number of seconds to wait.  None waits as long as needed.
+        :return: True if the tokens were taken, False on timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.try_acquire(tokens):
+            wait = self.time_until_available(tokens)
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+        return True
+
+
+# request priorities for the RequestScheduler, lower values go first
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# HTTP status codes worth retrying
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+# exceptions raised by the openai package when there was no HTTP response
+RETRYABLE_EXCEPTION_NAMES = {"APIConnectionError", "APITimeoutError"}
+
+
+def is_retryable(exc: Exception) -> bool:
+    """
+    True for rate limits, timeouts, connection errors and server errors.
+    """
+    if getattr(exc, "status_code", None) in RETRYABLE_STATUS_CODES:
+        return True
+    return any(cls.__name__ in RETRYABLE_EXCEPTION_NAMES for cls in type(exc).__mro__)
+
+
+def get_retry_after(exc: Exception) -> float | None:
+    """
+    The Retry-After header of the error response, in seconds, if there is one.
+    """
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+@dataclass
+class SchedulerStats:
+    requests: int = 0
+    retries: int = 0
+    rate_limited: int = 0  # responses with status 429
+    failures: int = 0  # requests that failed after the last retry
+    throttle_delay: Dict[int, float] = field(default_factory=dict)  # priority -> total seconds waited for a token
+    max_throttle_delay: float = 0.0
+    backoff_delay: float = 0.0  # total seconds slept between retries
+
+    def as_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "rate_limited": self.rate_limited,
+            "failures": self.failures,
+            "throttle_delay": {("interactive" if p == INTERACTIVE else "background"): round(d, 3)
+                               for p, d in self.throttle_delay.items()},
+            "max_throttle_delay": round(self.max_throttle_delay, 3),
+            "backoff_delay": round(self.backoff_delay, 3)
+        }
+
+
+class RequestScheduler:
+    """
+    Client side rate limiting and retries for OpenAI API calls, shared by every assistant in the process.
+
+    Every call takes a token from a shared TokenBucket.  When tokens are scarce, waiting INTERACTIVE calls
+    (runs, messages) go before BACKGROUND calls (uploads, clean up).  Retryable errors are retried with
+    full jitter exponential backoff, honouring Retry-After.
+
+    Usage:
+        scheduler.call(client.beta.threads.runs.retrieve, thread_id=thread_id, run_id=run_id)
+        scheduler.call(client.files.delete, file_id=file_id, priority=BACKGROUND)
+
+    :param requests_per_second: The sustained request rate
+    :param burst: The number of requests that can be made back to back
+    :param max_retries: The number of retries after the first attempt
+    :param base_delay: The backoff ceiling for the first retry, doubled for every retry
+    :param max_delay: The largest backoff ceiling
+    """
+
+    def __init__(self, requests_per_second: float = 5, burst: int = 10, max_retries: int = 5,
+                 base_delay: float = 0.5, max_delay: float = 20):
+        self.bucket = TokenBucket(rate=requests_per_second, capacity=burst)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.stats = SchedulerStats()
+        self._condition = threading.Condition()
+        self._waiting: List[tuple] = []
+        self._tickets = itertools.count()
+
+    def _acquire(self, priority: int):
+        start = time.monotonic()
+        with self._condition:
+            ticket = (priority, next(self._tickets))
+            heapq.heappush(self._waiting, ticket)
+            while True:
+                if self._waiting[0] == ticket:
+                    if self.bucket.try_acquire():
+                        heapq.heappop(self._waiting)
+                        self._condition.notify_all()
+                        break
+                    self._condition.wait(timeout=self.bucket.time_until_available())
+                else:
+                    self._condition.wait()
+
+            waited = time.monotonic() - start
+            self.stats.requests += 1
+            self.stats.throttle_delay[priority] = self.stats.throttle_delay.get(priority, 0.0) + waited
+            self.stats.max_throttle_delay = max(self.stats.max_throttle_delay, waited)
+
+    def call(self, function: Callable, *args, priority: int = INTERACTIVE, **kwargs):
+        """
+        Call function(*args, **kwargs) within the rate limit, retrying retryable errors.
+        """
+        attempt = 0
+        while True:
+            self._acquire(priority)
+            try:
+                return function(*args, **kwargs)
+            except Exception as exc:
+                if getattr(exc, "status_code", None) == 429:
+                    with self._condition:
+                        self.stats.rate_limited += 1
+                if attempt >= self.max_retries or not is_retryable(exc):
+                    with self._condition:
+                        self.stats.failures += 1
+                    raise
+
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                retry_after = get_retry_after(exc)
+                if retry_after is not None:
+                    delay = max(delay, min(retry_after, self.max_delay))
+                attempt += 1
+                with self._condition:
+                    self.stats.retries += 1
+                    self.stats.backoff_delay += delay
+                logging.info(f"Retry {attempt}/{self.max_retries} of {getattr(function, '__qualname__', function)} "
+                             f"in {delay:.2f}s after: {exc}")
+                time.sleep(delay)
+
+
+_default_scheduler: RequestScheduler | None = None
+_default_scheduler_lock = threading.Lock()
+
+
+def get_default_scheduler() -> RequestScheduler:
+    """
+    The RequestScheduler shared by every OpenAIAssistant in the process.
+    """
+    global _default_scheduler
+    with _default_scheduler_lock:
+        if _default_scheduler is None:
+            _default_scheduler = RequestScheduler()
+        return _default_scheduler
@@ -0,0 +1,132 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+
+from openai_assistant import OpenAIAssistant, AssistantThreadMessage, RunEvent
+from tracing import STATUS_ERROR
+
+
+class RunHandle:
+    """
+    A prompt running on the RunExecutor.  The UI keeps the handle, and reads the events observed so far
+    without blocking.
+
+    Attributes:
+        user_prompt (str): The prompt that was submitted
+        cached_response (List[AssistantThreadMessage]): Set when the prompt was answered from the answer cache
+        error (Exception | None): The exception raised by the run, if any
+    """
+
+    def __init__(self, assistant: OpenAIAssistant, user_prompt: str):
+        self.assistant = assistant
+        self.user_prompt = user_prompt
+        self.cached_response: List[AssistantThreadMessage] = []
+        self.error: Exception | None = None
+        self.submitted_ns = time.time_ns()
+        self._events: List[RunEvent] = []
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._cancel_requested = threading.Event()
+
+    def add_event(self, event: RunEvent):
+        with self._lock:
+            self._events.append(event)
+
+    def get_events(self) -> List[RunEvent]:
+        """
+        A snapshot of every event observed so far, in order.
+        """
+        with self._lock:
+            return list(self._events)
+
+    def mark_done(self):
+        self._done.set()
+
+    def is_done(self) -> bool:
+        return self._done.is_set()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        return self._done.wait(timeout)
+
+    def cancel(self):
+        """
+        Ask for the run to be cancelled.  The worker cancels it through the runs cancel API and keeps following
+        it until OpenAI reports it as cancelled.
+        """
+        self._cancel_requested.set()
+
+    def is_cancel_requested(self) -> bool:
+        return self._cancel_requested.is_set()
+
+    def get_messages(self) -> List[AssistantThreadMessage]:
+        """
+        The conversation once the run is done.
+        """
+        if self.cached_response:
+            return self.cached_response
+        return self.assistant.message_history
+
+
+class RunExecutor:
+    """
+    Runs assistant prompts on a shared pool of worker threads, so the Streamlit script thread is never blocked
+    waiting for a run.
+
+    Usage:
+        handle = executor.submit(assistant, "What is the co2 value?")
+        ...
+        for event in handle.get_events():
+            ...
+
+    :param max_workers: The maximum number of runs followed at the same time
+    """
+
+    def __init__(self, max_workers: int = 8):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="assistant-run")
+
+    def submit(self, assistant: OpenAIAssistant, user_prompt: str, max_wait_time: int = 60,
+               on_done: Callable[[RunHandle], None] | None = None) -> RunHandle:
+        """
+        :param assistant: The assistant the prompt is submitted to
+        :param user_prompt: The user's prompt
+        :param max_wait_time: Wall clock seconds before the run is cancelled
+        :param on_done: Called on the worker thread when the run is done, whether it succeeded or not
+        :return: The handle for following the run
+        """
+        handle = RunHandle(assistant, user_prompt)
+        self._pool.submit(self._run, handle, max_wait_time, on_done)
+        return handle
+
+    @staticmethod
+    def _run(handle: RunHandle, max_wait_time: int, on_done: Callable[[RunHandle], None] | None):
+        assistant = handle.assistant
+        tracer = assistant.tracer
+        try:
+            with tracer.span("assistant_run", start_time_ns=handle.submitted_ns) as span:
+                # the time the prompt waited for a worker
+                tracer.record_span("queued", handle.submitted_ns, time.time_ns())
+                try:
+                    the_run = assistant.submit_user_prompt(handle.user_prompt, wait_for_completion=False)
+                    if the_run is None:
+                        handle.cached_response = assistant.cached_response
+                        return
+
+                    for event in assistant.iter_run_events(max_wait_time=max_wait_time,
+                                                           should_cancel=handle.is_cancel_requested):
+                        handle.add_event(event)
+                        if event.type in ("done", "timeout"):
+                            span.set_attribute("run_status", event.run.status if event.type == "done" else "timeout")
+                except Exception as exc:
+                    logging.exception(exc)
+                    handle.error = exc
+                    span.status_code = STATUS_ERROR
+                    span.status_message = str(exc)
+        finally:
+            handle.mark_done()
+            if on_done is not None:
+                on_done(handle)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
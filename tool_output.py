@@ -0,0 +1,249 @@
+import json
+import logging
+import threading
+from collections import deque
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List
+
+from conversation_context import estimate_tokens
+from databot_sensors import DATABOT_DECIMAL, get_column_units
+
+# the fields of each history point, in the order they are encoded
+HISTORY_POINT_FIELDS = ["start", "mean", "min", "max"]
+
+
+@dataclass
+class ToolOutputRecord:
+    """
+    The size of one function output sent to OpenAI.
+
+    Attributes:
+        function_name (str): The function that was called
+        budget_bytes (int): The byte budget of the output
+        output_bytes (int): The size of the compact json output before the budget was applied
+        encoded_bytes (int): The size of the output that was sent
+        estimated_tokens (int): The estimated tokens of the output that was sent
+        truncated (bool): True if the output was shortened to fit the budget
+    """
+    function_name: str
+    budget_bytes: int
+    output_bytes: int
+    encoded_bytes: int
+    estimated_tokens: int
+    truncated: bool
+
+
+def _to_number(value: Any) -> Any:
+    # the databot sends its values as strings
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            return value
+    return value
+
+
+def _merge_points(points: List[dict], size: int) -> List[dict]:
+    """
+    Merge consecutive history points into groups of `size` points, keeping the min, max and the count weighted mean.
+    """
+    merged = []
+    for i in range(0, len(points), size):
+        group = points[i:i + size]
+        count = sum(p.get("count", 1) for p in group)
+        merged.append({
+            "start": group[0]["start"],
+            "min": min(p["min"] for p in group),
+            "max": max(p["max"] for p in group),
+            "mean": sum(p["mean"] * p.get("count", 1) for p in group) / count,
+            "count": count
+        })
+    return merged
+
+
+class ToolOutputEncoder:
+    """
+    Encodes function outputs for the assistant as compact json within a byte budget.
+
+    Databot records are reduced to the requested columns with rounded values and their units, and history is
+    sent as a summary per column with a bounded number of points.  Outputs still over the budget are shortened:
+    history points are merged, trailing columns, keys and list items dropped, and text truncated.  The sizes of
+    every output are recorded.
+
+    :param max_bytes: The byte budget of an output.  About four bytes per token.
+    :param decimal: The number of decimal places of the values.  Matches DatabotConfig.decimal by default.
+    :param max_points: The maximum number of history points per column
+    :param history_size: The number of ToolOutputRecords kept
+    """
+
+    def __init__(self, max_bytes: int = 4096, decimal: int = DATABOT_DECIMAL, max_points: int = 24,
+                 history_size: int = 100):
+        self.max_bytes = max_bytes
+        self.decimal = decimal
+        self.max_points = max_points
+        self.units = get_column_units()
+        self.records: deque[ToolOutputRecord] = deque(maxlen=history_size)
+        self._lock = threading.Lock()
+
+    def round_value(self, value: Any) -> Any:
+        value = _to_number(value)
+        if isinstance(value, float):
+            return round(value, self.decimal)
+        return value
+
+    def encode_record(self, record: dict, columns: List[str]) -> dict:
+        """
+        The requested columns of a databot record, rounded, with their units.
+        """
+        values = {column: self.round_value(record[column]) for column in columns if column in record}
+        return {
+            "timestamp": _to_number(record.get("timestamp")),
+            "values": values,
+            "units": {column: self.units[column] for column in values if column in self.units}
+        }
+
+    def encode_latest(self, latest: dict, columns: List[str]) -> dict:
+        """
+        The requested columns of a /latest read of the databot web server, rounded, with their units and how old
+        they are.  Stale data is marked, so the assistant can tell the user without another call.
+        """
+        encoded = self.encode_record(dict(latest["values"], timestamp=latest.get("timestamp")), columns)
+        encoded["sample_age_s"] = latest.get("sample_age_s")
+        if latest.get("stale"):
+            encoded["stale"] = True
+            if latest.get("timestamp") is None:
+                encoded["stale_message"] = "No data has been received from the databot."
+            else:
+                encoded["stale_message"] = f"The latest databot data is {latest['sample_age_s']:.0f} seconds old."
+
+        max_age = latest.get("max_age_s")
+        if max_age is not None:
+            # columns that were not updated by the latest records
+            stale_columns = {column: age for column, age in latest.get("column_age_s", {}).items()
+                             if column in encoded["values"] and age > max_age}
+            if stale_columns:
+                encoded["stale_columns_age_s"] = stale_columns
+        return encoded
+
+    def encode_history(self, history: dict) -> dict:
+        """
+        A rollup query result as a summary per column, with at most max_points points per column.
+        Each point is a list of HISTORY_POINT_FIELDS.
+        """
+        columns = {}
+        for column, summary in history.get("columns", {}).items():
+            if not summary.get("count"):
+                columns[column] = {"count": 0}
+                continue
+            points = summary.get("points", [])
+            if len(points) > self.max_points:
+                points = _merge_points(points, -(-len(points) // self.max_points))
+            columns[column] = {
+                "min": self.round_value(summary["min"]),
+                "max": self.round_value(summary["max"]),
+                "mean": self.round_value(summary["mean"]),
+                "count": summary["count"],
+                "unit": self.units.get(column),
+                "points": points
+            }
+        return {
+            "tier_seconds": history.get("tier_seconds"),
+            "start": history.get("start"),
+            "end": history.get("end"),
+            "point_fields": HISTORY_POINT_FIELDS,
+            "columns": columns
+        }
+
+    def _dumps(self, output: Any) -> str:
+        if isinstance(output, str):
+            return output
+        if isinstance(output, dict) and "point_fields" in output:
+            # the points are kept as dicts until the output fits, so they can still be merged
+            output = dict(output, columns={
+                column: dict(summary, points=[[round(p["start"]), self.round_value(p["mean"]),
+                                               self.round_value(p["min"]), self.round_value(p["max"])]
+                                              for p in summary["points"]]) if "points" in summary else summary
+                for column, summary in output["columns"].items()
+            })
+        return json.dumps(output, separators=(",", ":"), ensure_ascii=False)
+
+    def _shrink(self, output: Any) -> Any:
+        """
+        A smaller version of the output, or None if it cannot be made smaller without truncating it.
+        """
+        if isinstance(output, dict) and "point_fields" in output:
+            columns = output["columns"]
+            if any(len(summary.get("points", [])) > 1 for summary in columns.values()):
+                return dict(output, columns={
+                    column: dict(summary, points=_merge_points(summary["points"], 2)) if "points" in summary
+                    else summary
+                    for column, summary in columns.items()
+                })
+            if len(columns) > 1:
+                return dict(output, columns=dict(list(columns.items())[:-1]))
+            return None
+        if isinstance(output, dict) and isinstance(output.get("values"), dict) and len(output["values"]) > 1:
+            # a databot record: drop the last column, with its unit and age
+            column = list(output["values"])[-1]
+            return {key: {k: v for k, v in value.items() if k != column} if isinstance(value, dict) else value
+                    for key, value in output.items()}
+        if isinstance(output, dict) and len(output) > 1:
+            return dict(list(output.items())[:-1])
+        if isinstance(output, list) and len(output) > 1:
+            return output[:-1]
+        return None
+
+    def _truncate(self, encoded: str, is_text: bool) -> str:
+        """
+        The first max_bytes of an encoded output.  Text is cut on a character boundary and marked, and json is
+        sent as the text of a json object, so the assistant knows the output is incomplete and it stays valid json.
+        """
+        if is_text:
+            marker = " ...[truncated]"
+            return encoded.encode("utf-8")[:self.max_bytes - len(marker)].decode("utf-8", errors="ignore") + marker
+
+        text = encoded
+        while True:
+            envelope = json.dumps({"truncated": True, "text": text}, separators=(",", ":"), ensure_ascii=False)
+            excess = len(envelope.encode("utf-8")) - self.max_bytes
+            if excess <= 0 or not text:
+                return envelope
+            text = text.encode("utf-8")[:-excess].decode("utf-8", errors="ignore")
+
+    def encode(self, function_name: str, output: Any) -> str:
+        """
+        The output of a function as compact json, or as is for text, within the byte budget.
+        """
+        encoded = self._dumps(output)
+        output_bytes = len(encoded.encode("utf-8"))
+        truncated = False
+
+        while len(encoded.encode("utf-8")) > self.max_bytes:
+            truncated = True
+            smaller = self._shrink(output)
+            if smaller is None:
+                encoded = self._truncate(encoded, is_text=isinstance(output, str))
+                break
+            output = smaller
+            # a shortened object says so, so the assistant knows the output is incomplete
+            encoded = self._dumps(dict(output, truncated=True) if isinstance(output, dict) else output)
+
+        encoded_bytes = len(encoded.encode("utf-8"))
+        record = ToolOutputRecord(function_name=function_name, budget_bytes=self.max_bytes,
+                                  output_bytes=output_bytes, encoded_bytes=encoded_bytes,
+                                  estimated_tokens=estimate_tokens(encoded), truncated=truncated)
+        with self._lock:
+            self.records.append(record)
+        if truncated:
+            logging.info(f"{function_name} output shortened from {output_bytes} to {encoded_bytes} bytes")
+        return encoded
+
+    def get_stats(self, recent: int = 5) -> Dict[str, Any]:
+        with self._lock:
+            records = list(self.records)
+        return {
+            "calls": len(records),
+            "encoded_bytes": sum(r.encoded_bytes for r in records),
+            "truncated": sum(r.truncated for r in records),
+            "recent": [asdict(r) for r in records[-recent:]]
+        }
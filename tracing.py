@@ -0,0 +1,229 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List
+
+# OpenTelemetry span status codes
+STATUS_UNSET = 0
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+
+@dataclass
+class Span:
+    """
+    A timed operation of a trace.  Times are epoch nanoseconds, as in OpenTelemetry.
+    """
+    name: str
+    trace_id: str
+    span_id: str
+    parent_span_id: str | None
+    start_time_ns: int
+    end_time_ns: int = 0
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    status_code: int = STATUS_UNSET
+    status_message: str = ""
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_time_ns - self.start_time_ns) / 1e6
+
+
+# the span of the current thread (or task) that new spans become children of
+_current_span: ContextVar[Span | None] = ContextVar("current_span", default=None)
+
+
+def _otlp_value(value: Any) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        # int64 values are strings in the OTLP json encoding
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _percentile(values: List[float], percentile: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(percentile / 100 * (len(values) - 1))))]
+
+
+class Tracer:
+    """
+    Records spans around the steps of an assistant run, so a slow answer can be attributed to queueing,
+    the model, a function call or the databot.
+
+    Spans started while another span is active on the same thread become its children.  A trace is complete
+    when its root span ends; the last max_traces traces are kept in memory, and, with an export path, each
+    trace is appended to the file as one line of OpenTelemetry (OTLP) json.
+
+    Usage:
+        with tracer.span("assistant_run", prompt_length=len(prompt)):
+            with tracer.span("get_run") as span:
+                span.set_attribute("run.status", the_run.status)
+
+    :param service_name: The service.name resource attribute of the exported spans
+    :param max_traces: The number of completed traces kept in memory
+    :param export_path: A json lines file each completed trace is appended to
+    """
+
+    def __init__(self, service_name: str = "databot-assistant", max_traces: int = 200, export_path: str | None = None):
+        self.service_name = service_name
+        self.export_path = export_path
+        self._open: Dict[str, List[Span]] = {}
+        self._traces: deque[List[Span]] = deque(maxlen=max_traces)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, start_time_ns: int | None = None, **attributes) -> Iterator[Span]:
+        """
+        Time the body of the with statement as a span.  An exception raised by the body marks the span as failed.
+
+        :param name: The span name
+        :param start_time_ns: The start of the span, if it started before the with statement, e.g. when the work
+                              was queued
+        :param attributes: The attributes of the span
+        """
+        span = self._new_span(name, start_time_ns if start_time_ns is not None else time.time_ns(), attributes)
+        if span.parent_span_id is None:
+            # the spans of a trace are collected from the moment its root span starts
+            with self._lock:
+                self._open[span.trace_id] = []
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as exc:
+            span.status_code = STATUS_ERROR
+            span.status_message = f"{type(exc).__name__}: {exc}"
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end_time_ns = time.time_ns()
+            self._finish(span)
+
+    def record_span(self, name: str, start_time_ns: int, end_time_ns: int, **attributes) -> Span:
+        """
+        Record a span that has already ended, as a child of the current span.
+        """
+        span = self._new_span(name, start_time_ns, attributes)
+        span.end_time_ns = end_time_ns
+        self._finish(span)
+        return span
+
+    @staticmethod
+    def _new_span(name: str, start_time_ns: int, attributes: dict) -> Span:
+        parent = _current_span.get()
+        return Span(
+            name=name,
+            trace_id=parent.trace_id if parent is not None else f"{random.getrandbits(128):032x}",
+            span_id=f"{random.getrandbits(64):016x}",
+            parent_span_id=parent.span_id if parent is not None else None,
+            start_time_ns=start_time_ns,
+            attributes=dict(attributes)
+        )
+
+    def _finish(self, span: Span):
+        with self._lock:
+            if span.parent_span_id is not None:
+                # spans that end after their trace was completed are dropped
+                if span.trace_id in self._open:
+                    self._open[span.trace_id].append(span)
+                return
+            trace = self._open.pop(span.trace_id, [])
+            trace.append(span)
+            self._traces.append(trace)
+
+        if self.export_path is not None:
+            try:
+                with open(self.export_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(self.to_otlp([trace])))
+                    f.write("\n")
+            except OSError as exc:
+                logging.warning(f"Could not export trace to {self.export_path}: {exc}")
+
+    def current_span(self) -> Span | None:
+        return _current_span.get()
+
+    def get_traces(self) -> List[List[Span]]:
+        """
+        The completed traces, oldest first.  The root span is the last span of each trace.
+        """
+        with self._lock:
+            return list(self._traces)
+
+    def to_otlp(self, traces: List[List[Span]] | None = None) -> dict:
+        """
+        The traces as an OTLP ExportTraceServiceRequest in its json encoding.
+        """
+        if traces is None:
+            traces = self.get_traces()
+        spans = []
+        for trace in traces:
+            for span in trace:
+                otlp_span = {
+                    "traceId": span.trace_id,
+                    "spanId": span.span_id,
+                    "name": span.name,
+                    "kind": 1,  # SPAN_KIND_INTERNAL
+                    "startTimeUnixNano": str(span.start_time_ns),
+                    "endTimeUnixNano": str(span.end_time_ns),
+                    "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in span.attributes.items()],
+                    "status": {"code": span.status_code, "message": span.status_message}
+                }
+                if span.parent_span_id is not None:
+                    otlp_span["parentSpanId"] = span.parent_span_id
+                spans.append(otlp_span)
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+                "scopeSpans": [{"scope": {"name": "databot-assistant"}, "spans": spans}]
+            }]
+        }
+
+    def summarize(self) -> Dict[str, Any]:
+        """
+        The count, mean, p95 and max duration in milliseconds per span name over the completed traces.
+        """
+        durations: Dict[str, List[float]] = {}
+        errors: Dict[str, int] = {}
+        for trace in self.get_traces():
+            for span in trace:
+                durations.setdefault(span.name, []).append(span.duration_ms)
+                if span.status_code == STATUS_ERROR:
+                    errors[span.name] = errors.get(span.name, 0) + 1
+        return {
+            name: {
+                "count": len(values),
+                "mean_ms": round(sum(values) / len(values), 1),
+                "p95_ms": round(_percentile(values, 95), 1),
+                "max_ms": round(max(values), 1),
+                "errors": errors.get(name, 0)
+            }
+            for name, values in durations.items()
+        }
+
+
+_tracer: Tracer | None = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer() -> Tracer:
+    """
+    The Tracer shared by every assistant in the process.  Set TRACE_EXPORT_PATH to export the traces to a file.
+    """
+    global _tracer
+    with _tracer_lock:
+        if _tracer is None:
+            _tracer = Tracer(export_path=os.getenv("TRACE_EXPORT_PATH"))
+        return _tracer